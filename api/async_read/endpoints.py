@@ -0,0 +1,251 @@
+"""Async routes for the read endpoints, same URLs and JSON as the blueprints, see asgi.py
+
+The SQL, the staging and the listing/profile caches are the blueprints' own, only the database
+round trips differ: they go through the aiomysql pool and never hold a thread while waiting. Each
+route records the request metrics, Server-Timing header and slow query log of its blueprint
+counterpart, under the same endpoint name.
+"""
+import json
+import time
+from datetime import date
+from decimal import Decimal
+from urllib.parse import quote
+from uuid import UUID
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Route, request_response
+from werkzeug.http import http_date
+from api.instruments.endpoints import (INSTRUMENTS_BY_USER_SQL, STREAM_BATCH_SIZE, STREAM_MAX_LIMIT, browse_query,
+                                       browse_response, instruments_by_user_response, _feed_position,
+                                       _stage_instrument)
+from api.loan.endpoints import (BORROWED_INSTRUMENTS_SQL, LOAN_LIST_SQL, MY_LOANS_SQL, REQUESTED_INSTRUMENTS_SQL,
+                                loan_list_response, loan_requests_response, my_loans_response)
+from api.profile.endpoints import PROFILE_COLUMNS, _stage_profile
+from helper.async_db_helper import async_db_cursor
+from helper.cache_helper import (listing_cache, profile_cache, INSTRUMENTS_BROWSE, INSTRUMENTS_BY_USER,
+                                 LOAN_REQUESTS, PROFILES)
+from helper.metrics_helper import finish_route_metrics, start_route_metrics
+from helper.pagination_helper import DEFAULT_LIMIT, MAX_LIMIT, encode_cursor, parse_cursor, parse_limit
+from helper.sql_timing_helper import finish_async_sql_timing, server_timing, start_async_sql_timing
+
+
+def _json_default(value):
+    """Same conversions as Flask's default JSON provider"""
+    if isinstance(value, date):
+        return http_date(value)
+    if isinstance(value, (Decimal, UUID)):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class FlaskJSONResponse(Response):
+    """JSON rendered byte for byte like flask.jsonify outside debug mode"""
+
+    media_type = 'application/json'
+
+    def render(self, content):
+        return (json.dumps(content, default=_json_default, sort_keys=True, separators=(',', ':'))
+                + "\n").encode('utf-8')
+
+
+def _respond(response):
+    """Response of a (body, status) tuple as built by the blueprints"""
+    return FlaskJSONResponse(response[0], status_code=response[1])
+
+
+def _int_arg(request, name):
+    """Query parameter as int, None when missing or invalid (request.args.get(name, type=int))"""
+    try:
+        return int(request.query_params[name])
+    except (KeyError, ValueError):
+        return None
+
+
+async def read_user(request):
+    """Async profile.read_user"""
+    user_id = request.path_params['user_id']
+    cache_key = (PROFILES, user_id, None)
+    profile = profile_cache.get(cache_key)
+    if not profile:
+        async with async_db_cursor(dictionary=True) as cursor:
+            await cursor.execute(f"SELECT {PROFILE_COLUMNS} FROM users WHERE user_id = %s", (user_id,))
+            profile = await cursor.fetchone()
+        if profile:
+            profile.pop('user_id')
+            profile_cache.set(cache_key, profile)
+
+    if not profile:
+        return _respond(({"message": "Failed", "description": "User not found"}, 404))
+
+    base_url = str(request.base_url)
+
+    def image_url(image_name, size=None):
+        return f"{base_url}static/img/{quote(image_name)}" + (f"?size={size}" if size else "")
+
+    return _respond(({"message": "OK", "data": _stage_profile(profile, image_url)}, 200))
+
+
+async def read_instruments_by_user(request):
+    """Async instruments.read_instruments_by_user"""
+    user_id = request.path_params['user_id']
+    cache_key = (INSTRUMENTS_BY_USER, user_id, None)
+    cached = listing_cache.get(cache_key)
+    if cached:
+        return _respond(cached)
+
+    async with async_db_cursor() as cursor:
+        await cursor.execute(INSTRUMENTS_BY_USER_SQL, (user_id,))
+        instruments_data = await cursor.fetchall()
+
+    response = instruments_by_user_response(instruments_data)
+    listing_cache.set(cache_key, response)
+    return _respond(response)
+
+
+async def read_instruments_by_availability_excluding_user(request):
+    """Async instruments.read_instruments_by_availability_excluding_user, format=ndjson included"""
+    exclude_user_id = request.path_params['exclude_user_id']
+    stream = request.query_params.get('format') == 'ndjson'
+    recommended = request.query_params.get('sort') == 'recommended'
+    try:
+        limit = parse_limit(request.query_params.get('limit'), None if stream else DEFAULT_LIMIT,
+                            STREAM_MAX_LIMIT if stream else MAX_LIMIT)
+    except ValueError:
+        return _respond(({"err_message": "limit must be a positive integer"}, 400))
+    try:
+        token = request.query_params.get('cursor')
+        position = parse_cursor(token) if token else None
+        after_id = int(position['after']) if position else 0
+        after_rank = int(position['rank']) if position and recommended else 0
+    except (KeyError, TypeError, ValueError):
+        return _respond(({"err_message": "Invalid cursor"}, 400))
+
+    query, values = browse_query(exclude_user_id, after_id, after_rank, limit, recommended,
+                                 _int_arg(request, 'instrument_type_id'), request.query_params.get('location'))
+
+    if stream:
+        return StreamingResponse(_stream_instruments(query, values, limit), media_type='application/x-ndjson')
+
+    # Raw query string, the same key the blueprint caches the page under
+    cache_key = (INSTRUMENTS_BROWSE, exclude_user_id, request.scope['query_string'])
+    cached = listing_cache.get(cache_key)
+    if cached:
+        return _respond(cached)
+
+    async with async_db_cursor() as cursor:
+        await cursor.execute(query, values)
+        instruments_data = await cursor.fetchall()
+
+    response = browse_response(instruments_data, limit, position)
+    listing_cache.set(cache_key, response)
+    return _respond(response)
+
+
+async def _stream_instruments(query, values, limit):
+    """Yield instruments as NDJSON lines straight from a server-side cursor"""
+    async with async_db_cursor(unbuffered=True) as cursor:
+        await cursor.execute(query, values)
+        sent = 0
+        last_row = None
+        while True:
+            rows = await cursor.fetchmany(STREAM_BATCH_SIZE)
+            if not rows:
+                break
+            for instrument in rows:
+                if limit is not None and sent == limit:
+                    # The extra row only tells us there is a next page
+                    yield json.dumps({"next_cursor": encode_cursor(_feed_position(last_row))}) + "\n"
+                    return
+                last_row = instrument
+                sent += 1
+                yield json.dumps(_stage_instrument(instrument), default=str) + "\n"
+
+
+async def get_loan_list(request):
+    """Async loan.get_loan_list"""
+    instrument_id = request.path_params['instrument_id']
+    async with async_db_cursor() as cursor:
+        await cursor.execute(LOAN_LIST_SQL, (instrument_id,))
+        list_request = await cursor.fetchall()
+    return _respond(loan_list_response(instrument_id, list_request))
+
+
+async def get_my_loans(request):
+    """Async loan.get_my_loans"""
+    requester_id = request.path_params['requester_id']
+    async with async_db_cursor() as cursor:
+        await cursor.execute(MY_LOANS_SQL, (requester_id, requester_id))
+        my_loans = await cursor.fetchall()
+    return _respond(my_loans_response(requester_id, my_loans))
+
+
+async def get_loan_requests(request):
+    """Async loan.get_loan_requests"""
+    requester_id = request.path_params['requester_id']
+    cache_key = (LOAN_REQUESTS, requester_id, None)
+    cached = listing_cache.get(cache_key)
+    if cached:
+        return _respond(cached)
+
+    async with async_db_cursor() as cursor:
+        await cursor.execute(REQUESTED_INSTRUMENTS_SQL, (requester_id,))
+        loanrequests_instruments = await cursor.fetchall()
+
+        await cursor.execute(BORROWED_INSTRUMENTS_SQL, (requester_id,))
+        loans_instruments = await cursor.fetchall()
+
+    response = loan_requests_response(requester_id, list(loanrequests_instruments), list(loans_instruments))
+    listing_cache.set(cache_key, response)
+    return _respond(response)
+
+
+class InstrumentedRoute:
+    """
+    ASGI app of an async handler recording what init_metrics and init_sql_timing record for its
+    Flask counterpart: the request metrics under the blueprint endpoint name, the Server-Timing
+    header and the slow query log. A streamed response is timed until its last line is sent.
+    """
+
+    def __init__(self, handler, endpoint):
+        self.app = request_response(handler)
+        self.endpoint = endpoint
+        self.blueprint = endpoint.split('.')[0]
+
+    async def __call__(self, scope, receive, send):
+        started = time.perf_counter()
+        metrics_started = start_route_metrics(self.blueprint, self.endpoint)
+        timings, token = start_async_sql_timing(self.endpoint)
+        # status 500 until the response starts, size None for a streamed body like response.is_streamed
+        sent = {"status": 500, "size": None}
+
+        async def send_with_timing(message):
+            if message['type'] == 'http.response.start':
+                headers = list(message.get('headers', []))
+                sent["status"] = message['status']
+                sent["size"] = next((int(value) for name, value in headers if name == b'content-length'), None)
+                headers.append((b'server-timing', server_timing(time.perf_counter() - started, timings).encode()))
+                message = {**message, 'headers': headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            finish_async_sql_timing(token)
+            finish_route_metrics(metrics_started, self.blueprint, self.endpoint, scope['method'],
+                                 sent["status"], sent["size"])
+
+
+def _route(path, handler, endpoint):
+    return Route(path, InstrumentedRoute(handler, endpoint), methods=['GET'], name=handler.__name__)
+
+
+routes = [
+    _route('/api/v1/profile/read/{user_id:int}', read_user, 'profile.read_user'),
+    _route('/api/v1/instruments/read_instruments_by_user/{user_id:int}', read_instruments_by_user,
+           'instruments.read_instruments_by_user'),
+    _route('/api/v1/instruments/read_instruments_by_availability_excluding_user/{exclude_user_id:int}',
+           read_instruments_by_availability_excluding_user,
+           'instruments.read_instruments_by_availability_excluding_user'),
+    _route('/api/v1/loan/loan_list/{instrument_id:int}', get_loan_list, 'loan.get_loan_list'),
+    _route('/api/v1/loan/my_loans/{requester_id:int}', get_my_loans, 'loan.get_my_loans'),
+    _route('/api/v1/loan/loan_requests/{requester_id:int}', get_loan_requests, 'loan.get_loan_requests'),
+]
@@ -1,12 +1,13 @@
 """Routes for module books"""
+from datetime import datetime, timezone
 from flask import Blueprint, jsonify, request
-from flask_jwt_extended import create_access_token, decode_token
-from flask_bcrypt import Bcrypt
+from flask_jwt_extended import create_access_token
+from flask_jwt_extended.config import config as jwt_config
 import base64
 
-from helper.db_helper import get_connection
+from helper.db_helper import db_cursor
+from helper.password_helper import PasswordHashBusy, hash_password, check_password, needs_rehash
 
-bcrypt = Bcrypt()
 auth_endpoints = Blueprint('auth', __name__)
 
 @auth_endpoints.route('/login', methods=['POST'])
@@ -18,24 +19,37 @@ def login():
     if not username or not password:
         return jsonify({"msg": "Username and password are required"}), 400
 
-    connection = get_connection()
-    cursor = connection.cursor(dictionary=True)
-    query = "SELECT * FROM users WHERE username = %s"
-    request_query = (username,)
-    cursor.execute(query, request_query)
-    user = cursor.fetchone()
-    cursor.close()
-    connection.close()
+    with db_cursor(dictionary=True) as cursor:
+        query = "SELECT * FROM users WHERE username = %s"
+        request_query = (username,)
+        cursor.execute(query, request_query)
+        user = cursor.fetchone()
 
-    if not user or not bcrypt.check_password_hash(user.get('password'), password):
-        return jsonify({"msg": "Bad username or password"}), 401
+    try:
+        if not user or not check_password(user.get('password'), password):
+            return jsonify({"msg": "Bad username or password"}), 401
 
-    user_id = user.get('user_id')  # Assuming the user_id field is present in the user record
+        user_id = user.get('user_id')  # Assuming the user_id field is present in the user record
+        if needs_rehash(user.get('password')):
+            # The work factor changed: upgrade the stored hash now that the plain password is known
+            new_hash = hash_password(password)
+            with db_cursor() as cursor:
+                cursor.execute("UPDATE users SET password = %s WHERE user_id = %s AND password = %s",
+                               (new_hash, user_id, user.get('password')))
+    except PasswordHashBusy:
+        return jsonify({"msg": "Too many login attempts in progress, try again"}), 503, {"Retry-After": "1"}
+
+    # Set exp ourselves instead of decoding the token we just signed
+    additional_claims = {'roles': user.get('roles')}
+    expires = None
+    # JWT_ACCESS_TOKEN_EXPIRES may be a timedelta or a number of seconds, access_expires is a timedelta or False
+    expires_delta = jwt_config.access_expires
+    if expires_delta:
+        expires = int((datetime.now(timezone.utc) + expires_delta).timestamp())
+        additional_claims['exp'] = expires
     access_token = create_access_token(
-        identity={'user_id': user_id, 'username': username}, additional_claims={'roles': user.get('roles')}
+        identity={'user_id': user_id, 'username': username}, additional_claims=additional_claims
     )
-    decoded_token = decode_token(access_token)
-    expires = decoded_token['exp']
     return jsonify({
         "access_token": access_token,
         "expires_in": expires,
@@ -52,25 +66,25 @@ def register():
     password = request.form['password']
 
     # Check if username already exists
-    connection = get_connection()
-    cursor = connection.cursor()
-    username_check_query = "SELECT * FROM users WHERE username = %s"
-    cursor.execute(username_check_query, (username,))
-    existing_user = cursor.fetchone()
+    with db_cursor() as cursor:
+        username_check_query = "SELECT * FROM users WHERE username = %s"
+        cursor.execute(username_check_query, (username,))
+        existing_user = cursor.fetchone()
     if existing_user:
-        cursor.close()
         return jsonify({"message": "Failed", "description": "Username already exists"}), 400
 
     # Hash password
-    hashed_password = bcrypt.generate_password_hash(password).decode('utf-8')
+    try:
+        hashed_password = hash_password(password)
+    except PasswordHashBusy:
+        return jsonify({"message": "Failed", "description": "Server busy, try again"}), 503, {"Retry-After": "1"}
 
     # Insert new user into database
-    insert_query = "INSERT INTO users (username, email, full_name, phone, password) VALUES (%s, %s, %s, %s, %s)"
-    request_insert = (username, email, full_name, phone, hashed_password)
-    cursor.execute(insert_query, request_insert)
-    connection.commit()
-    new_id = cursor.lastrowid
-    cursor.close()
+    with db_cursor() as cursor:
+        insert_query = "INSERT INTO users (username, email, full_name, phone, password) VALUES (%s, %s, %s, %s, %s)"
+        request_insert = (username, email, full_name, phone, hashed_password)
+        cursor.execute(insert_query, request_insert)
+        new_id = cursor.lastrowid
 
     if new_id:
         return jsonify({"message": "OK", "description": "User created", "username": username}), 201
@@ -2,6 +2,9 @@
 from flask import Blueprint, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from helper.jwt_helper import get_roles
+from helper.cache_helper import listing_cache
+from helper.db_helper import pool_stats
+from helper.image_gc import gc_stats
 
 
 
@@ -26,4 +29,24 @@ def get_data():
         "username": current_user['username'],
         "roles": roles,
     
-    }), 200
\ No newline at end of file
+    }), 200
+
+@protected_endpoints.route('/cache_stats', methods=['GET'])
+@jwt_required()
+def get_cache_stats():
+    """Hit, miss and eviction counters of the instrument listing cache"""
+    return jsonify({"message": "OK", "listing_cache": listing_cache.stats()}), 200
+
+
+@protected_endpoints.route('/pool_stats', methods=['GET'])
+@jwt_required()
+def get_pool_stats():
+    """Checkouts, wait time, in use and exhaustion counters of the DB connection pool"""
+    return jsonify({"message": "OK", "db_pool": pool_stats()}), 200
+
+
+@protected_endpoints.route('/gc_stats', methods=['GET'])
+@jwt_required()
+def get_gc_stats():
+    """Queued, scanned and removed images and bytes reclaimed by the image garbage collector"""
+    return jsonify({"message": "OK", "image_gc": gc_stats()}), 200
@@ -0,0 +1,31 @@
+"""Routes for the liveness and readiness probes"""
+import os
+from flask import Blueprint, jsonify
+from helper.db_helper import check_pool, get_pool_size, pool_stats
+
+health_endpoints = Blueprint('health', __name__)
+# Seconds /readyz waits for a pool connection, keep it below the probe timeout
+READY_POOL_TIMEOUT = float(os.environ.get('READY_POOL_TIMEOUT', 1))
+
+
+@health_endpoints.route('/healthz', methods=['GET'])
+def healthz():
+    """Liveness: the worker answers, the database is not checked"""
+    return jsonify({"status": "ok", "pid": os.getpid()}), 200
+
+
+@health_endpoints.route('/readyz', methods=['GET'])
+def readyz():
+    """Readiness: a pool connection is free within READY_POOL_TIMEOUT seconds and MySQL answers a ping"""
+    ready, reason = check_pool(READY_POOL_TIMEOUT)
+    stats = pool_stats()
+    body = {
+        "status": "ready" if ready else "unavailable",
+        "pid": os.getpid(),
+        "db_pool": {"pool_size": stats.get("pool_size", get_pool_size()), "in_use": stats["in_use"],
+                    "exhausted": stats["exhausted"]},
+    }
+    if not ready:
+        body["reason"] = reason
+        return jsonify(body), 503
+    return jsonify(body), 200
@@ -1,14 +1,48 @@
 """Routes for module books"""
-import os
-from flask import Blueprint, jsonify, request
-from helper.db_helper import get_connection
+import json
+from flask import Blueprint, jsonify, request, Response, stream_with_context
+from helper.cache_helper import (listing_cache, instrument_audience, invalidate_owner,
+                                 invalidate_instrument, INSTRUMENTS_BY_USER, INSTRUMENTS_BROWSE)
+from helper.db_helper import db_cursor, db_transaction
 from helper.form_validation import get_form_data
-import uuid
+from helper.geo_helper import covering_prefixes, location_columns, parse_coordinates, resolve_location
+from helper.image_helper import schedule_variants
+from helper.image_gc import queue_release
+from helper.image_storage import store_upload, add_ref, release_ref
+from helper.pagination_helper import DEFAULT_LIMIT, MAX_LIMIT, get_page_args, encode_cursor
+from helper.rating_helper import AVERAGE_RATING_SQL
+from helper.recommendation_helper import RECOMMENDATION_TOP_K, UNRANKED
+from helper.search_helper import MATCH_SQL, MIN_TERM_LENGTH, TYPE_NAME_SQL, boolean_query
+from helper.upload_helper import upload_limit
 
 instruments_endpoints = Blueprint('instruments', __name__)
-UPLOAD_FOLDER = "img"
+STREAM_MAX_LIMIT = 10000
+STREAM_BATCH_SIZE = 100
+NEARBY_DEFAULT_RADIUS_KM = 10
+NEARBY_MAX_RADIUS_KM = 500
+
+# Query instruments and join with instrument_type, average rating comes from the stored aggregates
+INSTRUMENTS_BY_USER_SQL = f"""
+    SELECT 
+            i.instrument_id, 
+            i.owner_id, 
+            u.username AS owner_username,
+            i.instrument_name, 
+            i.description, 
+            i.location, 
+            i.availability_status, 
+            i.image, 
+            i.instrument_type_id, 
+            it.name AS instrument_type,
+            {AVERAGE_RATING_SQL} AS average_rating
+        FROM instruments i
+        JOIN users u ON i.owner_id = u.user_id
+        JOIN instrument_type it ON i.instrument_type_id = it.id
+        WHERE i.owner_id = %s
+"""
 
 @instruments_endpoints.route('/add_instrument/<int:user_id>', methods=['POST'])
+@upload_limit('INSTRUMENT_IMAGE_MAX_BYTES')
 def add_instrument(user_id):
     """Route to add an instrument to the instruments table."""
     # Collect form data
@@ -22,29 +56,34 @@ def add_instrument(user_id):
     if not all([instrument_name, description, location, instrument_type_id, uploaded_file]):
         return jsonify({"message": "All fields are required."}), 400
 
+    # Coordinates sent by the client, otherwise looked up from the location text
+    try:
+        latitude, longitude, geohash = location_columns(location, request.form.get('latitude'),
+                                                        request.form.get('longitude'))
+    except ValueError:
+        return jsonify({"message": "Invalid latitude/longitude."}), 400
+
     # Save the uploaded image file
     if uploaded_file and uploaded_file.filename != '':
-        # Generate a unique filename for the uploaded image
-        unique_filename = str(uuid.uuid4())  # Generate a unique hash
-        file_extension = os.path.splitext(uploaded_file.filename)[1]  # Get the file extension
-        unique_filename += file_extension  # Combine hash and extension
-        file_path = os.path.join(UPLOAD_FOLDER, unique_filename)
-        uploaded_file.save(file_path)
+        # Store the image under its content hash, identical uploads share one file
+        image_key = store_upload(uploaded_file)
+        schedule_variants(image_key)
 
         # Insert the new instrument into the instruments table
-        connection = get_connection()
-        cursor = connection.cursor()
-        
-        insert_query = """
-            INSERT INTO instruments (owner_id, instrument_name, description, location, instrument_type_id, image)
-            VALUES (%s, %s, %s, %s, %s, %s)
-        """
-        cursor.execute(insert_query, (user_id, instrument_name, description, location, instrument_type_id, unique_filename))
-        connection.commit()
-        rows_affected = cursor.rowcount  # Get the number of rows affected by the insert
-        cursor.close()
+        with db_transaction() as cursor:
+            insert_query = f"""
+                INSERT INTO instruments (owner_id, instrument_name, description, location, instrument_type_id, image,
+                                         type_name, latitude, longitude, geohash)
+                VALUES (%s, %s, %s, %s, %s, %s, {TYPE_NAME_SQL}, %s, %s, %s)
+            """
+            cursor.execute(insert_query, (user_id, instrument_name, description, location, instrument_type_id, image_key,
+                                          instrument_type_id, latitude, longitude, geohash))
+            rows_affected = cursor.rowcount  # Get the number of rows affected by the insert
+            if rows_affected > 0:
+                add_ref(cursor, image_key)
 
         if rows_affected > 0:
+            invalidate_owner(user_id)
             return jsonify({"user_id": user_id, "message": "Instrument added successfully."}), 201
         else:
             return jsonify({"message": "Failed to add instrument."}), 500
@@ -52,6 +91,7 @@ def add_instrument(user_id):
         return jsonify({"message": "Image upload failed."}), 400
     
 @instruments_endpoints.route('/update_instrument/<int:instrument_id>', methods=['POST'])
+@upload_limit('INSTRUMENT_IMAGE_MAX_BYTES')
 def update_instrument(instrument_id):
     """Route to update an instrument in the instruments table."""
     # Collect optional parameters from the form
@@ -61,9 +101,13 @@ def update_instrument(instrument_id):
     instrument_type_id = request.form.get('instrument_type_id')
     uploaded_file = request.files.get('image')
     availability_status = request.form.get('availability_status')
-    print("tEst")
+    try:
+        coordinates = parse_coordinates(request.form.get('latitude'), request.form.get('longitude'))
+    except ValueError:
+        return jsonify({"message": "Invalid latitude/longitude."}), 400
     # Check if at least one field is provided for update
-    if not any([instrument_name, description, location, instrument_type_id, uploaded_file, availability_status]):
+    if not any([instrument_name, description, location, instrument_type_id, uploaded_file, availability_status,
+                coordinates]):
         return jsonify({"message": "No fields provided for update."}), 400
 
     fields_to_update = []
@@ -78,90 +122,94 @@ def update_instrument(instrument_id):
     if location:
         fields_to_update.append("location=%s")
         values_to_update.append(location)
+    if coordinates or location:
+        # A new location without coordinates is placed from the gazetteer, or unplaced when unknown
+        latitude, longitude, geohash = location_columns(location, *(coordinates or (None, None)))
+        fields_to_update.extend(["latitude=%s", "longitude=%s", "geohash=%s"])
+        values_to_update.extend([latitude, longitude, geohash])
     if instrument_type_id:
         fields_to_update.append("instrument_type_id=%s")
         values_to_update.append(instrument_type_id)
+        # Keep the searchable copy of the type name in sync
+        fields_to_update.append(f"type_name={TYPE_NAME_SQL}")
+        values_to_update.append(instrument_type_id)
     if availability_status:
         fields_to_update.append("availability_status=%s")
         values_to_update.append(availability_status)
 
-    connection = get_connection()
-    cursor = connection.cursor()
-
+    image_key = None
     if uploaded_file and uploaded_file.filename != '':
         try:
-            # Retrieve the current instrument image filename
-            cursor.execute("SELECT image FROM instruments WHERE instrument_id=%s", (instrument_id,))
-            current_image = cursor.fetchone()[0]
-
-            # Generate a unique filename for the new image
-            unique_filename = str(uuid.uuid4())  # Generate a unique hash
-            file_extension = os.path.splitext(uploaded_file.filename)[1].lower()  # Get the file extension
-            unique_filename += file_extension  # Combine hash and extension
-            file_path = os.path.join(UPLOAD_FOLDER, unique_filename)
-            uploaded_file.save(file_path)
+            # Store the new image under its content hash
+            image_key = store_upload(uploaded_file)
+            schedule_variants(image_key)
 
             fields_to_update.append("image=%s")
-            values_to_update.append(unique_filename)
-
-            # Delete the old image file if it exists
-            if current_image:
-                old_file_path = os.path.join(UPLOAD_FOLDER, current_image)
-                if os.path.exists(old_file_path):
-                    os.remove(old_file_path)
+            values_to_update.append(image_key)
 
         except Exception as e:
             return jsonify({"message": f"Error uploading image: {str(e)}"}), 500
 
-    if fields_to_update:
-        try:
+    if not fields_to_update:
+        return jsonify({"message": "No image uploaded."}), 400
+
+    released_image = None
+    try:
+        with db_transaction() as cursor:
+            if image_key:
+                # Lock the row so the old image is released exactly once
+                cursor.execute("SELECT image FROM instruments WHERE instrument_id=%s FOR UPDATE", (instrument_id,))
+                current = cursor.fetchone()
+
             update_query = f"UPDATE instruments SET {', '.join(fields_to_update)} WHERE instrument_id=%s"
             values_to_update.append(instrument_id)  # Add instrument_id to the end of the values list
 
             cursor.execute(update_query, values_to_update)
-            connection.commit()
             rows_affected = cursor.rowcount  # Get the number of rows affected by the update
-            cursor.close()
-
             if rows_affected > 0:
-                return jsonify({"instrument_id": instrument_id, "message": "Instrument updated successfully."}), 200
-            else:
-                return jsonify({"message": "Instrument not found or update failed."}), 404
+                if image_key:
+                    add_ref(cursor, image_key)
+                    if current and release_ref(cursor, current[0]):
+                        released_image = current[0]
+                audience = instrument_audience(cursor, instrument_id)
 
-        except Exception as e:
-            return jsonify({"message": f"Error updating instrument: {str(e)}"}), 500
+    except Exception as e:
+        return jsonify({"message": f"Error updating instrument: {str(e)}"}), 500
 
-    cursor.close()
-    return jsonify({"message": "No image uploaded."}), 400
+    if rows_affected > 0:
+        # The old image goes only once nothing references it anymore
+        if released_image:
+            queue_release(released_image)
+        invalidate_instrument(audience)
+        return jsonify({"instrument_id": instrument_id, "message": "Instrument updated successfully."}), 200
+    else:
+        return jsonify({"message": "Instrument not found or update failed."}), 404
 
 @instruments_endpoints.route('/delete_instrument/<int:instrument_id>', methods=['DELETE'])
 def delete_instrument(instrument_id):
     """Route to delete an instrument from the instruments table."""
-    connection = get_connection()
-    cursor = connection.cursor()
+    with db_transaction() as cursor:
+        # Retrieve the current instrument image filename
+        cursor.execute("SELECT image FROM instruments WHERE instrument_id=%s FOR UPDATE", (instrument_id,))
+        result = cursor.fetchone()
 
-    # Retrieve the current instrument image filename
-    cursor.execute("SELECT image FROM instruments WHERE instrument_id=%s", (instrument_id,))
-    result = cursor.fetchone()
-    
-    if not result:
-        cursor.close()
-        return jsonify({"message": "Instrument not found."}), 404
+        if not result:
+            return jsonify({"message": "Instrument not found."}), 404
 
-    current_image = result[0]
+        current_image = result[0]
+        audience = instrument_audience(cursor, instrument_id)
 
-    # Delete the instrument from the database
-    cursor.execute("DELETE FROM instruments WHERE instrument_id=%s", (instrument_id,))
-    connection.commit()
-    rows_affected = cursor.rowcount  # Get the number of rows affected by the delete
-    cursor.close()
+        # Delete the instrument from the database
+        cursor.execute("DELETE FROM instruments WHERE instrument_id=%s", (instrument_id,))
+        rows_affected = cursor.rowcount  # Get the number of rows affected by the delete
+        image_released = rows_affected > 0 and release_ref(cursor, current_image)
 
     if rows_affected > 0:
-        # Delete the image file if it exists
-        if current_image:
-            image_path = os.path.join(UPLOAD_FOLDER, current_image)
-            if os.path.exists(image_path):
-                os.remove(image_path)
+        invalidate_instrument(audience)
+
+        # Queue the image file for removal once nothing else references it
+        if image_released:
+            queue_release(current_image)
 
         return jsonify({"instrument_id": instrument_id, "message": "Instrument deleted successfully."}), 200
     else:
@@ -171,11 +219,37 @@ def delete_instrument(instrument_id):
 @instruments_endpoints.route('/read_instruments_by_user/<int:user_id>', methods=['GET'])
 def read_instruments_by_user(user_id):
     """Route to read instruments based on user_id."""
-    connection = get_connection()
-    cursor = connection.cursor()
+    cache_key = (INSTRUMENTS_BY_USER, user_id, None)
+    cached = listing_cache.get(cache_key)
+    if cached:
+        return jsonify(cached[0]), cached[1]
 
-    # Query instruments and join with instrument_type based on instrument_type_id and reviews for average rating
-    query = """
+    with db_cursor() as cursor:
+        cursor.execute(INSTRUMENTS_BY_USER_SQL, (user_id,))
+        instruments_data = cursor.fetchall()
+
+    response = instruments_by_user_response(instruments_data)
+    listing_cache.set(cache_key, response)
+    return jsonify(response[0]), response[1]
+
+
+def instruments_by_user_response(instruments_data):
+    """(body, status) of read_instruments_by_user, shared with the async read endpoints"""
+    staged_data = [_stage_instrument(instrument) for instrument in instruments_data]
+    if staged_data:
+        return {"instruments": staged_data}, 200
+    return {"message": "No instruments found for the user."}, 404
+
+
+@instruments_endpoints.route('/dashboard/<int:owner_id>', methods=['GET'])
+def read_owner_dashboard(owner_id):
+    """
+    Route to read everything the owner view shows in one call: the owner's instruments with their
+    rating aggregates, pending loan requests (with the requesters) and current loans.
+
+    Two queries on one connection, whatever the number of instruments.
+    """
+    instruments_query = f"""
         SELECT 
                 i.instrument_id, 
                 i.owner_id, 
@@ -187,51 +261,243 @@ def read_instruments_by_user(user_id):
                 i.image, 
                 i.instrument_type_id, 
                 it.name AS instrument_type,
-                COALESCE(AVG(r.rating), 0) AS average_rating
+                {AVERAGE_RATING_SQL} AS average_rating,
+                i.rating_count
             FROM instruments i
             JOIN users u ON i.owner_id = u.user_id
             JOIN instrument_type it ON i.instrument_type_id = it.id
-            LEFT JOIN reviews r ON i.instrument_id = r.instrument_id
             WHERE i.owner_id = %s
-            GROUP BY i.instrument_id, i.owner_id, u.username, i.instrument_name, i.description, 
-                     i.location, i.availability_status, i.image, i.instrument_type_id, it.name
+            ORDER BY i.instrument_id
     """
-    cursor.execute(query, (user_id,))
-    instruments_data = cursor.fetchall()
-
-    cursor.close()
-    connection.close()
+    # Requests and loans of all the owner's instruments at once, instead of one loan_list call each
+    activity_query = """
+        SELECT lr.instrument_id, 0 AS source, lr.request_id, u.user_id, u.full_name, u.phone,
+               lr.message, lr.request_date
+        FROM loanrequests lr
+        JOIN instruments i ON i.instrument_id = lr.instrument_id
+        JOIN users u ON u.user_id = lr.requester_id
+        WHERE i.owner_id = %s
+        UNION ALL
+        SELECT l.instrument_id, 1 AS source, NULL, u.user_id, u.full_name, u.phone,
+               NULL, l.loan_date
+        FROM loans l
+        JOIN instruments i ON i.instrument_id = l.instrument_id
+        JOIN users u ON u.user_id = l.borrower_id
+        WHERE i.owner_id = %s
+        ORDER BY 8
+    """
+    with db_cursor() as cursor:
+        cursor.execute(instruments_query, (owner_id,))
+        instruments_data = cursor.fetchall()
+        activity = []
+        if instruments_data:
+            cursor.execute(activity_query, (owner_id, owner_id))
+            activity = cursor.fetchall()
+
+    if not instruments_data:
+        return jsonify({"message": "No instruments found for the user."}), 404
 
-    # Stage the data
-    staged_data = []
+    staged = {}
     for instrument in instruments_data:
-        staged_data.append({
-            "instrument_id": instrument[0],
-            "owner_id": instrument[1],
-            "owner_username": instrument[2],
-            "instrument_name": instrument[3],
-            "description": instrument[4],
-            "location": instrument[5],
-            "availability_status": instrument[6],
-            "image": instrument[7],
-            "instrument_type_id": instrument[8],
-            "instrument_type": instrument[9],
-            "average_rating": (instrument[10])  # Ensure average_rating is converted to float
-        })
+        staged_instrument = _stage_instrument(instrument)
+        staged_instrument.update({"rating_count": instrument[11], "pending_request_count": 0,
+                                  "pending_requests": [], "current_loans": []})
+        staged[instrument[0]] = staged_instrument
+    for instrument_id, source, request_id, user_id, full_name, phone, message, date in activity:
+        staged_instrument = staged.get(instrument_id)
+        if staged_instrument is None:
+            continue
+        if source == 0:
+            staged_instrument["pending_requests"].append({
+                "request_id": request_id,
+                "user_id": user_id,
+                "full_name": full_name,
+                "phone": phone,
+                "message": message,
+                "request_date": date,
+            })
+            staged_instrument["pending_request_count"] += 1
+        else:
+            staged_instrument["current_loans"].append({
+                "user_id": user_id,
+                "full_name": full_name,
+                "phone": phone,
+                "loan_date": date,
+            })
 
-    if staged_data:
-        return jsonify({"instruments": staged_data}), 200
+    return jsonify({"owner_id": owner_id, "instruments": list(staged.values())}), 200
+
+
+def browse_query(exclude_user_id, after_id, after_rank, limit, recommended, instrument_type_id=None, location=None):
+    """
+    SQL and values of the browse feed page after (after_rank, after_id), shared with the async read endpoints.
+
+    Args:
+        limit (int): Page size, None for no limit (NDJSON streams). One extra row is selected.
+        recommended (bool): sort=recommended, order by the user's recommendation position first.
+
+    Returns:
+        tuple: (query, values)
+    """
+    filters = ["i.availability_status IN (1, 2)", "i.owner_id != %s", "lr.instrument_id IS NULL"]
+    filter_values = [exclude_user_id]
+    if instrument_type_id is not None:
+        filters.append("i.instrument_type_id = %s")
+        filter_values.append(instrument_type_id)
+    if location:
+        filters.append("i.location LIKE %s")
+        filter_values.append(location.replace('%', r'\%').replace('_', r'\_') + '%')
+
+    columns = f"""
+            i.instrument_id, 
+            i.owner_id, 
+            u.username AS owner_username,
+            i.instrument_name, 
+            i.description, 
+            i.location, 
+            i.availability_status, 
+            i.image, 
+            i.instrument_type_id, 
+            it.name AS instrument_type,
+            {AVERAGE_RATING_SQL} AS average_rating"""
+    joins = """
+        JOIN instrument_type it ON i.instrument_type_id = it.id
+        JOIN users u ON i.owner_id = u.user_id
+        LEFT JOIN loanrequests lr ON i.instrument_id = lr.instrument_id AND lr.requester_id = %s"""
+    # Fetch one extra row to know whether another page exists
+    page_limit = "" if limit is None else " LIMIT %s"
+    page_values = [] if limit is None else [limit + 1]
+
+    if recommended:
+        # Keyset on (recommendation position, instrument_id), unranked instruments come last at UNRANKED.
+        # Each half reads its page in index order (recommendations primary key, instruments primary key),
+        # only the two pages are sorted together instead of the whole feed
+        query = f"""
+            SELECT * FROM (
+                (SELECT {columns}, rec.position AS rank_key
+                FROM recommendations rec
+                JOIN instruments i ON i.instrument_id = rec.instrument_id
+                {joins}
+                WHERE rec.user_id = %s AND rec.position > %s AND {' AND '.join(filters)}
+                ORDER BY rec.position{page_limit})
+                UNION ALL
+                (SELECT {columns}, {UNRANKED} AS rank_key
+                FROM instruments i
+                {joins}
+                LEFT JOIN recommendations rec ON rec.user_id = %s AND rec.instrument_id = i.instrument_id
+                WHERE rec.instrument_id IS NULL AND i.instrument_id > %s AND {' AND '.join(filters)}
+                ORDER BY i.instrument_id{page_limit})
+            ) feed
+            ORDER BY rank_key, instrument_id{page_limit}
+        """
+        # Past the ranked rows every unranked row is next, within them only the higher ids
+        after_unranked_id = after_id if after_rank >= UNRANKED else 0
+        values = ([exclude_user_id, exclude_user_id, after_rank] + filter_values + page_values
+                  + [exclude_user_id, exclude_user_id, after_unranked_id] + filter_values + page_values
+                  + page_values)
     else:
-        return jsonify({"message": "No instruments found for the user."}), 404
+        query = f"""
+            SELECT {columns}
+            FROM instruments i
+            {joins}
+            WHERE {' AND '.join(filters)} AND i.instrument_id > %s
+            ORDER BY i.instrument_id{page_limit}
+        """
+        values = [exclude_user_id] + filter_values + [after_id] + page_values
+    return query, values
+
 
 @instruments_endpoints.route('/read_instruments_by_availability_excluding_user/<int:exclude_user_id>', methods=['GET'])
 def read_instruments_by_availability_excluding_user(exclude_user_id):
-    """Route to read instruments based on availability status, excluding instruments of a specified user and those already requested by that user."""
+    """
+    Route to read instruments based on availability status, excluding instruments of a specified user and those already requested by that user.
+
+    Keyset paginated on instrument_id with the `limit` and `cursor` query parameters, optionally filtered
+    by `instrument_type_id` and `location` (prefix match). `format=ndjson` streams one instrument per line.
+    `sort=recommended` puts the user's precomputed recommendations first, in their order.
+    """
+    stream = request.args.get('format') == 'ndjson'
+    recommended = request.args.get('sort') == 'recommended'
+    limit, position = get_page_args(default_limit=None if stream else DEFAULT_LIMIT,
+                                    max_limit=STREAM_MAX_LIMIT if stream else MAX_LIMIT)
+    try:
+        after_id = int(position['after']) if position else 0
+        after_rank = int(position['rank']) if position and recommended else 0
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"err_message": "Invalid cursor"}), 400
+
+    query, values = browse_query(exclude_user_id, after_id, after_rank, limit, recommended,
+                                 request.args.get('instrument_type_id', type=int), request.args.get('location'))
+
+    if stream:
+        return Response(stream_with_context(_stream_instruments(query, values, limit)),
+                        mimetype='application/x-ndjson')
 
-    connection = get_connection()
-    cursor = connection.cursor()
+    cache_key = (INSTRUMENTS_BROWSE, exclude_user_id, request.query_string)
+    cached = listing_cache.get(cache_key)
+    if cached:
+        return jsonify(cached[0]), cached[1]
 
-    query = """
+    with db_cursor() as cursor:
+        cursor.execute(query, values)
+        instruments_data = cursor.fetchall()
+
+    response = browse_response(instruments_data, limit, position)
+    listing_cache.set(cache_key, response)
+    return jsonify(response[0]), response[1]
+
+
+def browse_response(instruments_data, limit, position):
+    """(body, status) of a browse feed page fetched with browse_query, shared with the async read endpoints"""
+    next_cursor = None
+    if len(instruments_data) > limit:
+        instruments_data = instruments_data[:limit]
+        next_cursor = encode_cursor(_feed_position(instruments_data[-1]))
+
+    staged_data = [_stage_instrument(instrument) for instrument in instruments_data]
+
+    if staged_data or position:
+        return {"instruments": staged_data, "next_cursor": next_cursor}, 200
+    return {"message": "No instruments found with the specified availability status."}, 400
+
+
+@instruments_endpoints.route('/nearby/<int:exclude_user_id>', methods=['GET'])
+def read_instruments_nearby(exclude_user_id):
+    """
+    Route to read the available instruments closest to a point, nearest first.
+
+    The point is `lat`/`lon`, or a `location` resolved from the gazetteer. Returns up to `limit`
+    instruments within `radius_km`, with the same availability, own and already requested
+    filters as the browse feed, optionally filtered by `instrument_type_id`.
+    """
+    try:
+        origin = parse_coordinates(request.args.get('lat'), request.args.get('lon'))
+    except ValueError:
+        return jsonify({"err_message": "Invalid lat/lon"}), 400
+    origin = origin or resolve_location(request.args.get('location'))
+    if origin is None:
+        return jsonify({"err_message": "lat and lon, or a known location, are required"}), 400
+    radius_km = request.args.get('radius_km', NEARBY_DEFAULT_RADIUS_KM, type=float)
+    if not 0 < radius_km <= NEARBY_MAX_RADIUS_KM:
+        return jsonify({"err_message": f"radius_km must be between 0 and {NEARBY_MAX_RADIUS_KM}"}), 400
+    limit, _ = get_page_args()
+
+    # The geohash prefixes narrow the rows to a few index ranges, the exact distance filters and sorts them
+    prefixes = covering_prefixes(origin[0], origin[1], radius_km)
+    distance_sql = "ST_Distance_Sphere(POINT(i.longitude, i.latitude), POINT(%s, %s)) / 1000"
+    conditions = ["(" + " OR ".join(["i.geohash LIKE %s"] * len(prefixes)) + ")",
+                  "i.availability_status IN (1, 2)", "i.owner_id != %s", "lr.instrument_id IS NULL",
+                  f"{distance_sql} <= %s"]
+    values = [origin[1], origin[0], exclude_user_id]
+    values.extend(prefix + '%' for prefix in prefixes)
+    values.extend([exclude_user_id, origin[1], origin[0], radius_km])
+    instrument_type_id = request.args.get('instrument_type_id', type=int)
+    if instrument_type_id is not None:
+        conditions.append("i.instrument_type_id = %s")
+        values.append(instrument_type_id)
+    values.append(limit)
+
+    query = f"""
         SELECT 
             i.instrument_id, 
             i.owner_id, 
@@ -243,41 +509,181 @@ def read_instruments_by_availability_excluding_user(exclude_user_id):
             i.image, 
             i.instrument_type_id, 
             it.name AS instrument_type,
-            COALESCE(AVG(r.rating), 0) AS average_rating
+            {AVERAGE_RATING_SQL} AS average_rating,
+            {distance_sql} AS distance_km
         FROM instruments i
         JOIN instrument_type it ON i.instrument_type_id = it.id
-        LEFT JOIN reviews r ON i.instrument_id = r.instrument_id
         JOIN users u ON i.owner_id = u.user_id
         LEFT JOIN loanrequests lr ON i.instrument_id = lr.instrument_id AND lr.requester_id = %s
-        WHERE i.availability_status IN (1, 2) AND i.owner_id != %s
-        AND lr.instrument_id IS NULL
-        GROUP BY i.instrument_id, i.owner_id, u.username, i.instrument_name, i.description, 
-                 i.location, i.availability_status, i.image, i.instrument_type_id, it.name
+        WHERE {' AND '.join(conditions)}
+        ORDER BY distance_km, i.instrument_id
+        LIMIT %s
     """
-    cursor.execute(query, (exclude_user_id, exclude_user_id))
+    with db_cursor() as cursor:
+        cursor.execute(query, values)
+        instruments_data = cursor.fetchall()
+
+    staged_data = []
+    for instrument in instruments_data:
+        staged = _stage_instrument(instrument)
+        staged["distance_km"] = round(instrument[11], 3)
+        staged_data.append(staged)
+    return jsonify({"origin": {"lat": origin[0], "lon": origin[1]}, "radius_km": radius_km,
+                    "instruments": staged_data}), 200
 
-    instruments_data = cursor.fetchall()
 
-    cursor.close()
-    connection.close()
+@instruments_endpoints.route('/recommended/<int:user_id>', methods=['GET'])
+def read_recommended_instruments(user_id):
+    """
+    Route to read the instruments recommended to a user, best first.
+
+    Served from the list precomputed by `flask build-recommendations`, up to `limit` entries;
+    instruments lent out or requested by the user since the last build are skipped.
+    """
+    limit, _ = get_page_args(default_limit=20, max_limit=RECOMMENDATION_TOP_K)
+    query = f"""
+        SELECT 
+            i.instrument_id, 
+            i.owner_id, 
+            u.username AS owner_username,
+            i.instrument_name, 
+            i.description, 
+            i.location, 
+            i.availability_status, 
+            i.image, 
+            i.instrument_type_id, 
+            it.name AS instrument_type,
+            {AVERAGE_RATING_SQL} AS average_rating,
+            rec.score
+        FROM recommendations rec
+        JOIN instruments i ON i.instrument_id = rec.instrument_id
+        JOIN instrument_type it ON i.instrument_type_id = it.id
+        JOIN users u ON i.owner_id = u.user_id
+        LEFT JOIN loanrequests lr ON i.instrument_id = lr.instrument_id AND lr.requester_id = rec.user_id
+        WHERE rec.user_id = %s AND i.availability_status IN (1, 2) AND lr.instrument_id IS NULL
+        ORDER BY rec.position
+        LIMIT %s
+    """
+    with db_cursor() as cursor:
+        cursor.execute(query, (user_id, limit))
+        instruments_data = cursor.fetchall()
 
     staged_data = []
     for instrument in instruments_data:
-        staged_data.append({
-            "instrument_id": instrument[0],
-            "owner_id": instrument[1],
-            "owner_username": instrument[2],
-            "instrument_name": instrument[3],
-            "description": instrument[4],
-            "location": instrument[5],
-            "availability_status": instrument[6],
-            "image": instrument[7],
-            "instrument_type_id": instrument[8],
-            "instrument_type": instrument[9],
-            "average_rating": instrument[10]
-        })
+        staged = _stage_instrument(instrument)
+        staged["score"] = instrument[11]
+        staged_data.append(staged)
+    return jsonify({"user_id": user_id, "instruments": staged_data}), 200
 
-    if staged_data:
-        return jsonify({"instruments": staged_data}), 200
-    else:
-        return jsonify({"message": "No instruments found with the specified availability status."}), 400
+
+@instruments_endpoints.route('/search', methods=['GET'])
+def search_instruments():
+    """
+    Route to search instruments by name, description, location and type name, best match first.
+
+    Every word of `q` is required and matches as a prefix, `instrument_type_id` filters by type.
+    Keyset paginated on (score, instrument_id) with the `limit` and `cursor` query parameters.
+    """
+    match_query = boolean_query(request.args.get('q', ''))
+    if not match_query:
+        return jsonify({"err_message": f"q needs a word of at least {MIN_TERM_LENGTH} characters"}), 400
+    limit, position = get_page_args()
+
+    conditions = [MATCH_SQL]
+    values = [match_query, match_query]
+    instrument_type_id = request.args.get('instrument_type_id', type=int)
+    if instrument_type_id is not None:
+        conditions.append("i.instrument_type_id = %s")
+        values.append(instrument_type_id)
+    if position:
+        try:
+            after_score = float(position['score'])
+            after_id = int(position['after'])
+        except (KeyError, TypeError, ValueError):
+            return jsonify({"err_message": "Invalid cursor"}), 400
+        conditions.append(f"({MATCH_SQL} < %s OR ({MATCH_SQL} = %s AND i.instrument_id < %s))")
+        values.extend([match_query, after_score, match_query, after_score, after_id])
+    values.append(limit + 1)
+
+    # The FULLTEXT index finds the matches, the joins only run for the page being returned
+    query = f"""
+        SELECT 
+            i.instrument_id, 
+            i.owner_id, 
+            u.username AS owner_username,
+            i.instrument_name, 
+            i.description, 
+            i.location, 
+            i.availability_status, 
+            i.image, 
+            i.instrument_type_id, 
+            it.name AS instrument_type,
+            {AVERAGE_RATING_SQL} AS average_rating,
+            {MATCH_SQL} AS score
+        FROM instruments i
+        JOIN instrument_type it ON i.instrument_type_id = it.id
+        JOIN users u ON i.owner_id = u.user_id
+        WHERE {' AND '.join(conditions)}
+        ORDER BY score DESC, i.instrument_id DESC
+        LIMIT %s
+    """
+    with db_cursor() as cursor:
+        cursor.execute(query, values)
+        instruments_data = cursor.fetchall()
+
+    next_cursor = None
+    if len(instruments_data) > limit:
+        instruments_data = instruments_data[:limit]
+        next_cursor = encode_cursor({"score": instruments_data[-1][11], "after": instruments_data[-1][0]})
+
+    staged_data = []
+    for instrument in instruments_data:
+        staged = _stage_instrument(instrument)
+        staged["score"] = instrument[11]
+        staged_data.append(staged)
+    return jsonify({"instruments": staged_data, "next_cursor": next_cursor}), 200
+
+
+def _stream_instruments(query, values, limit):
+    """Yield instruments as NDJSON lines straight from an unbuffered (server-side) cursor"""
+    # db_cursor drains what the client did not read so the connection goes back to the pool clean
+    with db_cursor() as cursor:
+        cursor.execute(query, values)
+        sent = 0
+        last_row = None
+        while True:
+            rows = cursor.fetchmany(STREAM_BATCH_SIZE)
+            if not rows:
+                break
+            for instrument in rows:
+                if limit is not None and sent == limit:
+                    # The extra row only tells us there is a next page
+                    yield json.dumps({"next_cursor": encode_cursor(_feed_position(last_row))}) + "\n"
+                    return
+                last_row = instrument
+                sent += 1
+                yield json.dumps(_stage_instrument(instrument), default=str) + "\n"
+
+
+def _feed_position(instrument):
+    """Keyset position of a browse feed row, the rank_key column is only selected for sort=recommended"""
+    if len(instrument) > 11:
+        return {"rank": instrument[11], "after": instrument[0]}
+    return {"after": instrument[0]}
+
+
+def _stage_instrument(instrument):
+    """Stage an instrument listing row into its JSON shape"""
+    return {
+        "instrument_id": instrument[0],
+        "owner_id": instrument[1],
+        "owner_username": instrument[2],
+        "instrument_name": instrument[3],
+        "description": instrument[4],
+        "location": instrument[5],
+        "availability_status": instrument[6],
+        "image": instrument[7],
+        "instrument_type_id": instrument[8],
+        "instrument_type": instrument[9],
+        "average_rating": instrument[10]
+    }
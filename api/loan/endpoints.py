@@ -1,13 +1,97 @@
-"""Routes for module books"""
-import os
+"""Routes for module loan"""
 from flask import Blueprint, jsonify, request
-from helper.db_helper import get_connection
-from helper.form_validation import get_form_data
+from helper.cache_helper import (listing_cache, instrument_audience, invalidate_instrument, invalidate_requesters,
+                                 LOAN_REQUESTS)
+from helper.db_helper import db_cursor, db_transaction
+from helper.loan_helper import (create_loan_request, accept_loan, return_loan, REQUEST_CREATED, REQUEST_DUPLICATE,
+                                REQUEST_OWN_INSTRUMENT, REQUEST_INSTRUMENT_NOT_FOUND, REQUEST_REQUESTER_NOT_FOUND,
+                                LOAN_ACCEPTED, LOAN_RETURNED, LOAN_INSTRUMENT_NOT_FOUND, LOAN_ALREADY_ON_LOAN,
+                                LOAN_NOT_REQUESTED, LOAN_NOT_ON_LOAN)
+from helper.rating_helper import AVERAGE_RATING_SQL
 from datetime import datetime
-import uuid
 
 loan_endpoints = Blueprint('loan', __name__)
-UPLOAD_FOLDER = "img"
+LOAN_REQUEST_REJECTIONS = {
+    REQUEST_DUPLICATE: ("You have already requested this instrument.", 400),
+    REQUEST_OWN_INSTRUMENT: ("You cannot loan your own instrument.", 400),
+    REQUEST_INSTRUMENT_NOT_FOUND: ("Instrument not found.", 404),
+    REQUEST_REQUESTER_NOT_FOUND: ("Requester not found.", 404),
+}
+LOAN_REJECTIONS = {
+    LOAN_INSTRUMENT_NOT_FOUND: ("Instrument not found.", 404),
+    LOAN_ALREADY_ON_LOAN: ("Instrument is already on loan.", 409),
+    LOAN_NOT_REQUESTED: ("This user has not requested the instrument.", 404),
+    LOAN_NOT_ON_LOAN: ("Instrument is not on loan.", 409),
+}
+
+LOAN_LIST_SQL = """
+    SELECT * FROM `loanrequests` INNER JOIN users ON users.user_id = loanrequests.requester_id WHERE instrument_id = %s
+"""
+
+# Instruments requested (source 0) and borrowed (source 1) by a user, for my_loans
+MY_LOANS_SQL = """
+    SELECT a.request_date,
+        b.location,
+        c.full_name,
+        c.phone,
+        0 AS source
+    FROM loanrequests a
+    INNER JOIN instruments b ON b.instrument_id = a.instrument_id
+    INNER JOIN users c ON c.user_id = b.owner_id
+    WHERE a.requester_id = %s
+    UNION ALL
+    SELECT a.loan_date,
+        b.location,
+        c.full_name,
+        c.phone,
+        1 AS source
+    FROM loans a
+    INNER JOIN instruments b ON b.instrument_id = a.instrument_id
+    INNER JOIN users c ON c.user_id = b.owner_id
+    WHERE a.borrower_id = %s;
+"""
+
+# Instruments requested by a user, from loanrequests
+REQUESTED_INSTRUMENTS_SQL = f"""
+    SELECT 
+        i.instrument_id, 
+        i.owner_id, 
+        u.username AS owner_username, 
+        i.instrument_name, 
+        i.description, 
+        i.location, 
+        i.availability_status, 
+        i.image, 
+        i.instrument_type_id, 
+        it.name AS instrument_type, 
+        {AVERAGE_RATING_SQL} AS average_rating
+    FROM loanrequests lr
+    JOIN instruments i ON lr.instrument_id = i.instrument_id
+    JOIN users u ON i.owner_id = u.user_id
+    JOIN instrument_type it ON i.instrument_type_id = it.id
+    WHERE lr.requester_id = %s
+"""
+
+# Instruments borrowed by a user, from loans where instruments.instrument_id = loans.instrument_id
+BORROWED_INSTRUMENTS_SQL = f"""
+    SELECT 
+        i.instrument_id, 
+        i.owner_id, 
+        u.username AS owner_username, 
+        i.instrument_name, 
+        i.description, 
+        i.location, 
+        i.availability_status, 
+        i.image, 
+        i.instrument_type_id, 
+        it.name AS instrument_type, 
+        {AVERAGE_RATING_SQL} AS average_rating
+    FROM loans l
+    JOIN instruments i ON l.instrument_id = i.instrument_id
+    JOIN users u ON i.owner_id = u.user_id
+    JOIN instrument_type it ON i.instrument_type_id = it.id
+    WHERE l.borrower_id = %s
+"""
 
 @loan_endpoints.route('/request_loan/<int:requester_id>', methods=['POST'])
 def request_loan(requester_id):
@@ -20,71 +104,34 @@ def request_loan(requester_id):
     if not all([instrument_id, message]):
         return jsonify({"message": "All fields are required."}), 400
 
-    # Get the current date and time
-    request_date = datetime.now()
+    with db_cursor() as cursor:
+        outcome = create_loan_request(cursor, instrument_id, requester_id, message)
 
-    # Get the instrument owner_id to ensure requester is not the owner
-    connection = get_connection()
-    cursor = connection.cursor()
-
-    select_query = "SELECT owner_id FROM instruments WHERE instrument_id = %s"
-    cursor.execute(select_query, (instrument_id,))
-    instrument = cursor.fetchone()
-
-    if not instrument:
-        cursor.close()
-        return jsonify({"message": "Instrument not found."}), 404
-
-    owner_id = instrument[0]
-
-    if requester_id == owner_id:
-        cursor.close()
-        return jsonify({"message": "You cannot loan your own instrument."}), 400
-
-    # Check if the requester has already requested this instrument
-    duplicate_check_query = """
-        SELECT COUNT(*) FROM loanrequests
-        WHERE instrument_id = %s AND requester_id = %s
-    """
-    cursor.execute(duplicate_check_query, (instrument_id, requester_id))
-    duplicate_count = cursor.fetchone()[0]
-
-    if duplicate_count > 0:
-        cursor.close()
-        return jsonify({"message": "You have already requested this instrument."}), 400
-
-    # Insert the new loan request into the loanrequests table
-    insert_query = """
-        INSERT INTO loanrequests (instrument_id, requester_id, request_date, message)
-        VALUES (%s, %s, %s, %s)
-    """
-    cursor.execute(insert_query, (instrument_id, requester_id, request_date, message))
-    connection.commit()
-    rows_affected = cursor.rowcount  # Get the number of rows affected by the insert
-    cursor.close()
-
-    if rows_affected > 0:
+    if outcome == REQUEST_CREATED:
+        invalidate_requesters([requester_id])
         return jsonify({"requester_id": requester_id, "message": "Loan request submitted successfully."}), 201
-    else:
-        return jsonify({"message": "Failed to submit loan request."}), 500
+    return _loan_request_rejected(outcome)
+
+
+def _loan_request_rejected(outcome):
+    """Response for a loan request that create_loan_request did not insert"""
+    message, status = LOAN_REQUEST_REJECTIONS[outcome]
+    return jsonify({"message": message, "reason": outcome}), status
     
 
 # delete all requested instrument on list
 @loan_endpoints.route('/delete_loan_request/<int:instrument_id>', methods=['DELETE'])
 def delete_loan_requests(instrument_id):
     """Route to cancel a loan request."""
-    # Connect to the database
-    connection = get_connection()
-    cursor = connection.cursor()
-
-    # Delete the loan request
-    delete_query = "DELETE FROM loanrequests WHERE instrument_id = %s"
-    cursor.execute(delete_query, (instrument_id,))
-    connection.commit()
-    rows_affected = cursor.rowcount  # Get the number of rows affected by the delete operation
-    cursor.close()
+    with db_cursor() as cursor:
+        # Delete the loan request
+        _, requester_ids = instrument_audience(cursor, instrument_id)
+        delete_query = "DELETE FROM loanrequests WHERE instrument_id = %s"
+        cursor.execute(delete_query, (instrument_id,))
+        rows_affected = cursor.rowcount  # Get the number of rows affected by the delete operation
 
     if rows_affected > 0:
+        invalidate_requesters(requester_ids)
         return jsonify({"message": "Loan request cancelled successfully."}), 200
     else:
         return jsonify({"message": "Failed to cancel loan request."}), 500
@@ -93,18 +140,15 @@ def delete_loan_requests(instrument_id):
 @loan_endpoints.route('/delete_loan/<int:instrument_id>', methods=['DELETE'])
 def delete_loan(instrument_id):
     """Route to cancel a loan request."""
-    # Connect to the database
-    connection = get_connection()
-    cursor = connection.cursor()
-
-    # Delete the loan request
-    delete_query = "DELETE FROM loans WHERE instrument_id = %s"
-    cursor.execute(delete_query, (instrument_id,))
-    connection.commit()
-    rows_affected = cursor.rowcount  # Get the number of rows affected by the delete operation
-    cursor.close()
+    with db_cursor() as cursor:
+        # Delete the loan request
+        _, borrower_ids = instrument_audience(cursor, instrument_id)
+        delete_query = "DELETE FROM loans WHERE instrument_id = %s"
+        cursor.execute(delete_query, (instrument_id,))
+        rows_affected = cursor.rowcount  # Get the number of rows affected by the delete operation
 
     if rows_affected > 0:
+        invalidate_requesters(borrower_ids)
         return jsonify({"message": "Loan request cancelled successfully."}), 200
     else:
         return jsonify({"message": "Failed to cancel loan request."}), 500
@@ -123,20 +167,18 @@ def addloan(instrument_id):
     # Get the current date and time
     request_date = datetime.now()
 
-    # Get the instrument owner_id to ensure requester is not the owner
-    connection = get_connection()
-    cursor = connection.cursor()
-    # Insert the new loan request into the loanrequests table
-    insert_query = """
-        INSERT INTO loans (instrument_id, borrower_id, loan_date)
-        VALUES (%s, %s, %s)
-    """
-    cursor.execute(insert_query, (instrument_id, borrowed_id, request_date))
-    connection.commit()
-    rows_affected = cursor.rowcount  # Get the number of rows affected by the insert
-    cursor.close()
+    with db_cursor() as cursor:
+        # Insert the new loan into the loans table
+        insert_query = """
+            INSERT INTO loans (instrument_id, borrower_id, loan_date)
+            VALUES (%s, %s, %s)
+        """
+        cursor.execute(insert_query, (instrument_id, borrowed_id, request_date))
+        rows_affected = cursor.rowcount  # Get the number of rows affected by the insert
 
     if rows_affected > 0:
+        if borrowed_id:
+            invalidate_requesters([int(borrowed_id)])
         return jsonify({"message": "Loan request submitted successfully."}), 201
     else:
         return jsonify({"message": "Failed to submit loan request."}), 500
@@ -149,61 +191,75 @@ def addrequestloan():
     instrumen_id = request.form.get('instrumen_id')
     requester_id = request.form.get('requester_id')
     message= request.form.get('message')
-    request_date = datetime.now()
 
     # Check if all required fields are provided
     if not all([instrumen_id, requester_id, message]):
         return jsonify({"message": "All fields are required."}), 400
 
-    # Get the current date and time
-    request_date = datetime.now()
-
-    # Get the instrument owner_id to ensure requester is not the owner
-    connection = get_connection()
-    cursor = connection.cursor()
-    # Insert the new loan request into the loanrequests table
-    insert_query = """
-        INSERT INTO loanrequests (instrument_id, requester_id, request_date, message)
-        VALUES (%s, %s, %s, %s)
-    """
-    cursor.execute(insert_query, (instrumen_id, requester_id, request_date, message))
-    connection.commit()
-    rows_affected = cursor.rowcount  # Get the number of rows affected by the insert
-    cursor.close()
+    with db_cursor() as cursor:
+        outcome = create_loan_request(cursor, instrumen_id, requester_id, message)
 
-    if rows_affected > 0:
+    if outcome == REQUEST_CREATED:
+        invalidate_requesters([int(requester_id)])
         return jsonify({"message": "Loan request submitted successfully."}), 201
-    else:
-        return jsonify({"message": "Failed to submit loan request."}), 500
+    return _loan_request_rejected(outcome)
+
+# accept a loan request: loan, clear the requests and mark the instrument on loan at once
+@loan_endpoints.route('/accept_loan/<int:instrument_id>', methods=['POST'])
+def accept_loan_request(instrument_id):
+    """Route to lend an instrument to one of its requesters."""
+    borrower_id = request.form.get('borrower_id')
+
+    # Check if all required fields are provided
+    if not borrower_id or not borrower_id.isdigit():
+        return jsonify({"message": "All fields are required."}), 400
+
+    with db_transaction() as cursor:
+        outcome, audience = accept_loan(cursor, instrument_id, borrower_id)
+
+    if outcome == LOAN_ACCEPTED:
+        invalidate_instrument(audience)
+        return jsonify({"instrument_id": instrument_id, "borrower_id": int(borrower_id),
+                        "message": "Loan accepted successfully."}), 200
+    message, status = LOAN_REJECTIONS[outcome]
+    return jsonify({"message": message, "reason": outcome}), status
+
+# return a loaned instrument and make it available again
+@loan_endpoints.route('/return_loan/<int:instrument_id>', methods=['POST'])
+def return_loaned_instrument(instrument_id):
+    """Route to end the loan of an instrument."""
+    with db_transaction() as cursor:
+        outcome, audience = return_loan(cursor, instrument_id)
+
+    if outcome == LOAN_RETURNED:
+        invalidate_instrument(audience)
+        return jsonify({"instrument_id": instrument_id, "message": "Loan returned successfully."}), 200
+    message, status = LOAN_REJECTIONS[outcome]
+    return jsonify({"message": message, "reason": outcome}), status
 
 @loan_endpoints.route('/cancel_loan_request/<int:requester_id>/<int:instrument_id>', methods=['DELETE'])
 def cancel_loan_request(requester_id, instrument_id):
     """Route to cancel all loan requests for a specific instrument by a requester."""
-    # Connect to the database
-    connection = get_connection()
-    cursor = connection.cursor()
-
-    # Check if any loan requests exist and belong to the requester by joining loanrequests and instruments tables
-    select_query = """
-        SELECT * FROM loanrequests
-        JOIN instruments ON loanrequests.instrument_id = instruments.instrument_id
-        WHERE loanrequests.requester_id = %s AND loanrequests.instrument_id = %s
-    """
-    cursor.execute(select_query, (requester_id, instrument_id))
-    loan_requests = cursor.fetchall()
-
-    if not loan_requests:
-        cursor.close()
-        return jsonify({"message": "Loan requests not found or you do not have permission to cancel these requests."}), 404
-
-    # Delete all loan requests for the instrument by the requester
-    delete_query = "DELETE FROM loanrequests WHERE instrument_id = %s AND requester_id = %s"
-    cursor.execute(delete_query, (instrument_id, requester_id))
-    connection.commit()
-    rows_affected = cursor.rowcount  # Get the number of rows affected by the delete operation
-    cursor.close()
+    with db_cursor() as cursor:
+        # Check if any loan requests exist and belong to the requester by joining loanrequests and instruments tables
+        select_query = """
+            SELECT * FROM loanrequests
+            JOIN instruments ON loanrequests.instrument_id = instruments.instrument_id
+            WHERE loanrequests.requester_id = %s AND loanrequests.instrument_id = %s
+        """
+        cursor.execute(select_query, (requester_id, instrument_id))
+        loan_requests = cursor.fetchall()
+
+        if not loan_requests:
+            return jsonify({"message": "Loan requests not found or you do not have permission to cancel these requests."}), 404
+
+        # Delete all loan requests for the instrument by the requester
+        delete_query = "DELETE FROM loanrequests WHERE instrument_id = %s AND requester_id = %s"
+        cursor.execute(delete_query, (instrument_id, requester_id))
+        rows_affected = cursor.rowcount  # Get the number of rows affected by the delete operation
 
     if rows_affected > 0:
+        invalidate_requesters([requester_id])
         return jsonify({"message": f"{rows_affected} loan request(s) cancelled successfully."}), 200
     else:
         return jsonify({"message": "Failed to cancel loan requests."}), 500
@@ -211,19 +267,17 @@ def cancel_loan_request(requester_id, instrument_id):
 @loan_endpoints.route('/loan_list/<int:instrument_id>', methods=['GET'])
 def get_loan_list(instrument_id):
     """Route to get all instruments requested by a specific user."""
-    # Connect to the database
-    connection = get_connection()
-    cursor = connection.cursor()
-    select_query = """
-        SELECT * FROM `loanrequests` INNER JOIN users ON users.user_id = loanrequests.requester_id WHERE instrument_id = %s
-    """
-    cursor.execute(select_query, (instrument_id,))
-    list_request = cursor.fetchall()
-
-    cursor.close()
-    connection.close()
+    with db_cursor() as cursor:
+        cursor.execute(LOAN_LIST_SQL, (instrument_id,))
+        list_request = cursor.fetchall()
+    response = loan_list_response(instrument_id, list_request)
+    return jsonify(response[0]), response[1]
+
+
+def loan_list_response(instrument_id, list_request):
+    """(body, status) of loan_list, shared with the async read endpoints"""
     if not list_request:
-        return jsonify({"message": "No loan requests found for this user."}), 404
+        return {"message": "No loan requests found for this user."}, 404
        # Prepare the list of request to return
     request_list = []
     for r in list_request:
@@ -237,46 +291,23 @@ def get_loan_list(instrument_id):
         }
         request_list.append(request_data)
 
-    return jsonify({"requester_id": instrument_id, "list": request_list}), 200
+    return {"requester_id": instrument_id, "list": request_list}, 200
 
 # Read My Loans
 @loan_endpoints.route('/my_loans/<int:requester_id>', methods=['GET'])
 def get_my_loans(requester_id):
     """Route to get all instruments requested by a specific user."""
-    # Connect to the database
-    connection = get_connection()
-    cursor = connection.cursor()
-
-    # Query to get all instruments requested by the requester
-    select_query = """
-        SELECT a.request_date,
-       b.location,
-       c.full_name,
-       c.phone,
-       0 AS source
-        FROM loanrequests a
-        INNER JOIN instruments b ON b.instrument_id = a.instrument_id
-        INNER JOIN users c ON c.user_id = b.owner_id
-        WHERE a.requester_id = %s
-        UNION ALL
-        SELECT a.loan_date,
-            b.location,
-            c.full_name,
-            c.phone,
-            1 AS source
-        FROM loans a
-        INNER JOIN instruments b ON b.instrument_id = a.instrument_id
-        INNER JOIN users c ON c.user_id = b.owner_id
-        WHERE a.borrower_id = %s;
-    """
-    cursor.execute(select_query, (requester_id,requester_id))
-    myLoans = cursor.fetchall()
-
-    cursor.close()
-    connection.close()
+    with db_cursor() as cursor:
+        cursor.execute(MY_LOANS_SQL, (requester_id,requester_id))
+        myLoans = cursor.fetchall()
+    response = my_loans_response(requester_id, myLoans)
+    return jsonify(response[0]), response[1]
+
 
+def my_loans_response(requester_id, myLoans):
+    """(body, status) of my_loans, shared with the async read endpoints"""
     if not myLoans:
-        return jsonify({"message": "No loan requests found for this user."}), 404
+        return {"message": "No loan requests found for this user."}, 404
     
  
     # Prepare the list of myLoans to return
@@ -291,76 +322,35 @@ def get_my_loans(requester_id):
         }
         myLoans_list.append(loan_data)
 
-    return jsonify({"requester_id": requester_id, "list": myLoans_list}), 200
+    return {"requester_id": requester_id, "list": myLoans_list}, 200
 
 @loan_endpoints.route('/loan_requests/<int:requester_id>', methods=['GET'])
 def get_loan_requests(requester_id):
     """Route to get all instruments requested by a specific user, including those in loans."""
-    connection = get_connection()
-    cursor = connection.cursor()
-
-    # Query to get all instruments requested by the requester from loanrequests
-    loanrequests_query = """
-        SELECT 
-            i.instrument_id, 
-            i.owner_id, 
-            u.username AS owner_username, 
-            i.instrument_name, 
-            i.description, 
-            i.location, 
-            i.availability_status, 
-            i.image, 
-            i.instrument_type_id, 
-            it.name AS instrument_type, 
-            COALESCE(AVG(r.rating), 0) AS average_rating
-        FROM loanrequests lr
-        JOIN instruments i ON lr.instrument_id = i.instrument_id
-        JOIN users u ON i.owner_id = u.user_id
-        JOIN instrument_type it ON i.instrument_type_id = it.id
-        LEFT JOIN reviews r ON i.instrument_id = r.instrument_id
-        WHERE lr.requester_id = %s
-        GROUP BY i.instrument_id, i.owner_id, u.username, i.instrument_name, i.description, 
-                 i.location, i.availability_status, i.image, i.instrument_type_id, it.name
-    """
-    
-    # Query to get all instruments from loans where instruments.instrument_id = loans.instrument_id
-    loans_query = """
-        SELECT 
-            i.instrument_id, 
-            i.owner_id, 
-            u.username AS owner_username, 
-            i.instrument_name, 
-            i.description, 
-            i.location, 
-            i.availability_status, 
-            i.image, 
-            i.instrument_type_id, 
-            it.name AS instrument_type, 
-            COALESCE(AVG(r.rating), 0) AS average_rating
-        FROM loans l
-        JOIN instruments i ON l.instrument_id = i.instrument_id
-        JOIN users u ON i.owner_id = u.user_id
-        JOIN instrument_type it ON i.instrument_type_id = it.id
-        LEFT JOIN reviews r ON i.instrument_id = r.instrument_id
-        WHERE l.borrower_id = %s
-        GROUP BY i.instrument_id, i.owner_id, u.username, i.instrument_name, i.description, 
-                 i.location, i.availability_status, i.image, i.instrument_type_id, it.name
-    """
-
-    cursor.execute(loanrequests_query, (requester_id,))
-    loanrequests_instruments = cursor.fetchall()
-    
-    cursor.execute(loans_query, (requester_id,))
-    loans_instruments = cursor.fetchall()
+    cache_key = (LOAN_REQUESTS, requester_id, None)
+    cached = listing_cache.get(cache_key)
+    if cached:
+        return jsonify(cached[0]), cached[1]
+
+    with db_cursor() as cursor:
+        cursor.execute(REQUESTED_INSTRUMENTS_SQL, (requester_id,))
+        loanrequests_instruments = cursor.fetchall()
+
+        cursor.execute(BORROWED_INSTRUMENTS_SQL, (requester_id,))
+        loans_instruments = cursor.fetchall()
+
+    response = loan_requests_response(requester_id, loanrequests_instruments, loans_instruments)
+    listing_cache.set(cache_key, response)
+    return jsonify(response[0]), response[1]
 
-    cursor.close()
-    connection.close()
 
+def loan_requests_response(requester_id, loanrequests_instruments, loans_instruments):
+    """(body, status) of loan_requests, shared with the async read endpoints"""
     # Combine the results from both queries
     instruments = loanrequests_instruments + loans_instruments
 
     if not instruments:
-        return jsonify({"message": "No loan requests found for this user."}), 404
+        return {"message": "No loan requests found for this user."}, 404
 
     # Prepare the list of instruments to return
     instruments_list = []
@@ -380,5 +370,5 @@ def get_loan_requests(requester_id):
         }
         instruments_list.append(instrument_data)
 
-    return jsonify({"requester_id": requester_id, "instruments": instruments_list}), 200
+    return {"requester_id": requester_id, "instruments": instruments_list}, 200
 
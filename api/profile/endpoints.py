@@ -1,41 +1,101 @@
 """Routes for module books"""
-import os
-from flask import Blueprint, jsonify, request
-from helper.db_helper import get_connection
+from flask import Blueprint, jsonify, request, url_for
+from helper.cache_helper import profile_cache, invalidate_profile, PROFILES
+from helper.db_helper import db_cursor, db_transaction
 from helper.form_validation import get_form_data
-import uuid
+from helper.image_helper import schedule_variants
+from helper.image_gc import queue_release
+from helper.image_storage import store_upload, add_ref, release_ref
+from helper.upload_helper import upload_limit
 
 profile_endpoints = Blueprint('profile', __name__)
-UPLOAD_FOLDER = "img"
+
+PROFILE_BATCH_MAX = 100
+PROFILE_COLUMNS = "user_id, username, email, full_name, phone, profile_picture"
+
+
+def _load_profiles(user_ids):
+    """
+    Profiles of user_ids from the profile cache, the misses read with one IN query.
+
+    Returns:
+        dict: user_id to profile row, unknown users left out.
+    """
+    profiles = {}
+    missing = []
+    for user_id in user_ids:
+        cached = profile_cache.get((PROFILES, user_id, None))
+        if cached:
+            profiles[user_id] = cached
+        else:
+            missing.append(user_id)
+
+    if missing:
+        placeholders = ', '.join(['%s'] * len(missing))
+        with db_cursor(dictionary=True) as cursor:
+            cursor.execute(f"SELECT {PROFILE_COLUMNS} FROM users WHERE user_id IN ({placeholders})", missing)
+            rows = cursor.fetchall()
+        for row in rows:
+            user_id = row.pop('user_id')
+            profile_cache.set((PROFILES, user_id, None), row)
+            profiles[user_id] = row
+    return profiles
+
+
+def _image_url(image_name, size=None):
+    """External URL of an image on the image server, size=None for the original"""
+    return url_for('static_file_server.show_image', image_name=image_name, size=size, _external=True)
+
+
+def _stage_profile(profile, image_url=_image_url):
+    """Profile row with profile_picture resolved to URLs of the image server (image_url builds them)"""
+    staged = dict(profile)
+    picture = profile.get('profile_picture')
+    staged['profile_picture_url'] = image_url(picture) if picture else None
+    staged['profile_picture_thumb_url'] = image_url(picture, 'thumb') if picture else None
+    return staged
+
 
 @profile_endpoints.route('/read/<int:user_id>', methods=['GET'])
 def read_user(user_id):
     """Routes for reading user profile based on user_id"""
-    connection = get_connection()
-    cursor = connection.cursor(dictionary=True)
-    
-    # Define the select query to fetch user data based on user_id
-    select_query = """
-        SELECT username, email, full_name, phone, profile_picture 
-        FROM users 
-        WHERE user_id = %s
-    """
-    cursor.execute(select_query, (user_id,))
-    user = cursor.fetchone()
-    
-    cursor.close()  # Close the cursor after query execution
-    connection.close()  # Close the connection
+    user = _load_profiles([user_id]).get(user_id)
 
     if user:
-        return jsonify({"message": "OK", "data": user}), 200
+        return jsonify({"message": "OK", "data": _stage_profile(user)}), 200
     else:
         return jsonify({"message": "Failed", "description": "User not found"}), 404
 
+@profile_endpoints.route('/batch', methods=['GET'])
+def read_users():
+    """
+    Routes for reading many user profiles at once.
+
+    `ids` is a comma separated list of up to PROFILE_BATCH_MAX user ids, answered with one query
+    for the profiles that are not cached.
+    """
+    try:
+        user_ids = list(dict.fromkeys(int(user_id) for user_id in request.args.get('ids', '').split(',') if user_id))
+    except ValueError:
+        return jsonify({"message": "Failed", "description": "ids must be comma separated user ids"}), 400
+    if not user_ids:
+        return jsonify({"message": "Failed", "description": "ids is required"}), 400
+    if len(user_ids) > PROFILE_BATCH_MAX:
+        return jsonify({"message": "Failed", "description": f"At most {PROFILE_BATCH_MAX} ids per call"}), 400
+
+    profiles = _load_profiles(user_ids)
+    return jsonify({
+        "message": "OK",
+        "data": {str(user_id): _stage_profile(profile) for user_id, profile in profiles.items()},
+        "missing": [user_id for user_id in user_ids if user_id not in profiles],
+    }), 200
+
 @profile_endpoints.route('/update/<int:user_id>', methods=['POST'])
+@upload_limit('PROFILE_PICTURE_MAX_BYTES')
 def update(user_id):
     """Routes for module to update a user's profile"""
-    # Collect optional parameters from the form
-    request_data = request.get_json()
+    # Collect optional parameters from the JSON body, or the form when a picture is uploaded
+    request_data = request.get_json(silent=True) or request.form
 
     email = request_data.get('email')
     full_name = request_data.get('full_name')
@@ -66,41 +126,40 @@ def update(user_id):
         fields_to_update.append("phone=%s")
         values_to_update.append(phone)
 
-    connection = get_connection()
-    cursor = connection.cursor()
-
+    image_key = None
     if uploaded_file and uploaded_file.filename != '':
-        # Retrieve the current profile picture filename
-        cursor.execute("SELECT profile_picture FROM users WHERE user_id=%s", (user_id,))
-        current_profile_picture = cursor.fetchone()[0]
-
-        # Generate a unique filename for the new profile picture
-        unique_filename = str(uuid.uuid4()) + "_" + uploaded_file.filename
-        file_path = os.path.join(UPLOAD_FOLDER, unique_filename)
-        uploaded_file.save(file_path)
+        # Store the new profile picture under its content hash
+        image_key = store_upload(uploaded_file)
+        schedule_variants(image_key)
 
         fields_to_update.append("profile_picture=%s")
-        values_to_update.append(unique_filename)
+        values_to_update.append(image_key)
+
+    if not fields_to_update:
+        return jsonify({"message": "No profile picture uploaded."}), 400
 
-        # Delete the old profile picture file if it exists
-        if current_profile_picture:
-            old_file_path = os.path.join(UPLOAD_FOLDER, current_profile_picture)
-            if os.path.exists(old_file_path):
-                os.remove(old_file_path)
+    released_picture = None
+    with db_transaction() as cursor:
+        if image_key:
+            # Lock the row so the old profile picture is released exactly once
+            cursor.execute("SELECT profile_picture FROM users WHERE user_id=%s FOR UPDATE", (user_id,))
+            current = cursor.fetchone()
 
-    if fields_to_update:
         update_query = f"UPDATE users SET {', '.join(fields_to_update)} WHERE user_id=%s"
         values_to_update.append(user_id)  # Add user_id to the end of the values list
 
         cursor.execute(update_query, values_to_update)
-        connection.commit()
         rows_affected = cursor.rowcount  # Get the number of rows affected by the update
-        cursor.close()
-
-        if rows_affected > 0:
-            return jsonify({"user_id": user_id, "message": "Profile updated successfully."}), 200
-        else:
-            return jsonify({"message": "User not found or profile update failed."}), 404
-
-    cursor.close()
-    return jsonify({"message": "No profile picture uploaded."}), 400
\ No newline at end of file
+        if rows_affected > 0 and image_key:
+            add_ref(cursor, image_key)
+            if current and release_ref(cursor, current[0]):
+                released_picture = current[0]
+    invalidate_profile(user_id)
+
+    if rows_affected > 0:
+        # The old picture goes only once nothing references it anymore
+        if released_picture:
+            queue_release(released_picture)
+        return jsonify({"user_id": user_id, "message": "Profile updated successfully."}), 200
+    else:
+        return jsonify({"message": "User not found or profile update failed."}), 404
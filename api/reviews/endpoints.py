@@ -1,12 +1,12 @@
-"""Routes for module books"""
-import os
+"""Routes for module reviews"""
 from flask import Blueprint, jsonify, request
-from helper.db_helper import get_connection
-from helper.form_validation import get_form_data
-import uuid
+from mysql.connector import errorcode
+from mysql.connector.errors import IntegrityError
+from helper.cache_helper import instrument_audience, invalidate_instrument
+from helper.db_helper import db_transaction
+from helper.rating_helper import apply_rating
 
 reviews_endpoints = Blueprint('reviews', __name__)
-UPLOAD_FOLDER = "img"
 
 @reviews_endpoints.route('/add_review/<int:user_id>/<int:instrument_id>', methods=['POST'])
 def add_review(user_id, instrument_id):
@@ -27,31 +27,26 @@ def add_review(user_id, instrument_id):
     except ValueError:
         return jsonify({"message": "Rating must be an integer."}), 400
 
-    # Check if the user has already reviewed this instrument
-    connection = get_connection()
-    cursor = connection.cursor()
-    
-    check_query = """
-        SELECT COUNT(*) FROM reviews WHERE instrument_id = %s AND user_id = %s
-    """
-    cursor.execute(check_query, (instrument_id, user_id))
-    review_exists = cursor.fetchone()[0] > 0
-
-    if review_exists:
-        cursor.close()
-        return jsonify({"message": "User has already reviewed this instrument."}), 400
-
-    # Insert the new review into the reviews table
-    insert_query = """
-        INSERT INTO reviews (instrument_id, user_id, rating, comment)
-        VALUES (%s, %s, %s, %s)
-    """
-    cursor.execute(insert_query, (instrument_id, user_id, rating, comment))
-    connection.commit()
-    rows_affected = cursor.rowcount  # Get the number of rows affected by the insert
-    cursor.close()
+    # Insert the new review and bump the instrument rating aggregates in one transaction,
+    # a second review of the instrument by the user is rejected by the uq_reviews_instrument_user key
+    try:
+        with db_transaction() as cursor:
+            insert_query = """
+                INSERT INTO reviews (instrument_id, user_id, rating, comment)
+                VALUES (%s, %s, %s, %s)
+            """
+            cursor.execute(insert_query, (instrument_id, user_id, rating, comment))
+            rows_affected = cursor.rowcount  # Get the number of rows affected by the insert
+            if rows_affected > 0:
+                apply_rating(cursor, instrument_id, rating, 1)
+            audience = instrument_audience(cursor, instrument_id)
+    except IntegrityError as error:
+        if error.errno == errorcode.ER_DUP_ENTRY:
+            return jsonify({"message": "User has already reviewed this instrument."}), 400
+        raise
 
     if rows_affected > 0:
+        invalidate_instrument(audience)
         return jsonify({"message": "Review added successfully."}), 201
     else:
         return jsonify({"message": "Failed to add review."}), 500
@@ -59,16 +54,22 @@ def add_review(user_id, instrument_id):
 @reviews_endpoints.route('/delete_review/<int:review_id>', methods=['DELETE'])
 def delete_review(review_id):
     """Route to delete a review from the reviews table."""
-    connection = get_connection()
-    cursor = connection.cursor()
-    
-    delete_query = "DELETE FROM reviews WHERE review_id = %s"
-    cursor.execute(delete_query, (review_id,))
-    connection.commit()
-    rows_affected = cursor.rowcount  # Get the number of rows affected by the delete
-    cursor.close()
+    rows_affected = 0
+    with db_transaction() as cursor:
+        # Lock the review so the aggregates are decremented by exactly the rating that is removed
+        cursor.execute("SELECT instrument_id, rating FROM reviews WHERE review_id = %s FOR UPDATE", (review_id,))
+        review = cursor.fetchone()
+
+        if review:
+            delete_query = "DELETE FROM reviews WHERE review_id = %s"
+            cursor.execute(delete_query, (review_id,))
+            rows_affected = cursor.rowcount  # Get the number of rows affected by the delete
+            if rows_affected > 0:
+                apply_rating(cursor, review[0], -review[1], -1)
+                audience = instrument_audience(cursor, review[0])
 
     if rows_affected > 0:
+        invalidate_instrument(audience)
         return jsonify({"message": "Review deleted successfully."}), 200
     else:
-        return jsonify({"message": "Failed to delete review."}), 500
\ No newline at end of file
+        return jsonify({"message": "Failed to delete review."}), 500
@@ -1,5 +1,7 @@
 """Small apps to demonstrate endpoints with basic feature - CRUD"""
 
+import os
+import click
 from flask import Flask
 from flask_cors import CORS
 from dotenv import load_dotenv
@@ -10,18 +12,36 @@ from api.instruments.endpoints import instruments_endpoints
 from api.loan.endpoints import loan_endpoints
 from api.reviews.endpoints import reviews_endpoints
 from api.data_protected.endpoints import protected_endpoints
+from api.health.endpoints import health_endpoints
 from config import Config
+from helper.db_helper import db_cursor, db_transaction
+from helper.geo_helper import location_columns
+from helper.image_gc import GC_GRACE_SECONDS, reconcile, run_reconciler
+from helper.image_helper import VARIANT_FOLDER, schedule_variants
+from helper.image_storage import (STORAGE_ROOT, TMP_FOLDER, link_flat_files, repoint_rows,
+                                  remove_flat_files, rebuild_refs)
+from helper.metrics_helper import init_metrics
+from helper.migration_helper import MigrationError, downgrade, status, upgrade
+from helper.rating_helper import rebuild_rating_aggregates
+from helper.recommendation_helper import RECOMMENDATION_TOP_K, build_recommendations
+from helper.sql_timing_helper import init_sql_timing
+from helper.upload_helper import UploadRequest
 from static.static_file_server import static_file_server
 
 # Load environment variables from the .env file
 load_dotenv()
 
 app = Flask(__name__)
+# Uploads are size limited, type checked and spooled into image storage while the body is parsed
+app.request_class = UploadRequest
 app.config.from_object(Config)
 CORS(app)
 
 
 jwt.init_app(app)
+init_sql_timing(app)
+# GET /metrics for Prometheus when prometheus_client is installed
+init_metrics(app)
 
 # register the blueprint
 app.register_blueprint(auth_endpoints, url_prefix='/api/v1/auth')
@@ -32,8 +52,145 @@ app.register_blueprint(profile_endpoints, url_prefix='/api/v1/profile')
 app.register_blueprint(instruments_endpoints, url_prefix='/api/v1/instruments')
 app.register_blueprint(loan_endpoints, url_prefix='/api/v1/loan')
 app.register_blueprint(reviews_endpoints, url_prefix='/api/v1/reviews')
+# /healthz and /readyz for the load balancer and the process manager
+app.register_blueprint(health_endpoints)
 
 
+@app.cli.command('db-migrate')
+@click.option('--to', 'target', default=None, help="Stop after this version instead of applying every pending one")
+@click.option('--baseline', is_flag=True,
+              help="Record the migrations as applied without running them, for a schema created by hand")
+def db_migrate(target, baseline):
+    """Apply the pending schema migrations from migrations/"""
+    try:
+        with db_cursor() as cursor:
+            applied = upgrade(cursor, target, baseline)
+    except MigrationError as error:
+        raise click.ClickException(str(error))
+    verb = "recorded" if baseline else "applied"
+    for version, name in applied:
+        click.echo(f"{version} {name} {verb}")
+    click.echo(f"{len(applied)} migration(s) {verb}.")
+
+
+@app.cli.command('db-rollback')
+@click.option('--steps', default=1, show_default=True, help="Number of migrations to revert")
+def db_rollback(steps):
+    """Revert the last applied schema migrations with their down scripts"""
+    try:
+        with db_cursor() as cursor:
+            reverted = downgrade(cursor, steps)
+    except MigrationError as error:
+        raise click.ClickException(str(error))
+    for version, name in reverted:
+        click.echo(f"{version} {name} reverted")
+    click.echo(f"{len(reverted)} migration(s) reverted.")
+
+
+@app.cli.command('db-status')
+def db_status():
+    """List the schema migrations and whether they are applied"""
+    with db_cursor() as cursor:
+        migrations = status(cursor)
+    for version, name, applied in migrations:
+        click.echo(f"{version} {name} {'applied' if applied else 'pending'}")
+
+
+@app.cli.command('rebuild-ratings')
+def rebuild_ratings():
+    """Recompute the instrument rating aggregates from the reviews table"""
+    with db_cursor() as cursor:
+        rows_affected = rebuild_rating_aggregates(cursor)
+    click.echo(f"Rating aggregates rebuilt, {rows_affected} instrument(s) updated.")
+
+
+@app.cli.command('build-image-variants')
+def build_image_variants():
+    """Generate the thumb/medium/full variants of every image already in the storage folder"""
+    keys = []
+    for directory, subdirectories, files in os.walk(STORAGE_ROOT):
+        if directory == STORAGE_ROOT:
+            subdirectories[:] = [name for name in subdirectories if name not in (VARIANT_FOLDER, TMP_FOLDER)]
+        keys.extend(os.path.relpath(os.path.join(directory, name), STORAGE_ROOT) for name in files
+                    if not name.startswith('.'))
+    futures = [schedule_variants(key) for key in sorted(keys)]
+    futures = [future for future in futures if future is not None]
+    for future in futures:
+        future.result()
+    click.echo(f"Variants built for {len(futures)} image(s).")
+
+
+@app.cli.command('migrate-images')
+def migrate_images():
+    """Move the flat img/ files into the content-addressed, sharded layout"""
+    mapping = link_flat_files()
+    with db_transaction() as cursor:
+        rows_updated = repoint_rows(cursor, mapping)
+    remove_flat_files(mapping)
+    for key in sorted(set(mapping.values())):
+        schedule_variants(key)
+    click.echo(f"{len(mapping)} file(s) migrated into {len(set(mapping.values()))} key(s), "
+               f"{rows_updated} row(s) repointed.")
+
+
+@app.cli.command('rebuild-image-refs')
+def rebuild_image_refs():
+    """Recompute the image reference counts from instruments and users"""
+    with db_transaction() as cursor:
+        keys = rebuild_refs(cursor)
+    click.echo(f"Image references rebuilt, {keys} key(s) referenced.")
+
+
+@app.cli.command('geocode-instruments')
+@click.option('--all', 'replace_all', is_flag=True, help="Also re-place instruments that already have coordinates")
+def geocode_instruments(replace_all):
+    """Fill the instrument coordinates from the offline gazetteer"""
+    with db_transaction() as cursor:
+        query = "SELECT instrument_id, location FROM instruments"
+        if not replace_all:
+            query += " WHERE latitude IS NULL"
+        cursor.execute(query)
+        rows = cursor.fetchall()
+        placed = 0
+        for instrument_id, location in rows:
+            latitude, longitude, geohash = location_columns(location)
+            if geohash is None:
+                continue
+            cursor.execute("UPDATE instruments SET latitude=%s, longitude=%s, geohash=%s WHERE instrument_id=%s",
+                           (latitude, longitude, geohash, instrument_id))
+            placed += 1
+    click.echo(f"{placed} of {len(rows)} instrument(s) placed, the others have a location the gazetteer does not know.")
+
+
+@app.cli.command('build-recommendations')
+@click.option('--top-k', default=RECOMMENDATION_TOP_K, show_default=True, help="Instruments kept per user")
+def build_recommendations_command(top_k):
+    """Recompute the per user recommendations served by /recommended and sort=recommended (needs NumPy)"""
+    try:
+        report = build_recommendations(db_transaction, top_k)
+    except RuntimeError as error:
+        raise click.ClickException(str(error))
+    click.echo(f"{report['rows']} recommendation(s) for {report['users']} user(s) over "
+               f"{report['candidates']} instrument(s) in {report['seconds']}s.")
+
+
+@app.cli.command('gc-images')
+@click.option('--grace', default=GC_GRACE_SECONDS, show_default=True,
+              help="Only remove orphans older than this many seconds")
+@click.option('--dry-run', is_flag=True, help="Report what would be removed")
+@click.option('--every', type=int, help="Keep running, one batch every this many seconds (IMAGE_GC_INTERVAL under gunicorn)")
+def gc_images(grace, dry_run, every):
+    """Remove the stored images no instrument or user points at anymore"""
+    if every:
+        run_reconciler(every, grace=grace, dry_run=dry_run)
+        return
+    report = reconcile(grace=grace, dry_run=dry_run)
+    verb = "would be" if dry_run else "were"
+    click.echo(f"{report['scanned']} image(s) scanned, {report['removed']} orphan(s) {verb} removed, "
+               f"{report['bytes_reclaimed']} byte(s) reclaimed.")
+
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0')
+    # Development server only, production runs under gunicorn: gunicorn -c gunicorn.conf.py app:app
+    app.run(debug=os.environ.get('FLASK_DEBUG') == '1', host=os.environ.get('HOST', '0.0.0.0'),
+            port=int(os.environ.get('PORT', 5000)))
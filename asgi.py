@@ -0,0 +1,37 @@
+"""ASGI entry point: the read endpoints served async on aiomysql, every other route by the Flask app
+
+    uvicorn asgi:app --workers 4
+    WEB_WORKER_CLASS=uvicorn.workers.UvicornWorker gunicorn -c gunicorn.conf.py asgi:app
+
+The routes of api/async_read answer on the same URLs, with the same JSON, as their blueprint
+counterparts and are matched first. Anything else falls through to the Flask app, which runs in
+the WSGI adapter's thread pool with its own DB pool as under gunicorn gthread.
+"""
+from contextlib import asynccontextmanager
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.routing import Mount
+
+try:
+    from a2wsgi import WSGIMiddleware
+except ImportError:  # a2wsgi is optional, starlette's own adapter is deprecated but works
+    from starlette.middleware.wsgi import WSGIMiddleware
+
+from app import app as flask_app
+from api.async_read.endpoints import routes as async_read_routes
+from helper.async_db_helper import close_async_pool
+
+
+@asynccontextmanager
+async def lifespan(_app):
+    yield
+    await close_async_pool()
+
+
+app = Starlette(
+    routes=async_read_routes + [Mount('/', app=WSGIMiddleware(flask_app))],
+    # Same open CORS policy as CORS(app) in app.py, for the async routes too
+    middleware=[Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])],
+    lifespan=lifespan,
+)
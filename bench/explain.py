@@ -0,0 +1,476 @@
+"""Query plan regression check: EXPLAIN FORMAT=JSON every SQL statement of the endpoint modules
+
+Usage:
+    python -m bench.explain --max-rows 1000
+    python -m bench.explain --verbose --allow read_owner_dashboard:filesort
+
+The statements are read from the source with the ast module, no request is made: string constants,
+f-strings and the local variables they are built from are rendered along the default code path
+(the `else` side of conditional expressions, the initial conditions of a WHERE list) and every %s
+gets a sample value. Each `if` test and conditional expression test of the function, and of the
+query builder it calls, is then rendered true and false in turn; every variant that changes the SQL
+(a cursor page, sort=recommended, an optional filter, a stream without LIMIT) is explained as well
+and reported as `function[variant]`. A statement fails when its plan scans a whole table, sorts with
+a filesort or builds a temporary table over more than --max-rows estimated rows. Run it against a
+database seeded with python -m bench.seed, the exit status is non-zero when a statement fails or
+cannot be explained. Skipped statements and variants are listed with the reason.
+"""
+import argparse
+import ast
+import glob
+import importlib
+import json
+import os
+import re
+import sys
+from dotenv import load_dotenv
+from mysql.connector import Error as MySQLError
+
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+# Endpoint modules plus the helpers whose statements run inside a request
+DEFAULT_MODULES = ['api/*/endpoints.py', 'helper/loan_helper.py', 'helper/cache_helper.py']
+DEFAULT_MAX_ROWS = 1000
+SAMPLE_LIMIT = 51
+EXPLAINABLE = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE', 'WITH', '(')
+CHECKS = ('full_scan', 'filesort', 'temporary')
+
+_POINT = re.compile(r'POINT\(\s*%s\s*,\s*%s\s*\)', re.IGNORECASE)
+_PARAMETER = re.compile(r'(AGAINST\s*\(\s*|LIKE\s+|LIMIT\s+)?%s', re.IGNORECASE)
+
+
+class Unrenderable(Exception):
+    """Raised when a statement depends on a value that is only known at request time"""
+
+
+class Statement:
+    """One cursor.execute/executemany call site and its rendered SQL"""
+
+    def __init__(self, path, function, line, variant=None):
+        self.path = path
+        self.function = function
+        self.line = line
+        self.variant = variant
+        self.sql = None
+        self.skipped = None
+        self.error = None
+
+    @property
+    def name(self):
+        return f"{self.function}[{self.variant}]" if self.variant else self.function
+
+    @property
+    def location(self):
+        return f"{self.path}:{self.line} {self.name}"
+
+
+class _Returned:
+    """Element index of the tuple a query builder function returns"""
+
+    def __init__(self, function, index):
+        self.function = function
+        self.index = index
+
+    def scope(self, module, variant=None):
+        """Scope of the builder function, in its own module"""
+        builder = getattr(module, self.function, None)
+        if builder is None or not hasattr(builder, '__module__'):
+            raise Unrenderable(f"{self.function}()")
+        builder_module = importlib.import_module(builder.__module__)
+        definition = _module_functions(builder_module).get(self.function)
+        if definition is None:
+            raise Unrenderable(f"{self.function}()")
+        return _Scope(definition, builder_module, variant)
+
+    def render(self, module, variant=None):
+        scope = self.scope(module, variant)
+        returns = [node for node in ast.walk(scope.function) if isinstance(node, ast.Return)
+                   and isinstance(node.value, ast.Tuple) and len(node.value.elts) > self.index]
+        if not returns:
+            raise Unrenderable(f"{self.function}()")
+        statement = returns[-1]
+        return render(statement.value.elts[self.index], scope, statement.lineno)
+
+
+_functions = {}
+
+
+def _module_functions(module):
+    """Top level function definitions of a module, parsed once"""
+    if module.__name__ not in _functions:
+        with open(module.__file__, encoding='utf-8') as source_file:
+            tree = ast.parse(source_file.read())
+        _functions[module.__name__] = {node.name: node for node in tree.body
+                                       if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))}
+    return _functions[module.__name__]
+
+
+class _Scope:
+    """String and list values a function builds before a given line, module globals as fallback"""
+
+    def __init__(self, function, module, variant=None):
+        self.function = function
+        self.module = module
+        # {condition source: True or False} the variant assumes, conditions not in it follow the default path
+        self.variant = variant or {}
+        self.parameters = {arg.arg for arg in function.args.args + function.args.kwonlyargs}
+        self.conditions = set()
+        self.assignments = []
+        self.augmentations = []
+        self.appends = []
+        for node, guard in _guarded(function):
+            if isinstance(node, (ast.If, ast.IfExp)):
+                self.conditions.add(ast.unparse(node.test))
+            if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+                self.assignments.append((node.lineno, node.targets[0].id, node.value, guard))
+            elif (isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Tuple)
+                  and isinstance(node.value, ast.Call) and isinstance(node.value.func, ast.Name)):
+                # query, values = browse_query(...): the SQL is what the builder returns
+                for index, element in enumerate(node.targets[0].elts):
+                    if isinstance(element, ast.Name):
+                        self.assignments.append((node.lineno, element.id,
+                                                 _Returned(node.value.func.id, index), guard))
+            elif isinstance(node, ast.AugAssign) and isinstance(node.op, ast.Add) and isinstance(node.target, ast.Name):
+                self.augmentations.append((node.lineno, node.target.id, node.value, guard))
+            elif (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute)
+                  and node.func.attr == 'append' and isinstance(node.func.value, ast.Name) and node.args):
+                self.appends.append((node.lineno, node.func.value.id, node.args[0], guard))
+
+    def all_conditions(self):
+        """Conditions of the function and of the query builders it calls"""
+        conditions = set(self.conditions)
+        for _, _, value, _ in self.assignments:
+            if isinstance(value, _Returned):
+                try:
+                    conditions |= value.scope(self.module).conditions
+                except Unrenderable:
+                    pass
+        return conditions
+
+    def taken(self, guard):
+        """Whether the branch runs in this variant, None when the variant does not decide it"""
+        if guard is None or guard[0] not in self.variant:
+            return None
+        return self.variant[guard[0]] == guard[1]
+
+    def _assignment(self, name, before):
+        found = None
+        for line, target, value, guard in self.assignments:
+            if (target == name and line < before and self.taken(guard) is not False
+                    and (found is None or line > found[0])):
+                found = (line, value)
+        return found
+
+    def string(self, name, before):
+        assignment = self._assignment(name, before)
+        if assignment is None:
+            if name in self.parameters:
+                raise Unrenderable(f"parameter {name}")
+            value = getattr(self.module, name, None)
+            if isinstance(value, (str, int, float)) and not isinstance(value, bool):
+                return str(value)
+            raise Unrenderable(name)
+        line, value = assignment
+        if isinstance(value, _Returned):
+            rendered = value.render(self.module, self.variant)
+        else:
+            rendered = render(value, self, line)
+        for augmented_line, target, extra, guard in sorted(self.augmentations, key=lambda item: item[0]):
+            if target == name and line < augmented_line < before and self.taken(guard) is not False:
+                rendered += render(extra, self, augmented_line)
+        return rendered
+
+    def items(self, name, before):
+        assignment = self._assignment(name, before)
+        if assignment is None:
+            raise Unrenderable(name)
+        line, value = assignment
+        items = render_items(value, self, line)
+        appended = [(append_line, extra, self.taken(guard)) for append_line, target, extra, guard in self.appends
+                    if target == name and line < append_line < before]
+        if not items:
+            # Built up by appends, e.g. the SET list of an UPDATE
+            return [render(extra, self, append_line) for append_line, extra, taken in appended if taken is not False]
+        # Optional conditions added to an initial list only show up in the variant taking their branch
+        return items + [render(extra, self, append_line) for append_line, extra, taken in appended if taken]
+
+
+def _guarded(function):
+    """Every node of a function with its guard, the (condition source, branch) of the innermost if around it"""
+    stack = [(function, None)]
+    while stack:
+        node, guard = stack.pop()
+        yield node, guard
+        if isinstance(node, ast.If):
+            condition = ast.unparse(node.test)
+            stack.append((node.test, guard))
+            stack.extend((child, (condition, True)) for child in node.body)
+            stack.extend((child, (condition, False)) for child in node.orelse)
+        else:
+            stack.extend((child, guard) for child in ast.iter_child_nodes(node))
+
+
+def render_items(node, scope, before):
+    """Render a list expression into a list of strings"""
+    if isinstance(node, (ast.List, ast.Tuple)):
+        return [render(element, scope, before) for element in node.elts]
+    if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Mult):
+        # ['%s'] * len(ids): one element is enough for a plan
+        return render_items(node.left, scope, before)
+    if isinstance(node, ast.Name):
+        return scope.items(node.id, before)
+    raise Unrenderable(ast.unparse(node))
+
+
+def render(node, scope, before):
+    """Render a string expression along the default code path"""
+    if isinstance(node, ast.Constant) and isinstance(node.value, (str, int, float)):
+        return str(node.value)
+    if isinstance(node, ast.JoinedStr):
+        return ''.join(render(value, scope, before) for value in node.values)
+    if isinstance(node, ast.FormattedValue):
+        return render(node.value, scope, before)
+    if isinstance(node, ast.Name):
+        return scope.string(node.id, before)
+    if isinstance(node, ast.IfExp):
+        taken = scope.variant.get(ast.unparse(node.test))
+        return render(node.body if taken else node.orelse, scope, before)
+    if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Add):
+        return render(node.left, scope, before) + render(node.right, scope, before)
+    if (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and node.func.attr == 'join'
+            and isinstance(node.func.value, ast.Constant) and len(node.args) == 1):
+        return node.func.value.value.join(render_items(node.args[0], scope, before))
+    raise Unrenderable(ast.unparse(node))
+
+
+def _module_name(path):
+    return os.path.splitext(os.path.relpath(path, ROOT))[0].replace(os.sep, '.')
+
+
+def extract_statements(path):
+    """Every execute/executemany call of a module, rendered to SQL or marked as skipped or unrenderable"""
+    with open(path, encoding='utf-8') as source_file:
+        tree = ast.parse(source_file.read(), filename=path)
+    module = importlib.import_module(_module_name(path))
+    relative_path = os.path.relpath(path, ROOT)
+
+    statements = []
+    for function in ast.walk(tree):
+        if not isinstance(function, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            continue
+        scope = _Scope(function, module)
+        conditions = sorted(scope.all_conditions())
+        for node in ast.walk(function):
+            if not (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute)
+                    and node.func.attr in ('execute', 'executemany') and node.args):
+                continue
+            statement = Statement(relative_path, function.name, node.lineno)
+            try:
+                statement.sql = _render_sql(node, scope)
+            except Unrenderable as error:
+                if str(error).startswith('parameter '):
+                    statement.skipped = f"SQL passed in as a {error}, explained with the variants of its callers"
+                else:
+                    statement.error = f"cannot render {error}, build the SQL from constants and local strings"
+            statements.append(statement)
+            if statement.sql is not None:
+                statements.extend(_variants(node, function, module, conditions, statement))
+    return sorted(statements, key=lambda statement: (statement.path, statement.line, statement.variant or ''))
+
+
+def _render_sql(call, scope):
+    return ' '.join(render(call.args[0], scope, call.lineno).split())
+
+
+def _variant_name(condition, value):
+    if value:
+        return condition
+    return f"not ({condition})" if ' ' in condition else f"not {condition}"
+
+
+def _variants(call, function, module, conditions, default):
+    """Statements of the variants of a call whose SQL differs from the default path and from each other"""
+    seen = {default.sql}
+    variants = []
+    for condition in conditions:
+        for value in (True, False):
+            statement = Statement(default.path, default.function, default.line, _variant_name(condition, value))
+            try:
+                sql = _render_sql(call, _Scope(function, module, {condition: value}))
+            except Unrenderable as error:
+                statement.skipped = f"variant cannot be rendered: {error}"
+                variants.append(statement)
+                continue
+            if sql not in seen:
+                seen.add(sql)
+                statement.sql = sql
+                variants.append(statement)
+    return variants
+
+
+def with_sample_values(sql):
+    """
+    Replace every %s placeholder by a sample literal that fits where it is used.
+
+    Plain values become the string '1': MySQL converts it for integer columns, while a number
+    compared with a string column would hide its index and report a scan the app never does.
+    """
+    def sample(match):
+        context = (match.group(1) or '').upper()
+        if context.startswith('AGAINST'):
+            return match.group(1) + "'guitar*'"
+        if context.startswith('LIKE'):
+            return match.group(1) + "'a%'"
+        if context.startswith('LIMIT'):
+            return match.group(1) + str(SAMPLE_LIMIT)
+        return "'1'"
+    sql = _POINT.sub('POINT(106.8, -6.2)', sql.rstrip().rstrip(';'))
+    return _PARAMETER.sub(sample, sql)
+
+
+def _rows_below(node):
+    """
+    Largest row estimate of the tables under a plan node.
+
+    A derived table counts with its own estimate, the subquery it is materialized from is checked
+    on its own: a sort over a UNION of LIMITed pages sorts the pages, not the tables they read.
+    """
+    rows = 0
+    if isinstance(node, dict):
+        if 'table_name' in node:
+            rows = max(rows, int(node.get('rows_produced_per_join') or node.get('rows_examined_per_scan') or 0))
+        for key, value in node.items():
+            if key != 'materialized_from_subquery':
+                rows = max(rows, _rows_below(value))
+    elif isinstance(node, list):
+        for value in node:
+            rows = max(rows, _rows_below(value))
+    return rows
+
+
+def plan_problems(plan, max_rows):
+    """
+    Full scans, filesorts and temporary tables of an EXPLAIN FORMAT=JSON plan above max_rows.
+
+    Returns:
+        list: (check, description) tuples, check being one of CHECKS.
+    """
+    problems = []
+
+    def walk(node):
+        if isinstance(node, list):
+            for value in node:
+                walk(value)
+            return
+        if not isinstance(node, dict):
+            return
+        if node.get('access_type') == 'ALL':
+            rows = int(node.get('rows_examined_per_scan') or 0)
+            if rows > max_rows:
+                problems.append(('full_scan', f"full scan of {node.get('table_name')} (~{rows} rows)"))
+        if node.get('using_filesort'):
+            rows = _rows_below(node)
+            if rows > max_rows:
+                problems.append(('filesort', f"filesort over ~{rows} rows"))
+        if node.get('using_temporary_table'):
+            rows = _rows_below(node)
+            if rows > max_rows:
+                problems.append(('temporary', f"temporary table over ~{rows} rows"))
+        for value in node.values():
+            walk(value)
+
+    walk(plan)
+    return problems
+
+
+def explain(cursor, sql):
+    """EXPLAIN FORMAT=JSON of a statement, as a dict"""
+    cursor.execute(f"EXPLAIN FORMAT=JSON {with_sample_values(sql)}")
+    return json.loads(cursor.fetchone()[0])
+
+
+def check_statements(cursor, statements, max_rows, allowed):
+    """
+    Explain every statement and collect the problems not allowed for its function.
+
+    Returns:
+        list: (statement, status, details) tuples, status being OK, FAIL, ERROR or SKIP.
+    """
+    # MySQL 8.3+ defaults to the version 2 JSON format, the checks read version 1
+    try:
+        cursor.execute("SET SESSION explain_json_format_version = 1")
+    except MySQLError:
+        pass
+
+    results = []
+    for statement in statements:
+        if statement.error:
+            results.append((statement, 'ERROR', [statement.error]))
+            continue
+        if statement.skipped:
+            results.append((statement, 'SKIP', [statement.skipped]))
+            continue
+        if not statement.sql.lstrip().upper().startswith(EXPLAINABLE):
+            results.append((statement, 'SKIP', ["not an explainable statement"]))
+            continue
+        try:
+            plan = explain(cursor, statement.sql)
+        except MySQLError as error:
+            results.append((statement, 'ERROR', [str(error)]))
+            continue
+        accepted = allowed.get(statement.function, set()) | allowed.get(statement.name, set())
+        problems = [description for check, description in plan_problems(plan, max_rows) if check not in accepted]
+        results.append((statement, 'FAIL' if problems else 'OK', problems))
+    return results
+
+
+def _parse_allowances(values):
+    allowed = {}
+    for value in values:
+        function, _, check = value.partition(':')
+        if check not in CHECKS:
+            raise argparse.ArgumentTypeError(f"--allow expects function:check with check one of {', '.join(CHECKS)}")
+        allowed.setdefault(function, set()).add(check)
+    return allowed
+
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--module', action='append', help="glob of modules to check, relative to the project root "
+                                                          f"(default: {', '.join(DEFAULT_MODULES)})")
+    parser.add_argument('--max-rows', type=int, default=DEFAULT_MAX_ROWS,
+                        help="row estimate above which a full scan, filesort or temporary table fails")
+    parser.add_argument('--allow', action='append', default=[], metavar='FUNCTION:CHECK',
+                        help=f"accept one of {', '.join(CHECKS)} for the statements of a function, "
+                             "or of one variant with function[variant]")
+    parser.add_argument('--verbose', action='store_true', help="print the rendered SQL of every statement")
+    args = parser.parse_args()
+    try:
+        allowed = _parse_allowances(args.allow)
+    except argparse.ArgumentTypeError as error:
+        parser.error(str(error))
+
+    load_dotenv()
+    from helper.db_helper import db_cursor  # pylint: disable=import-outside-toplevel
+    paths = sorted({path for pattern in args.module or DEFAULT_MODULES
+                    for path in glob.glob(os.path.join(ROOT, pattern))})
+    statements = [statement for path in paths for statement in extract_statements(path)]
+    with db_cursor() as cursor:
+        results = check_statements(cursor, statements, args.max_rows, allowed)
+
+    counts = {}
+    for statement, status, details in results:
+        counts[status] = counts.get(status, 0) + 1
+        if status != 'OK' or args.verbose:
+            print(f"{status:<5} {statement.location}")
+            for detail in details:
+                print(f"      {detail}")
+            if args.verbose and statement.sql:
+                print(f"      {statement.sql}")
+    print(", ".join(f"{count} {status}" for status, count in sorted(counts.items())))
+    if counts.get('FAIL') or counts.get('ERROR'):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,306 @@
+"""Replay API flows at a given concurrency and report latency percentiles per endpoint
+
+Usage:
+    python -m bench.run --concurrency 16 --duration 30 --save-baseline bench/baseline.json
+    python -m bench.run --concurrency 16 --duration 30 --baseline bench/baseline.json --threshold 0.2
+
+The load goes to --base-url (default $BENCH_BASE_URL or http://127.0.0.1:5000), a server started
+separately, e.g. with gunicorn: a server in this interpreter would share the GIL with the load
+generator and skew the latencies. --in-process still serves app.py on a threaded Werkzeug server
+for a quick smoke run.
+To compare serving modes at equal memory, benchmark each server with --base-url and --server-pid
+(the gunicorn or uvicorn master pid, its workers are included): the report adds their peak RSS.
+Run python -m bench.seed first so there are bench_user_* accounts to drive the flows with.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict
+from urllib.parse import urlencode, urlsplit
+from dotenv import load_dotenv
+
+from bench.seed import BENCH_PASSWORD, BENCH_USER_PREFIX
+
+DEFAULT_BASE_URL = 'http://127.0.0.1:5000'
+PERCENTILES = (50, 95, 99)
+NEARBY_LOCATIONS = ['Jakarta', 'Bandung', 'Surabaya', 'Yogyakarta']
+SEARCH_TERMS = ['guitar', 'bass+jakarta', 'key', 'drums+bandung', 'synthetic', 'viol']
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(pct / 100 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def load_dataset():
+    """Ids of the seeded bench users and instruments"""
+    from helper.db_helper import db_cursor  # pylint: disable=import-outside-toplevel
+    with db_cursor() as cursor:
+        cursor.execute("SELECT user_id, username FROM users WHERE username LIKE %s", (BENCH_USER_PREFIX + '%',))
+        users = cursor.fetchall()
+        cursor.execute("SELECT instrument_id FROM instruments")
+        instrument_ids = [row[0] for row in cursor.fetchall()]
+    if not users or not instrument_ids:
+        raise SystemExit("No benchmark dataset found, run python -m bench.seed first")
+    return users, instrument_ids
+
+
+def build_flows(users, instrument_ids):
+    """
+    Flows replayed by every worker: each one is a list of (endpoint, method, path, form) steps.
+
+    The read flows mirror what the mobile screens call, the write flows undo themselves so the
+    dataset stays stable across runs. A write the server rejects ends its flow (see Worker.run): a
+    loan request refused because the seed already made one for the pair is not cancelled.
+    """
+    def read_flow(rng):
+        user_id, _ = rng.choice(users)
+        instrument_id = rng.choice(instrument_ids)
+        return [
+            ('profile.read_user', 'GET', f'/api/v1/profile/read/{user_id}', None),
+            ('instruments.read_instruments_by_user', 'GET',
+             f'/api/v1/instruments/read_instruments_by_user/{user_id}', None),
+            ('instruments.read_owner_dashboard', 'GET', f'/api/v1/instruments/dashboard/{user_id}', None),
+            ('instruments.read_instruments_by_availability_excluding_user', 'GET',
+             f'/api/v1/instruments/read_instruments_by_availability_excluding_user/{user_id}?limit=50', None),
+            ('loan.get_my_loans', 'GET', f'/api/v1/loan/my_loans/{user_id}', None),
+            ('loan.get_loan_requests', 'GET', f'/api/v1/loan/loan_requests/{user_id}', None),
+            ('loan.get_loan_list', 'GET', f'/api/v1/loan/loan_list/{instrument_id}', None),
+            ('instruments.read_instruments_nearby', 'GET',
+             f'/api/v1/instruments/nearby/{user_id}?location={rng.choice(NEARBY_LOCATIONS)}&radius_km=25&limit=20',
+             None),
+            ('instruments.search_instruments', 'GET',
+             f'/api/v1/instruments/search?q={rng.choice(SEARCH_TERMS)}&limit=20', None),
+        ]
+
+    def login_flow(rng):
+        _, username = rng.choice(users)
+        return [('auth.login', 'POST', '/api/v1/auth/login', {'username': username, 'password': BENCH_PASSWORD})]
+
+    def loan_request_flow(rng):
+        user_id, _ = rng.choice(users)
+        instrument_id = rng.choice(instrument_ids)
+        return [
+            ('loan.request_loan', 'POST', f'/api/v1/loan/request_loan/{user_id}',
+             {'instrument_id': instrument_id, 'message': f'bench {uuid.uuid4().hex[:8]}'}),
+            ('loan.cancel_loan_request', 'DELETE', f'/api/v1/loan/cancel_loan_request/{user_id}/{instrument_id}', None),
+        ]
+
+    # Weighted like production traffic: reads dominate
+    return [(read_flow, 8), (login_flow, 1), (loan_request_flow, 1)]
+
+
+class Worker(threading.Thread):
+    """Replays flows on one keep-alive connection until the deadline"""
+
+    def __init__(self, base_url, flows, deadline, seed_value, results):
+        super().__init__(daemon=True)
+        self.base = urlsplit(base_url)
+        self.flows = [flow for flow, _ in flows]
+        self.weights = [weight for _, weight in flows]
+        self.deadline = deadline
+        self.rng = random.Random(seed_value)
+        self.results = results
+
+    def run(self):
+        connection = http.client.HTTPConnection(self.base.hostname, self.base.port or 80, timeout=30)
+        samples = defaultdict(list)
+        errors = defaultdict(int)
+        while time.monotonic() < self.deadline:
+            flow = self.rng.choices(self.flows, weights=self.weights)[0]
+            for endpoint, method, path, form in flow(self.rng):
+                body = urlencode(form) if form is not None else None
+                headers = {'Content-Type': 'application/x-www-form-urlencoded'} if form is not None else {}
+                started = time.perf_counter()
+                try:
+                    connection.request(method, path, body=body, headers=headers)
+                    response = connection.getresponse()
+                    response.read()
+                    status = response.status
+                except (OSError, http.client.HTTPException):
+                    connection.close()
+                    connection = http.client.HTTPConnection(self.base.hostname, self.base.port or 80, timeout=30)
+                    status = 599
+                samples[endpoint].append(time.perf_counter() - started)
+                if status >= 500:
+                    errors[endpoint] += 1
+                if method != 'GET' and not 200 <= status < 300:
+                    # The next steps would undo a write that did not happen, e.g. delete a seeded row
+                    break
+        connection.close()
+        self.results.append((samples, errors))
+
+
+def run_benchmark(base_url, flows, concurrency, duration, seed_value=42):
+    """
+    Run the workers and aggregate their samples.
+
+    Returns:
+        dict: Per endpoint count, errors, requests per second and p50/p95/p99 latency in ms.
+    """
+    results = []
+    deadline = time.monotonic() + duration
+    workers = [Worker(base_url, flows, deadline, seed_value + n, results) for n in range(concurrency)]
+    started = time.monotonic()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.monotonic() - started
+
+    samples = defaultdict(list)
+    errors = defaultdict(int)
+    for worker_samples, worker_errors in results:
+        for endpoint, values in worker_samples.items():
+            samples[endpoint].extend(values)
+        for endpoint, count in worker_errors.items():
+            errors[endpoint] += count
+
+    report = {}
+    for endpoint, values in sorted(samples.items()):
+        values.sort()
+        report[endpoint] = {
+            "count": len(values),
+            "errors": errors[endpoint],
+            "rps": round(len(values) / elapsed, 2),
+            **{f"p{pct}_ms": round(percentile(values, pct) * 1000, 3) for pct in PERCENTILES},
+        }
+    return report
+
+
+def compare_to_baseline(report, baseline, threshold, metric='p95_ms'):
+    """
+    List the endpoints whose latency regressed past the threshold.
+
+    Args:
+        threshold (float): Allowed relative increase, 0.2 means 20% slower than the baseline.
+
+    Returns:
+        list: Human readable regression messages, empty when the run passes.
+    """
+    regressions = []
+    for endpoint, expected in baseline.get('endpoints', {}).items():
+        current = report.get(endpoint)
+        if current is None or not expected.get(metric):
+            continue
+        limit = expected[metric] * (1 + threshold)
+        if current[metric] > limit:
+            regressions.append(f"{endpoint}: {metric} {current[metric]:.2f} > {limit:.2f} "
+                               f"(baseline {expected[metric]:.2f})")
+    return regressions
+
+
+def print_report(report):
+    """Print the per endpoint table"""
+    header = f"{'endpoint':<62} {'count':>7} {'err':>5} {'rps':>9} {'p50':>9} {'p95':>9} {'p99':>9}"
+    print(header)
+    print('-' * len(header))
+    for endpoint, row in report.items():
+        print(f"{endpoint:<62} {row['count']:>7} {row['errors']:>5} {row['rps']:>9.1f} "
+              f"{row['p50_ms']:>9.2f} {row['p95_ms']:>9.2f} {row['p99_ms']:>9.2f}")
+
+
+def _status_kb(pid, field):
+    with open(f"/proc/{pid}/status", encoding='ascii') as status_file:
+        for line in status_file:
+            if line.startswith(field + ':'):
+                return int(line.split()[1])
+    return 0
+
+
+def _with_children(pid):
+    pids = [pid]
+    for task in os.listdir(f"/proc/{pid}/task"):
+        with open(f"/proc/{pid}/task/{task}/children", encoding='ascii') as children_file:
+            pids.extend(int(child) for child in children_file.read().split())
+    return pids
+
+
+def server_memory(pids):
+    """
+    Resident memory of the server processes and their direct children (Linux /proc only).
+
+    Returns:
+        dict: Current and peak (VmHWM) RSS in MB summed over the processes, and the process count.
+    """
+    processes = sorted({child for pid in pids for child in _with_children(pid)})
+    return {
+        "processes": len(processes),
+        "rss_mb": round(sum(_status_kb(pid, 'VmRSS') for pid in processes) / 1024, 1),
+        "peak_rss_mb": round(sum(_status_kb(pid, 'VmHWM') for pid in processes) / 1024, 1),
+    }
+
+
+def serve_in_process(app):
+    """Serve the app on an ephemeral port in a background thread, returns the base URL"""
+    from werkzeug.serving import make_server  # pylint: disable=import-outside-toplevel
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--base-url', help=f"server to benchmark (default: $BENCH_BASE_URL or {DEFAULT_BASE_URL})")
+    parser.add_argument('--in-process', action='store_true',
+                        help="serve app.py from this process instead, shares the GIL with the load generator")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=20, help="seconds")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help="write the JSON report to this file")
+    parser.add_argument('--save-baseline', help="write the report as the new baseline")
+    parser.add_argument('--baseline', help="fail when an endpoint regressed past --threshold")
+    parser.add_argument('--threshold', type=float, default=0.2, help="allowed p95 increase, 0.2 = 20%%")
+    parser.add_argument('--server-pid', type=int, action='append', default=[],
+                        help="report the peak RSS of this server process and its workers, repeatable")
+    args = parser.parse_args()
+
+    load_dotenv()
+    if args.in_process:
+        from app import app  # pylint: disable=import-outside-toplevel
+        base_url = serve_in_process(app)
+    else:
+        base_url = args.base_url or os.environ.get('BENCH_BASE_URL') or DEFAULT_BASE_URL
+
+    users, instrument_ids = load_dataset()
+    flows = build_flows(users, instrument_ids)
+    report = run_benchmark(base_url, flows, args.concurrency, args.duration, args.seed)
+    print_report(report)
+
+    document = {
+        "concurrency": args.concurrency,
+        "duration": args.duration,
+        "base_url": base_url,
+        "endpoints": report,
+    }
+    if args.server_pid:
+        memory = server_memory(args.server_pid)
+        total_rps = sum(row['rps'] for row in report.values())
+        memory["rps_per_100mb"] = round(total_rps / memory['peak_rss_mb'] * 100, 1) if memory['peak_rss_mb'] else 0
+        print(f"\nServer: {memory['processes']} process(es), RSS {memory['rss_mb']} MB, "
+              f"peak {memory['peak_rss_mb']} MB, {memory['rps_per_100mb']} req/s per 100 MB")
+        document["server_memory"] = memory
+    for path in filter(None, [args.output, args.save_baseline]):
+        with open(path, 'w', encoding='utf-8') as output_file:
+            json.dump(document, output_file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as baseline_file:
+            regressions = compare_to_baseline(report, json.load(baseline_file), args.threshold)
+        if regressions:
+            print("\nRegressions:\n" + "\n".join(regressions))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+"""Seed a local MySQL with a synthetic, reproducible dataset for the benchmarks
+
+Usage:
+    python -m bench.seed --users 1000 --instruments 5000 --reviews 20000 --loan-requests 5000 --loans 1000
+"""
+import argparse
+import random
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+from helper.password_helper import hash_password
+from helper.db_helper import db_cursor, db_transaction
+from helper.geo_helper import location_columns
+from helper.rating_helper import rebuild_rating_aggregates
+
+BENCH_USER_PREFIX = 'bench_user_'
+BENCH_PASSWORD = 'bench-password'
+BATCH_SIZE = 1000
+INSTRUMENT_TYPES = ['Guitar', 'Bass', 'Drums', 'Keyboard', 'Violin', 'Saxophone', 'Trumpet', 'Ukulele']
+LOCATIONS = ['Jakarta', 'Bandung', 'Surabaya', 'Yogyakarta', 'Semarang', 'Medan', 'Denpasar', 'Makassar']
+
+
+def _insert_many(cursor, query, rows):
+    """executemany in batches so large datasets do not build one huge statement"""
+    for start in range(0, len(rows), BATCH_SIZE):
+        cursor.executemany(query, rows[start:start + BATCH_SIZE])
+
+
+def _pairs(rng, count, left_ids, right_ids, exclude=None):
+    """Draw up to count distinct (left, right) pairs, skipping those rejected by exclude"""
+    pairs = set()
+    attempts = 0
+    while len(pairs) < count and attempts < count * 10:
+        attempts += 1
+        pair = (rng.choice(left_ids), rng.choice(right_ids))
+        if exclude is None or not exclude(pair):
+            pairs.add(pair)
+    return sorted(pairs)
+
+
+def clear_dataset():
+    """Remove the rows of a previous seed run"""
+    with db_transaction() as cursor:
+        cursor.execute("SELECT user_id FROM users WHERE username LIKE %s", (BENCH_USER_PREFIX + '%',))
+        user_ids = [row[0] for row in cursor.fetchall()]
+        if not user_ids:
+            return
+        placeholders = ', '.join(['%s'] * len(user_ids))
+        instrument_subquery = f"SELECT instrument_id FROM instruments WHERE owner_id IN ({placeholders})"
+        for table, column in [('reviews', 'user_id'), ('loanrequests', 'requester_id'), ('loans', 'borrower_id')]:
+            cursor.execute(f"DELETE FROM {table} WHERE {column} IN ({placeholders})", user_ids)
+            cursor.execute(f"DELETE FROM {table} WHERE instrument_id IN ({instrument_subquery})", user_ids)
+        cursor.execute(f"DELETE FROM instruments WHERE owner_id IN ({placeholders})", user_ids)
+        cursor.execute(f"DELETE FROM users WHERE user_id IN ({placeholders})", user_ids)
+
+
+def seed(users, instruments, reviews, loan_requests, loans, seed_value=42):
+    """
+    Insert a synthetic dataset owned by bench_user_* accounts.
+
+    Returns:
+        dict: Number of rows inserted per table.
+    """
+    rng = random.Random(seed_value)
+    password_hash = hash_password(BENCH_PASSWORD)
+    now = datetime.now()
+
+    with db_transaction() as cursor:
+        cursor.execute("SELECT id, name FROM instrument_type")
+        type_names = dict(cursor.fetchall())
+        if not type_names:
+            _insert_many(cursor, "INSERT INTO instrument_type (name) VALUES (%s)",
+                         [(name,) for name in INSTRUMENT_TYPES])
+            cursor.execute("SELECT id, name FROM instrument_type")
+            type_names = dict(cursor.fetchall())
+        type_ids = list(type_names)
+
+        _insert_many(cursor, """
+            INSERT INTO users (username, email, full_name, phone, password)
+            VALUES (%s, %s, %s, %s, %s)
+        """, [(f"{BENCH_USER_PREFIX}{n}", f"bench{n}@example.com", f"Bench User {n}",
+               f"08{rng.randrange(10**9, 10**10)}", password_hash) for n in range(users)])
+        cursor.execute("SELECT user_id FROM users WHERE username LIKE %s", (BENCH_USER_PREFIX + '%',))
+        user_ids = [row[0] for row in cursor.fetchall()]
+
+        instrument_rows = []
+        for n in range(instruments):
+            type_id = rng.choice(type_ids)
+            location = rng.choice(LOCATIONS)
+            instrument_rows.append((rng.choice(user_ids), f"{type_names[type_id]} {n}", f"Synthetic instrument {n}",
+                                    location, type_id, f"bench-{n}.jpg", type_names[type_id],
+                                    *location_columns(location)))
+        _insert_many(cursor, """
+            INSERT INTO instruments (owner_id, instrument_name, description, location, instrument_type_id, image,
+                                     type_name, latitude, longitude, geohash)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        """, instrument_rows)
+        placeholders = ', '.join(['%s'] * len(user_ids))
+        cursor.execute(f"SELECT instrument_id, owner_id FROM instruments WHERE owner_id IN ({placeholders})",
+                       user_ids)
+        owners = dict(cursor.fetchall())
+        instrument_ids = list(owners)
+
+        def own(pair):
+            return owners[pair[1]] == pair[0]
+
+        review_pairs = _pairs(rng, reviews, user_ids, instrument_ids, own)
+        _insert_many(cursor, """
+            INSERT INTO reviews (instrument_id, user_id, rating, comment)
+            VALUES (%s, %s, %s, %s)
+        """, [(instrument_id, user_id, rng.randint(0, 5), "Synthetic review")
+              for user_id, instrument_id in review_pairs])
+
+        request_pairs = _pairs(rng, loan_requests, user_ids, instrument_ids, own)
+        _insert_many(cursor, """
+            INSERT INTO loanrequests (instrument_id, requester_id, request_date, message)
+            VALUES (%s, %s, %s, %s)
+        """, [(instrument_id, user_id, now - timedelta(minutes=rng.randrange(60 * 24 * 30)), "Synthetic request")
+              for user_id, instrument_id in request_pairs])
+
+        loan_pairs = _pairs(rng, loans, user_ids, instrument_ids, own)
+        _insert_many(cursor, """
+            INSERT INTO loans (instrument_id, borrower_id, loan_date)
+            VALUES (%s, %s, %s)
+        """, [(instrument_id, user_id, now - timedelta(days=rng.randrange(30)))
+              for user_id, instrument_id in loan_pairs])
+
+    with db_cursor() as cursor:
+        rebuild_rating_aggregates(cursor)
+
+    return {
+        "users": len(user_ids),
+        "instruments": len(instrument_ids),
+        "reviews": len(review_pairs),
+        "loanrequests": len(request_pairs),
+        "loans": len(loan_pairs),
+    }
+
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--instruments', type=int, default=5000)
+    parser.add_argument('--reviews', type=int, default=20000)
+    parser.add_argument('--loan-requests', type=int, default=5000)
+    parser.add_argument('--loans', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=42, help="random seed, same seed gives the same dataset")
+    parser.add_argument('--keep', action='store_true', help="keep the rows of a previous run")
+    args = parser.parse_args()
+
+    load_dotenv()
+    if not args.keep:
+        clear_dataset()
+    counts = seed(args.users, args.instruments, args.reviews, args.loan_requests, args.loans, args.seed)
+    print(", ".join(f"{count} {table}" for table, count in counts.items()))
+
+
+if __name__ == '__main__':
+    main()
@@ -11,3 +11,9 @@ class Config:
     JWT_SECRET_KEY = os.getenv('JWT_SECRET_KEY', 'supersecretjwtkey')
     JWT_ACCESS_TOKEN_EXPIRES = os.getenv(
         'JWT_ACCESS_TOKEN_EXPIRES', timedelta(seconds=int(3600)))
+    # Let the front server stream static images, see static/static_file_server.py
+    USE_X_SENDFILE = os.getenv('STATIC_SENDFILE', '').lower() == 'x-sendfile'
+    # Request body limits in bytes: the whole app, and the upload routes (see helper/upload_helper.py)
+    MAX_CONTENT_LENGTH = int(os.getenv('MAX_CONTENT_LENGTH', 16 * 1024 * 1024))
+    INSTRUMENT_IMAGE_MAX_BYTES = int(os.getenv('INSTRUMENT_IMAGE_MAX_BYTES', 8 * 1024 * 1024))
+    PROFILE_PICTURE_MAX_BYTES = int(os.getenv('PROFILE_PICTURE_MAX_BYTES', 2 * 1024 * 1024))
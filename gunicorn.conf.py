@@ -0,0 +1,123 @@
+"""Gunicorn settings for production serving: gunicorn -c gunicorn.conf.py app:app
+
+Pre-forked gthread workers, each with its own DB pool sized so that all the workers together, and
+the image reconciler, stay under DB_MAX_CONNECTIONS. With WEB_WORKER_CLASS=uvicorn.workers.UvicornWorker
+serve asgi:app instead, the async read endpoints then get their own aiomysql pool out of the same
+per-worker budget. SIGHUP reloads the workers and SIGTERM shuts down, both let the workers finish
+their in-flight requests for up to WEB_GRACEFUL_TIMEOUT seconds.
+"""
+import glob
+import multiprocessing
+import os
+import subprocess
+import sys
+from dotenv import load_dotenv
+
+load_dotenv()
+
+bind = os.environ.get('WEB_BIND') or f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+workers = int(os.environ.get('WEB_WORKERS') or min(multiprocessing.cpu_count() * 2 + 1, 8))
+threads = int(os.environ.get('WEB_THREADS') or 4)
+worker_class = os.environ.get('WEB_WORKER_CLASS') or 'gthread'
+ASGI_WORKER = worker_class.startswith('uvicorn')
+timeout = int(os.environ.get('WEB_TIMEOUT') or 30)
+graceful_timeout = int(os.environ.get('WEB_GRACEFUL_TIMEOUT') or 30)
+keepalive = int(os.environ.get('WEB_KEEPALIVE') or 5)
+# Recycle workers now and then so slow leaks never accumulate, jittered so they do not restart together
+max_requests = int(os.environ.get('WEB_MAX_REQUESTS') or 10000)
+max_requests_jitter = max_requests // 10
+# The app is imported by each worker, so a SIGHUP reload picks up new code
+preload_app = False
+accesslog = os.environ.get('WEB_ACCESS_LOG') or None
+errorlog = '-'
+
+# Each worker gets POOL_SIZE connections (default: one per thread), capped so that
+# workers x pool size stays under DB_MAX_CONNECTIONS. The workers inherit the value when forked.
+DB_MAX_CONNECTIONS = int(os.environ.get('DB_MAX_CONNECTIONS') or 100)
+# The image reconciler (see when_ready) runs with a pool of one connection, taken off the budget first
+RECONCILER_POOL_SIZE = 1 if os.environ.get('IMAGE_GC_INTERVAL') else 0
+workers_max_connections = DB_MAX_CONNECTIONS - RECONCILER_POOL_SIZE
+# A worker needs one connection, two under ASGI (the async pool and the Flask routes)
+MIN_WORKER_CONNECTIONS = 2 if ASGI_WORKER else 1
+if workers_max_connections < MIN_WORKER_CONNECTIONS:
+    raise RuntimeError(f"DB_MAX_CONNECTIONS={DB_MAX_CONNECTIONS} leaves {workers_max_connections} connection(s) "
+                       f"after the image reconciler, a {worker_class} worker needs {MIN_WORKER_CONNECTIONS}")
+# Fewer workers rather than more connections than the budget, see on_starting
+requested_workers = workers
+workers = min(workers, workers_max_connections // MIN_WORKER_CONNECTIONS)
+worker_budget = workers_max_connections // workers
+worker_async_pool_size = 0
+if ASGI_WORKER:
+    # The aiomysql pool (ASYNC_POOL_SIZE, default 10) comes first, the Flask routes keep at least one connection
+    worker_async_pool_size = max(1, min(int(os.environ.get('ASYNC_POOL_SIZE') or 10), worker_budget - 1))
+    os.environ['ASYNC_POOL_SIZE'] = str(worker_async_pool_size)
+worker_pool_size = max(1, min(int(os.environ.get('POOL_SIZE') or threads), worker_budget - worker_async_pool_size))
+os.environ['POOL_SIZE'] = str(worker_pool_size)
+
+
+def on_starting(server):
+    """Clear the samples of the previous run from the Prometheus multiprocess directory"""
+    if workers < requested_workers:
+        server.log.warning("WEB_WORKERS lowered from %s to %s: a %s worker needs %s DB connection(s) "
+                           "and %s of DB_MAX_CONNECTIONS=%s are left for the workers", requested_workers, workers,
+                           worker_class, MIN_WORKER_CONNECTIONS, workers_max_connections, DB_MAX_CONNECTIONS)
+    if ASGI_WORKER:
+        server.log.info("%s %s worker(s), DB pools of %s async + %s per worker, %s for the image reconciler "
+                        "(%s of %s connections)", workers, worker_class, worker_async_pool_size, worker_pool_size,
+                        RECONCILER_POOL_SIZE,
+                        workers * (worker_async_pool_size + worker_pool_size) + RECONCILER_POOL_SIZE,
+                        DB_MAX_CONNECTIONS)
+    else:
+        server.log.info("%s worker(s) x %s thread(s), DB pool of %s per worker, %s for the image reconciler "
+                        "(%s of %s connections)", workers, threads, worker_pool_size, RECONCILER_POOL_SIZE,
+                        workers * worker_pool_size + RECONCILER_POOL_SIZE, DB_MAX_CONNECTIONS)
+    metrics_dir = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if metrics_dir:
+        os.makedirs(metrics_dir, exist_ok=True)
+        for path in glob.glob(os.path.join(metrics_dir, '*.db')):
+            os.remove(path)
+
+
+# The image reconciler runs once per server, not once per worker, see when_ready
+_reconciler = []
+
+
+def when_ready(server):
+    """Start the image reconciler (flask gc-images --every) when IMAGE_GC_INTERVAL is set"""
+    interval = os.environ.get('IMAGE_GC_INTERVAL')
+    if interval:
+        command = [sys.executable, '-m', 'flask', '--app', 'app', 'gc-images', '--every', interval]
+        # One cursor at a time, its pool is the RECONCILER_POOL_SIZE reserved in the budget
+        environment = dict(os.environ, POOL_SIZE=str(RECONCILER_POOL_SIZE))
+        _reconciler.append(subprocess.Popen(command, cwd=os.path.dirname(os.path.abspath(__file__)),
+                                            env=environment))
+        server.log.info("Image reconciler started (pid %s), one pass every %ss", _reconciler[0].pid, interval)
+
+
+def on_exit(server):
+    """Stop the image reconciler with the server"""
+    for process in _reconciler:
+        process.terminate()
+        process.wait(timeout=10)
+
+
+def post_worker_init(worker):
+    """Open the worker's DB connections before it takes traffic, a failure only shows on /readyz"""
+    from helper.db_helper import warmup_pool  # pylint: disable=import-outside-toplevel
+    try:
+        opened = warmup_pool(worker_pool_size)
+    except Exception as error:  # pylint: disable=broad-except
+        worker.log.warning("DB pool warmup failed in worker %s: %s", worker.pid, error)
+    else:
+        worker.log.info("Worker %s opened %s DB connection(s)", worker.pid, opened)
+
+
+def child_exit(server, worker):
+    """Drop the live gauges of a dead worker from the Prometheus multiprocess samples"""
+    if not os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        return
+    try:
+        from prometheus_client import multiprocess  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        return
+    multiprocess.mark_process_dead(worker.pid)
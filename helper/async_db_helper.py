@@ -0,0 +1,91 @@
+"""Async DB Helper: aiomysql pool for the ASGI read endpoints, see asgi.py"""
+import asyncio
+import os
+from contextlib import asynccontextmanager
+
+try:
+    import aiomysql
+except ImportError:  # aiomysql is optional, only the ASGI serving mode needs it
+    aiomysql = None
+
+from helper.sql_timing_helper import TimedAsyncCursor
+
+# One pool per event loop, created on first use so the settings loaded by python-dotenv are honoured
+_pools = {}
+
+
+def get_async_pool_size():
+    """Async pool size from ASYNC_POOL_SIZE, defaults to 10"""
+    return int(os.environ.get('ASYNC_POOL_SIZE') or 10)
+
+
+async def get_async_pool():
+    """
+    Get the aiomysql pool of the running event loop, creating it on first use.
+
+    Returns:
+        aiomysql.Pool: Autocommit pool configured from the DB_* and ASYNC_POOL_SIZE environment variables.
+    """
+    if aiomysql is None:
+        raise RuntimeError("aiomysql is required for the ASGI read endpoints, pip install aiomysql")
+    loop = asyncio.get_running_loop()
+    entry = _pools.get(loop)
+    if entry is None:
+        # The lock is created and awaited on this loop only, concurrent first requests share one pool
+        entry = _pools.setdefault(loop, [asyncio.Lock(), None])
+    async with entry[0]:
+        if entry[1] is None:
+            entry[1] = await aiomysql.create_pool(
+                host=os.environ.get('DB_HOST'),
+                user=os.environ.get('DB_USER'),
+                password=os.environ.get('DB_PASSWORD') or '',
+                db=os.environ.get('DB_NAME'),
+                minsize=0,
+                maxsize=get_async_pool_size(),
+                autocommit=True,
+                pool_recycle=int(os.environ.get('ASYNC_POOL_RECYCLE') or 3600),
+            )
+    return entry[1]
+
+
+async def close_async_pool():
+    """Close the pool of the running event loop, waiting for the connections in use to come back"""
+    entry = _pools.pop(asyncio.get_running_loop(), None)
+    if entry and entry[1] is not None:
+        entry[1].close()
+        await entry[1].wait_closed()
+
+
+@asynccontextmanager
+async def async_db_cursor(unbuffered=False, dictionary=False):
+    """
+    Context managed cursor on an autocommit connection of the async pool.
+
+    Waits up to POOL_TIMEOUT seconds (default 5) for a free connection, like db_cursor.
+
+    Args:
+        unbuffered: Server-side cursor streaming the rows, for NDJSON responses.
+        dictionary: Rows as dicts instead of tuples.
+
+    Yields:
+        TimedAsyncCursor: aiomysql cursor timed like the db_cursor ones (Server-Timing, slow query
+            log), closed and its connection returned on exit.
+    """
+    pool = await get_async_pool()
+    connection = await asyncio.wait_for(pool.acquire(), float(os.environ.get('POOL_TIMEOUT') or 5))
+    try:
+        if unbuffered:
+            cursor_class = aiomysql.SSDictCursor if dictionary else aiomysql.SSCursor
+        else:
+            cursor_class = aiomysql.DictCursor if dictionary else aiomysql.Cursor
+        cursor = TimedAsyncCursor(await connection.cursor(cursor_class))
+        try:
+            yield cursor
+        finally:
+            await cursor.close()
+    except BaseException:
+        # e.g. a client gone mid-stream: the connection may hold unread rows, never hand it out again
+        connection.close()
+        raise
+    finally:
+        pool.release(connection)
@@ -0,0 +1,162 @@
+"""In-process LRU + TTL caches for the instrument listings and the user profiles"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Listing endpoints kept in the cache, entries are keyed by (endpoint, user_id, variant)
+INSTRUMENTS_BY_USER = 'instruments_by_user'
+INSTRUMENTS_BROWSE = 'instruments_browse'
+LOAN_REQUESTS = 'loan_requests'
+PROFILES = 'profiles'
+
+
+class LRUCache:
+    """Bounded, thread safe LRU cache whose entries also expire after a TTL
+
+    Keys are (endpoint, user_id, variant) tuples, indexed by endpoint and user_id so an
+    invalidation only touches the entries it drops.
+    """
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        # {endpoint: {user_id: set of keys}}
+        self._index = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        """Return the cached value for key, or None on a miss or an expired entry"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        """Store value under key, evicting the least recently used entries when full"""
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            self._index.setdefault(key[0], {}).setdefault(key[1], set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def pop(self, key):
+        """Drop the entry of key, if any"""
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+                self.invalidations += 1
+
+    def invalidate(self, endpoint, user_id=None):
+        """Drop the entries of an endpoint, only those of user_id when it is given"""
+        with self._lock:
+            users = self._index.get(endpoint)
+            if not users:
+                return
+            if user_id is None:
+                stale = [key for keys in users.values() for key in keys]
+            else:
+                stale = list(users.get(user_id, ()))
+            for key in stale:
+                self._remove(key)
+            self.invalidations += len(stale)
+
+    def _remove(self, key):
+        """Delete an entry and its index slot, the lock must be held"""
+        del self._entries[key]
+        users = self._index[key[0]]
+        keys = users[key[1]]
+        keys.discard(key)
+        if not keys:
+            del users[key[1]]
+            if not users:
+                del self._index[key[0]]
+
+    def stats(self):
+        """Counters used to size the cache"""
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+# The caches live in each process: under gunicorn a write only invalidates the worker that handled
+# it, the other workers keep serving their copy until the TTL expires. The TTLs are kept short
+# (seconds to minutes) for that reason, lower them rather than raise them when staleness matters.
+listing_cache = LRUCache(
+    max_entries=int(os.environ.get('LISTING_CACHE_SIZE', 1024)),
+    ttl=float(os.environ.get('LISTING_CACHE_TTL', 60))
+)
+# Public profile rows keyed by (PROFILES, user_id, None), dropped by profile.update
+profile_cache = LRUCache(
+    max_entries=int(os.environ.get('PROFILE_CACHE_SIZE', 4096)),
+    ttl=float(os.environ.get('PROFILE_CACHE_TTL', 300))
+)
+
+
+def instrument_audience(cursor, instrument_id):
+    """
+    Collect the users whose cached listings show an instrument.
+
+    Must run before the rows it reads (instrument, loan requests, loans) are deleted.
+
+    Returns:
+        tuple: (owner_id or None, set of requester and borrower user ids)
+    """
+    cursor.execute("SELECT owner_id FROM instruments WHERE instrument_id = %s", (instrument_id,))
+    instrument = cursor.fetchone()
+    audience_query = """
+        SELECT requester_id FROM loanrequests WHERE instrument_id = %s
+        UNION
+        SELECT borrower_id FROM loans WHERE instrument_id = %s
+    """
+    cursor.execute(audience_query, (instrument_id, instrument_id))
+    user_ids = {row[0] for row in cursor.fetchall()}
+    return (instrument[0] if instrument else None), user_ids
+
+
+def invalidate_owner(owner_id):
+    """Invalidate after an instrument of owner_id was added"""
+    listing_cache.invalidate(INSTRUMENTS_BY_USER, owner_id)
+    listing_cache.invalidate(INSTRUMENTS_BROWSE)
+
+
+def invalidate_instrument(audience):
+    """Invalidate after an instrument (or its rating) changed, audience from instrument_audience"""
+    owner_id, user_ids = audience
+    if owner_id is not None:
+        listing_cache.invalidate(INSTRUMENTS_BY_USER, owner_id)
+    listing_cache.invalidate(INSTRUMENTS_BROWSE)
+    for user_id in user_ids:
+        listing_cache.invalidate(LOAN_REQUESTS, user_id)
+
+
+def invalidate_requesters(user_ids):
+    """Invalidate after loan requests or loans of these users were created or removed"""
+    for user_id in user_ids:
+        listing_cache.invalidate(INSTRUMENTS_BROWSE, user_id)
+        listing_cache.invalidate(LOAN_REQUESTS, user_id)
+
+
+def invalidate_profile(user_id):
+    """Invalidate after the profile of user_id was updated"""
+    profile_cache.pop((PROFILES, user_id, None))
@@ -1,28 +1,268 @@
 """DB Helper"""
 import os
+import threading
+import time
+from contextlib import contextmanager
+from mysql.connector.errors import Error as MySQLError, PoolError
 from mysql.connector.pooling import MySQLConnectionPool
+from helper.sql_timing_helper import TimedCursor
 
-DB_HOST = os.environ.get('DB_HOST')
-DB_NAME = os.environ.get('DB_NAME')
-DB_USER = os.environ.get('DB_USER')
-DB_PASSWORD = os.environ.get('DB_PASSWORD')
-DB_POOLNAME = os.environ.get('DB_POOLNAME')
-POOL_SIZE = int(os.environ.get('POOL_SIZE'))
+# The pool is created on first use, once per process: a forked worker never reuses the parent's sockets.
+# Settings are read from the environment at that point so values loaded by python-dotenv are honoured.
+_pool = None
+_pool_settings = {}
+_pool_slots = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_pool_stats = {}
 
-db_pool = MySQLConnectionPool(
-    host=DB_HOST,
-    user=DB_USER,
-    password=DB_PASSWORD,
-    database=DB_NAME,
-    pool_size=POOL_SIZE,  # define pool size connection
-    pool_name=DB_POOLNAME
-)
+
+def _reset_stats():
+    """Zero the pool metrics"""
+    _pool_stats.update({
+        "checkouts": 0,
+        "wait_time_total": 0.0,
+        "wait_time_max": 0.0,
+        "in_use": 0,
+        "in_use_max": 0,
+        "exhausted": 0,
+    })
+
+
+_reset_stats()
+
+
+def _after_fork_in_child():
+    """Forget the parent's pool without closing it, its sockets still belong to the parent"""
+    global _pool, _pool_slots, _pool_pid, _pool_lock, _stats_lock  # pylint: disable=global-statement
+    _pool = None
+    _pool_slots = None
+    _pool_pid = None
+    _pool_lock = threading.Lock()
+    _stats_lock = threading.Lock()
+    _pool_settings.clear()
+    _reset_stats()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+def get_pool_size():
+    """Pool size from POOL_SIZE, defaults to 5"""
+    return int(os.environ.get('POOL_SIZE') or 5)
+
+
+def _read_settings():
+    """Pool settings from the environment"""
+    return {
+        "pool_size": get_pool_size(),
+        "wait_timeout": float(os.environ.get('POOL_TIMEOUT') or 5),  # seconds to wait for a free connection
+    }
+
+
+def get_pool():
+    """
+    Get the db pool of the current process, creating it on first use.
+
+    Returns:
+        MySQLConnectionPool: Pool configured from the DB_* and POOL_SIZE environment variables.
+    """
+    global _pool, _pool_slots, _pool_pid  # pylint: disable=global-statement
+    pid = os.getpid()
+    if _pool is not None and _pool_pid == pid:
+        return _pool
+
+    with _pool_lock:
+        if _pool is None or _pool_pid != pid:
+            settings = _read_settings()
+            pool_size = settings["pool_size"]
+            _pool = MySQLConnectionPool(
+                host=os.environ.get('DB_HOST'),
+                user=os.environ.get('DB_USER'),
+                password=os.environ.get('DB_PASSWORD'),
+                database=os.environ.get('DB_NAME'),
+                pool_size=pool_size,  # define pool size connection
+                pool_name=os.environ.get('DB_POOLNAME') or 'db_pool'
+            )
+            # One slot per pooled connection, waiting on it replaces the immediate PoolError
+            _pool_slots = threading.BoundedSemaphore(pool_size)
+            _pool_settings.update(settings)
+            _pool_pid = pid
+    return _pool
 
 
 def get_connection():
     """
-    Get connection db connection from db pool
+    Get connection db connection from db pool.
+
+    The caller owns the connection and must close it, prefer db_connection,
+    db_cursor or db_transaction which always return it to the pool.
     """
-    connection = db_pool.get_connection()
+    connection = get_pool().get_connection()
     connection.autocommit = True
     return connection
+
+
+def _checkout(wait_timeout=None):
+    """
+    Wait up to POOL_TIMEOUT (or wait_timeout) seconds for a free slot and take a connection.
+
+    The pool already checks the connection with is_connected() and reconnects a dropped one,
+    so no extra ping is sent here.
+    """
+    pool = get_pool()
+    slots = _pool_slots
+    started = time.perf_counter()
+    if wait_timeout is None:
+        wait_timeout = _pool_settings["wait_timeout"]
+    if not slots.acquire(timeout=wait_timeout):
+        with _stats_lock:
+            _pool_stats["exhausted"] += 1
+        raise PoolError(f"No connection available in pool '{pool.pool_name}' after {wait_timeout}s")
+    try:
+        connection = get_connection()
+    except Exception:
+        slots.release()
+        raise
+    waited = time.perf_counter() - started
+
+    with _stats_lock:
+        _pool_stats["checkouts"] += 1
+        _pool_stats["wait_time_total"] += waited
+        _pool_stats["wait_time_max"] = max(_pool_stats["wait_time_max"], waited)
+        _pool_stats["in_use"] += 1
+        _pool_stats["in_use_max"] = max(_pool_stats["in_use_max"], _pool_stats["in_use"])
+    return connection
+
+
+def _checkin(connection):
+    """Return a connection taken with _checkout to the pool"""
+    try:
+        connection.close()
+    finally:
+        _pool_slots.release()
+        with _stats_lock:
+            _pool_stats["in_use"] -= 1
+
+
+def _discard_unread(connection):
+    """Discard rows the caller left unread, they would block commit, rollback and close"""
+    if connection.unread_result:
+        connection.consume_results()
+
+
+@contextmanager
+def db_connection():
+    """
+    Context managed pool connection, always returned to the pool on exit.
+
+    Yields:
+        PooledMySQLConnection: Connection in autocommit mode.
+
+    Raises:
+        PoolError: If no connection frees up within POOL_TIMEOUT seconds.
+    """
+    connection = _checkout()
+    try:
+        yield connection
+    finally:
+        _checkin(connection)
+
+
+@contextmanager
+def db_cursor(**cursor_kwargs):
+    """
+    Context managed cursor on an autocommit pool connection.
+
+    Args:
+        **cursor_kwargs: Passed to connection.cursor(), e.g. dictionary=True.
+
+    Yields:
+        MySQLCursor: Cursor closed, and its connection returned, on exit.
+    """
+    with db_connection() as connection:
+        cursor = TimedCursor(connection.cursor(**cursor_kwargs))
+        try:
+            yield cursor
+        finally:
+            _discard_unread(connection)
+            cursor.close()
+
+
+@contextmanager
+def db_transaction(**cursor_kwargs):
+    """
+    Context managed cursor running inside a single transaction.
+
+    Commits when the block exits normally, rolls back when it raises.
+
+    Args:
+        **cursor_kwargs: Passed to connection.cursor(), e.g. dictionary=True.
+
+    Yields:
+        MySQLCursor: Cursor closed, and its connection returned, on exit.
+    """
+    with db_connection() as connection:
+        cursor = TimedCursor(connection.cursor(**cursor_kwargs))
+        connection.start_transaction()
+        try:
+            yield cursor
+        except BaseException:
+            _discard_unread(connection)
+            connection.rollback()
+            raise
+        else:
+            _discard_unread(connection)
+            connection.commit()
+        finally:
+            cursor.close()
+
+
+def warmup_pool(count):
+    """
+    Open and ping up to count connections so the first requests do not pay for the handshake.
+
+    Returns:
+        int: Number of connections that answered the ping.
+    """
+    count = min(count, get_pool_size())
+    connections = []
+    try:
+        for _ in range(count):
+            connections.append(_checkout())
+    finally:
+        for connection in connections:
+            _checkin(connection)
+    return len(connections)
+
+
+def check_pool(wait_timeout=1.0):
+    """
+    Readiness probe: take a pool connection within wait_timeout seconds and ping the server.
+
+    Returns:
+        tuple: (True, None) when the database answered, else (False, reason).
+    """
+    try:
+        connection = _checkout(wait_timeout)
+    except MySQLError as error:  # PoolError when exhausted, or the server is unreachable
+        return False, str(error)
+    try:
+        connection.ping()
+    except MySQLError as error:
+        return False, str(error)
+    finally:
+        _checkin(connection)
+    return True, None
+
+
+def pool_stats():
+    """Snapshot of the pool metrics: checkouts, wait time, in use and exhaustion events"""
+    with _stats_lock:
+        stats = dict(_pool_stats)
+    # Before the first checkout the pool does not exist yet, report the settings it will use
+    stats.update(_pool_settings or _read_settings())
+    stats["wait_time_avg"] = stats["wait_time_total"] / stats["checkouts"] if stats["checkouts"] else 0.0
+    return stats
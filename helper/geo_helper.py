@@ -0,0 +1,147 @@
+"""Helper for instrument coordinates: offline gazetteer lookup and geohash radius search"""
+import csv
+import math
+import os
+import re
+import threading
+
+GAZETTEER_PATH = os.path.join(os.path.dirname(__file__), '..', 'stuff', 'gazetteer.csv')
+GEOHASH_PRECISION = 9  # ~5 m cells, stored in instruments.geohash
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = 111.32
+
+_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+_WHITESPACE = re.compile(r'\s+')
+
+_gazetteer = None
+_gazetteer_lock = threading.Lock()
+
+
+def _normalize(name):
+    return _WHITESPACE.sub(' ', name.strip().lower())
+
+
+def _load_gazetteer(path=GAZETTEER_PATH):
+    """Place name to (latitude, longitude), read once per process"""
+    global _gazetteer  # pylint: disable=global-statement
+    with _gazetteer_lock:
+        if _gazetteer is None:
+            places = {}
+            if os.path.exists(path):
+                with open(path, encoding='utf-8', newline='') as gazetteer_file:
+                    for row in csv.DictReader(gazetteer_file):
+                        places[_normalize(row['name'])] = (float(row['latitude']), float(row['longitude']))
+            _gazetteer = places
+    return _gazetteer
+
+
+def resolve_location(location):
+    """
+    Look a free text location up in the offline gazetteer.
+
+    The whole text is tried first, then its comma separated parts from the most general (last)
+    one, so "Kemang, Jakarta Selatan" resolves through "jakarta selatan".
+
+    Returns:
+        tuple: (latitude, longitude), or None when the place is unknown.
+    """
+    if not location:
+        return None
+    places = _load_gazetteer()
+    candidates = [location] + list(reversed(location.split(',')))
+    for candidate in candidates:
+        coordinates = places.get(_normalize(candidate))
+        if coordinates:
+            return coordinates
+    return None
+
+
+def parse_coordinates(latitude, longitude):
+    """
+    Validate client supplied coordinates.
+
+    Returns:
+        tuple: (latitude, longitude) as floats, or None when either one is missing.
+
+    Raises:
+        ValueError: If they are not numbers in range.
+    """
+    if latitude in (None, '') or longitude in (None, ''):
+        return None
+    latitude, longitude = float(latitude), float(longitude)
+    if not -90 <= latitude <= 90 or not -180 <= longitude <= 180:
+        raise ValueError("Coordinates out of range")
+    return latitude, longitude
+
+
+def encode_geohash(latitude, longitude, precision=GEOHASH_PRECISION):
+    """Standard base32 geohash of a point"""
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    geohash, bits, bit_count, even = [], 0, 0, True
+    while len(geohash) < precision:
+        value, value_range = (longitude, lon_range) if even else (latitude, lat_range)
+        middle = (value_range[0] + value_range[1]) / 2
+        bits <<= 1
+        if value >= middle:
+            bits |= 1
+            value_range[0] = middle
+        else:
+            value_range[1] = middle
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            geohash.append(_BASE32[bits])
+            bits, bit_count = 0, 0
+    return ''.join(geohash)
+
+
+def _cell_size_km(precision, latitude):
+    """(height, width) in km of a geohash cell at this latitude"""
+    lon_bits = math.ceil(precision * 5 / 2)
+    lat_bits = precision * 5 // 2
+    height = 180.0 / 2 ** lat_bits * KM_PER_DEGREE
+    width = 360.0 / 2 ** lon_bits * KM_PER_DEGREE * max(math.cos(math.radians(latitude)), 0.01)
+    return height, width
+
+
+def covering_prefixes(latitude, longitude, radius_km):
+    """
+    Geohash prefixes whose cells together cover a circle.
+
+    Uses the finest precision whose cells are at least radius_km on each side, so the center
+    cell and its 8 neighbours contain the whole circle.
+
+    Returns:
+        list: Distinct prefixes, each one an index range scan on instruments.geohash.
+    """
+    precision = 1
+    for candidate in range(1, GEOHASH_PRECISION + 1):
+        if min(_cell_size_km(candidate, latitude)) < radius_km:
+            break
+        precision = candidate
+    height, width = _cell_size_km(precision, latitude)
+    lat_step = height / KM_PER_DEGREE
+    lon_step = width / (KM_PER_DEGREE * max(math.cos(math.radians(latitude)), 0.01))
+    prefixes = set()
+    for d_lat in (-1, 0, 1):
+        for d_lon in (-1, 0, 1):
+            neighbour_lat = max(-90.0, min(90.0, latitude + d_lat * lat_step))
+            neighbour_lon = (longitude + d_lon * lon_step + 180.0) % 360.0 - 180.0
+            prefixes.add(encode_geohash(neighbour_lat, neighbour_lon, precision))
+    return sorted(prefixes)
+
+
+def location_columns(location, latitude=None, longitude=None):
+    """
+    Coordinates and geohash to store for an instrument, client coordinates win over the gazetteer.
+
+    Returns:
+        tuple: (latitude, longitude, geohash), all None when the location cannot be placed.
+
+    Raises:
+        ValueError: If the client coordinates are invalid.
+    """
+    coordinates = parse_coordinates(latitude, longitude) or resolve_location(location)
+    if coordinates is None:
+        return None, None, None
+    return coordinates[0], coordinates[1], encode_geohash(*coordinates)
@@ -0,0 +1,213 @@
+"""Background removal of orphaned images: a cleanup queue fed by the handlers and a periodic reconciler
+
+A file is only removed when no instruments.image / users.profile_picture row points at it and it is
+older than the grace period. commit_file refreshes the mtime when an upload reuses a stored file,
+so an upload whose row is not committed yet is never collected.
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from helper.db_helper import db_cursor
+from helper.image_helper import VARIANT_FOLDER
+from helper.image_storage import STORAGE_ROOT, TMP_FOLDER, image_path, unlink_image
+
+GC_GRACE_SECONDS = int(os.environ.get('IMAGE_GC_GRACE', 3600))
+GC_BATCH_SIZE = int(os.environ.get('IMAGE_GC_BATCH', 500))
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_pid = None
+_lock = threading.Lock()
+_stats = {"queued": 0, "scanned": 0, "removed": 0, "bytes_reclaimed": 0, "errors": 0}
+
+
+def _count(**increments):
+    with _lock:
+        for name, value in increments.items():
+            _stats[name] += value
+
+
+def _get_executor():
+    """Single cleanup worker of the current process, created on first use so forked workers get their own"""
+    global _executor, _executor_pid  # pylint: disable=global-statement
+    with _lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='image-gc')
+            _executor_pid = os.getpid()
+    return _executor
+
+
+def _referenced(cursor, keys):
+    """Keys of the batch that a row still points at"""
+    placeholders = ', '.join(['%s'] * len(keys))
+    cursor.execute(f"""
+        SELECT image FROM instruments WHERE image IN ({placeholders})
+        UNION
+        SELECT profile_picture FROM users WHERE profile_picture IN ({placeholders})
+    """, (*keys, *keys))
+    return {row[0] for row in cursor.fetchall()}
+
+
+def collect(keys, grace=GC_GRACE_SECONDS, dry_run=False):
+    """
+    Remove the stored images of keys that are unreferenced and older than the grace period.
+
+    Returns:
+        tuple: (number of images removed, bytes reclaimed including variants)
+    """
+    keys = [key for key in keys if os.path.isfile(image_path(key))]
+    if not keys:
+        return 0, 0
+    with db_cursor() as cursor:
+        orphans = set(keys) - _referenced(cursor, keys)
+        cutoff = time.time() - grace
+        orphans = sorted(key for key in orphans if os.path.getmtime(image_path(key)) < cutoff)
+        if orphans and not dry_run:
+            # Drop counts that drifted, the rows are the source of truth
+            placeholders = ', '.join(['%s'] * len(orphans))
+            cursor.execute(f"DELETE FROM image_refs WHERE image_key IN ({placeholders})", orphans)
+
+    reclaimed = 0
+    for key in orphans:
+        if dry_run:
+            reclaimed += os.path.getsize(image_path(key))
+        else:
+            reclaimed += unlink_image(key)
+    if not dry_run:
+        _count(removed=len(orphans), bytes_reclaimed=reclaimed)
+    return len(orphans), reclaimed
+
+
+def _collect_released(key):
+    try:
+        collect([key])
+    except Exception:  # pylint: disable=broad-except
+        # The reconciler picks the file up on its next pass
+        _count(errors=1)
+        logger.exception("Failed to remove released image %s", key)
+
+
+def queue_release(key):
+    """Queue an image whose last reference was committed away, instead of unlinking it in the request"""
+    if not key:
+        return None
+    _count(queued=1)
+    return _get_executor().submit(_collect_released, key)
+
+
+def iter_image_keys(after=None):
+    """
+    Keys of the stored images in a stable order, variants and temp files excluded.
+
+    Args:
+        after (str): Resume after this key, subtrees sorting before it are not listed.
+    """
+    after_parts = after.split('/') if after else None
+
+    def walk(directory, prefix):
+        for name in sorted(os.listdir(directory)):
+            if name.startswith('.') or (not prefix and name == VARIANT_FOLDER):
+                continue
+            parts = prefix + [name]
+            if after_parts and parts < after_parts[:len(parts)]:
+                continue
+            path = os.path.join(directory, name)
+            if os.path.isdir(path):
+                yield from walk(path, parts)
+            elif not after_parts or parts > after_parts:
+                yield '/'.join(parts)
+
+    if os.path.isdir(STORAGE_ROOT):
+        yield from walk(STORAGE_ROOT, [])
+
+
+def remove_stale_uploads(grace=GC_GRACE_SECONDS, dry_run=False):
+    """
+    Remove temp files left behind by interrupted uploads.
+
+    Returns:
+        int: Bytes reclaimed.
+    """
+    tmp_dir = os.path.join(STORAGE_ROOT, TMP_FOLDER)
+    if not os.path.isdir(tmp_dir):
+        return 0
+    cutoff = time.time() - grace
+    reclaimed = 0
+    for name in os.listdir(tmp_dir):
+        path = os.path.join(tmp_dir, name)
+        if os.path.isfile(path) and os.path.getmtime(path) < cutoff:
+            reclaimed += os.path.getsize(path)
+            if not dry_run:
+                os.remove(path)
+    if not dry_run:
+        _count(bytes_reclaimed=reclaimed)
+    return reclaimed
+
+
+def reconcile(after=None, max_batches=None, batch_size=GC_BATCH_SIZE, grace=GC_GRACE_SECONDS, dry_run=False):
+    """
+    Compare the storage folder with the DB rows batch by batch and remove the orphans.
+
+    Args:
+        after (str): Key the previous incremental pass stopped at, None starts from the beginning.
+        max_batches (int): Stop after this many batches, None walks the whole folder.
+
+    Returns:
+        dict: scanned, removed, bytes_reclaimed and next_after (None once the folder is done).
+    """
+    report = {"scanned": 0, "removed": 0, "bytes_reclaimed": 0, "next_after": None}
+    batch = []
+    batches = 0
+
+    def flush():
+        removed, reclaimed = collect(batch, grace, dry_run)
+        report["scanned"] += len(batch)
+        report["removed"] += removed
+        report["bytes_reclaimed"] += reclaimed
+        report["next_after"] = batch[-1]
+        _count(scanned=len(batch))
+        batch.clear()
+
+    for key in iter_image_keys(after):
+        batch.append(key)
+        if len(batch) >= batch_size:
+            flush()
+            batches += 1
+            if max_batches is not None and batches >= max_batches:
+                return report
+    if batch:
+        flush()
+    report["next_after"] = None
+    report["bytes_reclaimed"] += remove_stale_uploads(grace, dry_run)
+    return report
+
+
+def run_reconciler(interval, max_batches=1, grace=GC_GRACE_SECONDS, dry_run=False):
+    """
+    Run reconcile every `interval` seconds, max_batches batches per pass, until interrupted.
+
+    Meant for a single process per storage folder (`flask gc-images --every`, started once by
+    gunicorn's master), several reconcilers would repeat the same scans and race on the same files.
+    """
+    after = None
+    while True:
+        time.sleep(interval)
+        try:
+            report = reconcile(after, max_batches, grace=grace, dry_run=dry_run)
+        except Exception:  # pylint: disable=broad-except
+            _count(errors=1)
+            logger.exception("Image reconciler pass failed")
+            continue
+        after = report["next_after"]
+        if report["removed"] or report["bytes_reclaimed"]:
+            logger.info("Image GC removed %d orphan(s), reclaimed %d bytes",
+                        report["removed"], report["bytes_reclaimed"])
+
+
+def gc_stats():
+    """Counters of the cleanup queue and the reconciler in this process"""
+    with _lock:
+        return dict(_stats)
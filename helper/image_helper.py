@@ -0,0 +1,103 @@
+"""Helper to build resized image variants (thumb/medium/full) in the background"""
+import os
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional, without it the originals are always served
+    Image = None
+
+UPLOAD_FOLDER = "img"
+VARIANT_FOLDER = "variants"
+# Longest edge in pixels of each variant
+VARIANT_SIZES = {"thumb": 160, "medium": 640, "full": 1600}
+VARIANT_FORMATS = {"webp": ("WEBP", {"quality": 80, "method": 4}), "jpg": ("JPEG", {"quality": 85, "optimize": True})}
+IMAGE_WORKERS = int(os.environ.get('IMAGE_WORKERS', 2))
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    """Worker pool of the current process, created on first use so forked workers get their own"""
+    global _executor, _executor_pid  # pylint: disable=global-statement
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix='image-variants')
+            _executor_pid = os.getpid()
+    return _executor
+
+
+def variant_name(image_name, size, extension):
+    """Path of a variant relative to UPLOAD_FOLDER"""
+    stem = os.path.splitext(image_name)[0]
+    return os.path.join(VARIANT_FOLDER, f"{stem}_{size}.{extension}")
+
+
+def find_variant(image_name, size, extension):
+    """
+    Get the variant of an image if it has been generated already.
+
+    Returns:
+        str: Path relative to UPLOAD_FOLDER, or None when the variant is not ready (or unknown).
+    """
+    if size not in VARIANT_SIZES or extension not in VARIANT_FORMATS:
+        return None
+    name = variant_name(image_name, size, extension)
+    if os.path.exists(os.path.join(UPLOAD_FOLDER, name)):
+        return name
+    return None
+
+
+def _generate_variants(image_name):
+    """Resize an uploaded image into every size and format, each file appears atomically when complete"""
+    source_path = os.path.join(UPLOAD_FOLDER, image_name)
+    try:
+        with Image.open(source_path) as source:
+            source = ImageOps.exif_transpose(source)
+            for size, edge in VARIANT_SIZES.items():
+                variant = source.copy()
+                variant.thumbnail((edge, edge))
+                if variant.mode not in ("RGB", "RGBA"):
+                    variant = variant.convert("RGBA" if "transparency" in variant.info else "RGB")
+                for extension, (image_format, options) in VARIANT_FORMATS.items():
+                    target = os.path.join(UPLOAD_FOLDER, variant_name(image_name, size, extension))
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    image = variant.convert("RGB") if image_format == "JPEG" else variant
+                    tmp_path = f"{target}.{os.getpid()}.tmp"
+                    image.save(tmp_path, image_format, **options)
+                    os.replace(tmp_path, target)
+    except Exception:  # pylint: disable=broad-except
+        # The original keeps being served, a broken upload must not take the worker down
+        logger.exception("Failed to build variants for %s", image_name)
+
+
+def schedule_variants(image_name):
+    """Queue the variants of an uploaded image for generation, no-op without Pillow"""
+    if Image is None or not image_name:
+        return None
+    return _get_executor().submit(_generate_variants, image_name)
+
+
+def remove_variants(image_name):
+    """
+    Delete the generated variants of an image.
+
+    Returns:
+        int: Bytes freed.
+    """
+    freed = 0
+    if not image_name:
+        return freed
+    for size in VARIANT_SIZES:
+        for extension in VARIANT_FORMATS:
+            path = os.path.join(UPLOAD_FOLDER, variant_name(image_name, size, extension))
+            if os.path.exists(path):
+                freed += os.path.getsize(path)
+                os.remove(path)
+    return freed
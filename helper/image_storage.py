@@ -0,0 +1,200 @@
+"""Content-addressed, sharded image storage with reference counting
+
+Uploads are stored once per distinct content under ``ab/cd/<sha256>.<ext>`` inside STORAGE_ROOT.
+The DB table ``image_refs`` counts the rows (instruments.image, users.profile_picture) pointing
+at each key, a file is only unlinked when its last reference goes away.
+"""
+import hashlib
+import os
+import shutil
+import uuid
+from helper.image_helper import remove_variants
+
+STORAGE_ROOT = "img"
+TMP_FOLDER = ".tmp"
+CHUNK_SIZE = 64 * 1024
+
+
+def image_key(digest, extension):
+    """Storage key of a content hash, relative to STORAGE_ROOT"""
+    return f"{digest[:2]}/{digest[2:4]}/{digest}{extension.lower()}"
+
+
+def image_path(key):
+    """Filesystem path of a storage key"""
+    return os.path.join(STORAGE_ROOT, key)
+
+
+def commit_file(tmp_path, digest, extension):
+    """Move a fully written temp file to its content address, dropping it if the content is stored already"""
+    key = image_key(digest, extension)
+    target = image_path(key)
+    if os.path.exists(target):
+        os.remove(tmp_path)
+        # Restart the GC grace period, the new reference is not committed yet
+        os.utime(target)
+    else:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(tmp_path, target)
+    return key
+
+
+def store_stream(stream, extension):
+    """
+    Hash a stream while writing it to disk and store it under its content address.
+
+    Args:
+        stream: Binary file-like object positioned at the start of the content.
+        extension (str): File extension including the dot, e.g. '.jpg'.
+
+    Returns:
+        str: Storage key, identical for identical content.
+    """
+    tmp_dir = os.path.join(STORAGE_ROOT, TMP_FOLDER)
+    os.makedirs(tmp_dir, exist_ok=True)
+    tmp_path = os.path.join(tmp_dir, uuid.uuid4().hex)
+    digest = hashlib.sha256()
+    try:
+        with open(tmp_path, 'wb') as tmp_file:
+            for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+                tmp_file.write(chunk)
+        return commit_file(tmp_path, digest.hexdigest(), extension)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def store_upload(uploaded_file):
+    """
+    Store a werkzeug FileStorage, see store_stream.
+
+    Files spooled by helper.upload_helper.UploadRequest are already hashed in TMP_FOLDER, they are
+    only moved and stored under their sniffed type rather than the client's file name.
+    """
+    from helper.upload_helper import SniffedUpload  # pylint: disable=import-outside-toplevel
+    if isinstance(uploaded_file.stream, SniffedUpload):
+        return uploaded_file.stream.commit()
+    extension = os.path.splitext(uploaded_file.filename)[1]
+    return store_stream(uploaded_file.stream, extension)
+
+
+def add_ref(cursor, key):
+    """Count one more row pointing at key, run in the transaction that writes the row"""
+    cursor.execute("""
+        INSERT INTO image_refs (image_key, ref_count) VALUES (%s, 1)
+        ON DUPLICATE KEY UPDATE ref_count = ref_count + 1
+    """, (key,))
+
+
+def release_ref(cursor, key):
+    """
+    Count one row less pointing at key, run in the transaction that removes or repoints the row.
+
+    Returns:
+        bool: True when nothing references key anymore, the caller unlinks it after commit.
+    """
+    if not key:
+        return False
+    cursor.execute("SELECT ref_count FROM image_refs WHERE image_key = %s FOR UPDATE", (key,))
+    row = cursor.fetchone()
+    if row is None:
+        # Not tracked, e.g. a legacy flat file that is not migrated yet: it had this one reference
+        return True
+    if row[0] > 1:
+        cursor.execute("UPDATE image_refs SET ref_count = ref_count - 1 WHERE image_key = %s", (key,))
+        return False
+    cursor.execute("DELETE FROM image_refs WHERE image_key = %s", (key,))
+    return True
+
+
+def unlink_image(key):
+    """
+    Remove a stored image and its variants from disk, see helper.image_gc for when it is safe to.
+
+    Returns:
+        int: Bytes freed.
+    """
+    freed = 0
+    path = image_path(key)
+    if os.path.exists(path):
+        freed += os.path.getsize(path)
+        os.remove(path)
+    return freed + remove_variants(key)
+
+
+def rebuild_refs(cursor):
+    """
+    Recompute image_refs from instruments.image and users.profile_picture.
+
+    Returns:
+        int: Number of distinct keys referenced.
+    """
+    cursor.execute("DELETE FROM image_refs")
+    cursor.execute("""
+        INSERT INTO image_refs (image_key, ref_count)
+        SELECT image_key, COUNT(*) FROM (
+            SELECT image AS image_key FROM instruments WHERE image IS NOT NULL AND image <> ''
+            UNION ALL
+            SELECT profile_picture FROM users WHERE profile_picture IS NOT NULL AND profile_picture <> ''
+        ) refs
+        GROUP BY image_key
+    """)
+    return cursor.rowcount
+
+
+def link_flat_files():
+    """
+    First step of the migration: link the flat, UUID-named files of STORAGE_ROOT into the sharded layout.
+
+    The old names stay in place until the DB rows are repointed, duplicates collapse into one key.
+
+    Returns:
+        dict: Old file name to storage key.
+    """
+    mapping = {}
+    for name in sorted(os.listdir(STORAGE_ROOT)):
+        path = os.path.join(STORAGE_ROOT, name)
+        if name.startswith('.') or not os.path.isfile(path):
+            continue
+        digest = hashlib.sha256()
+        with open(path, 'rb') as source:
+            for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+        key = image_key(digest.hexdigest(), os.path.splitext(name)[1])
+        target = image_path(key)
+        if not os.path.exists(target):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            try:
+                os.link(path, target)
+            except OSError:
+                shutil.copy2(path, target)
+        mapping[name] = key
+    return mapping
+
+
+def repoint_rows(cursor, mapping):
+    """
+    Second step of the migration: point instruments and users at the storage keys and rebuild image_refs.
+
+    Returns:
+        int: Number of rows updated.
+    """
+    rows_updated = 0
+    for name, key in mapping.items():
+        cursor.execute("UPDATE instruments SET image = %s WHERE image = %s", (key, name))
+        rows_updated += cursor.rowcount
+        cursor.execute("UPDATE users SET profile_picture = %s WHERE profile_picture = %s", (key, name))
+        rows_updated += cursor.rowcount
+    rebuild_refs(cursor)
+    return rows_updated
+
+
+def remove_flat_files(mapping):
+    """Last step of the migration, once the repointed rows are committed: drop the old names and variants"""
+    for name in mapping:
+        path = os.path.join(STORAGE_ROOT, name)
+        if os.path.exists(path):
+            os.remove(path)
+        remove_variants(name)
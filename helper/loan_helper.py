@@ -0,0 +1,112 @@
+"""Loan workflow statements: guarded loan request creation, transactional accept and return"""
+from datetime import datetime
+from mysql.connector import errorcode
+from mysql.connector.errors import IntegrityError
+from helper.cache_helper import instrument_audience
+
+REQUEST_CREATED = "created"
+REQUEST_DUPLICATE = "duplicate"
+REQUEST_OWN_INSTRUMENT = "own_instrument"
+REQUEST_INSTRUMENT_NOT_FOUND = "instrument_not_found"
+REQUEST_REQUESTER_NOT_FOUND = "requester_not_found"
+
+
+def create_loan_request(cursor, instrument_id, requester_id, message):
+    """
+    Insert a loan request unless the instrument is missing or owned by the requester.
+
+    The happy path is a single INSERT ... SELECT, duplicates are rejected by the unique
+    (instrument_id, requester_id) key. Only a rejected insert costs a second query, to tell the caller why.
+
+    Returns:
+        str: One of the REQUEST_* outcomes.
+    """
+    try:
+        cursor.execute("""
+            INSERT INTO loanrequests (instrument_id, requester_id, request_date, message)
+            SELECT i.instrument_id, %s, %s, %s
+            FROM instruments i
+            WHERE i.instrument_id = %s AND i.owner_id <> %s
+        """, (requester_id, datetime.now(), message, instrument_id, requester_id))
+    except IntegrityError as error:
+        if error.errno == errorcode.ER_DUP_ENTRY:
+            return REQUEST_DUPLICATE
+        if error.errno == errorcode.ER_NO_REFERENCED_ROW_2:
+            return REQUEST_REQUESTER_NOT_FOUND
+        raise
+    if cursor.rowcount > 0:
+        return REQUEST_CREATED
+
+    cursor.execute("SELECT owner_id FROM instruments WHERE instrument_id = %s", (instrument_id,))
+    instrument = cursor.fetchone()
+    if instrument is None:
+        return REQUEST_INSTRUMENT_NOT_FOUND
+    return REQUEST_OWN_INSTRUMENT
+
+
+# instruments.availability_status values written by the loan workflow, the browse feed lists 1 and 2
+STATUS_ON_LOAN = 0
+STATUS_AVAILABLE = 1
+
+LOAN_ACCEPTED = "accepted"
+LOAN_RETURNED = "returned"
+LOAN_INSTRUMENT_NOT_FOUND = "instrument_not_found"
+LOAN_ALREADY_ON_LOAN = "already_on_loan"
+LOAN_NOT_REQUESTED = "not_requested"
+LOAN_NOT_ON_LOAN = "not_on_loan"
+
+
+def _lock_instrument(cursor, instrument_id):
+    """Lock the instrument row for the rest of the transaction, concurrent accepts/returns queue here"""
+    cursor.execute("SELECT availability_status FROM instruments WHERE instrument_id = %s FOR UPDATE",
+                   (instrument_id,))
+    row = cursor.fetchone()
+    return None if row is None else row[0]
+
+
+def accept_loan(cursor, instrument_id, borrower_id):
+    """
+    Lend an instrument to one of its requesters, run inside db_transaction.
+
+    Inserts the loan, clears every loan request of the instrument and marks it on loan.
+
+    Returns:
+        tuple: (one of the LOAN_* outcomes, instrument_audience or None when nothing changed)
+    """
+    status = _lock_instrument(cursor, instrument_id)
+    if status is None:
+        return LOAN_INSTRUMENT_NOT_FOUND, None
+    if status == STATUS_ON_LOAN:
+        return LOAN_ALREADY_ON_LOAN, None
+    cursor.execute("SELECT 1 FROM loanrequests WHERE instrument_id = %s AND requester_id = %s",
+                   (instrument_id, borrower_id))
+    if cursor.fetchone() is None:
+        return LOAN_NOT_REQUESTED, None
+
+    audience = instrument_audience(cursor, instrument_id)
+    cursor.execute("INSERT INTO loans (instrument_id, borrower_id, loan_date) VALUES (%s, %s, %s)",
+                   (instrument_id, borrower_id, datetime.now()))
+    cursor.execute("DELETE FROM loanrequests WHERE instrument_id = %s", (instrument_id,))
+    cursor.execute("UPDATE instruments SET availability_status = %s WHERE instrument_id = %s",
+                   (STATUS_ON_LOAN, instrument_id))
+    return LOAN_ACCEPTED, audience
+
+
+def return_loan(cursor, instrument_id):
+    """
+    Close the loan of an instrument and make it available again, run inside db_transaction.
+
+    Returns:
+        tuple: (one of the LOAN_* outcomes, instrument_audience or None when nothing changed)
+    """
+    status = _lock_instrument(cursor, instrument_id)
+    if status is None:
+        return LOAN_INSTRUMENT_NOT_FOUND, None
+    if status != STATUS_ON_LOAN:
+        return LOAN_NOT_ON_LOAN, None
+
+    audience = instrument_audience(cursor, instrument_id)
+    cursor.execute("DELETE FROM loans WHERE instrument_id = %s", (instrument_id,))
+    cursor.execute("UPDATE instruments SET availability_status = %s WHERE instrument_id = %s",
+                   (STATUS_AVAILABLE, instrument_id))
+    return LOAN_RETURNED, audience
@@ -0,0 +1,194 @@
+"""Prometheus metrics: per-route request counters and latency histograms, DB pool and cache gauges
+
+With PROMETHEUS_MULTIPROC_DIR set (a directory emptied before the server starts), every worker
+process writes its samples there and GET /metrics sums them across workers. The per-route metric
+children are looked up once per endpoint, a request then costs a few counter and histogram updates.
+The async read routes of asgi.py record the same series, under their blueprint endpoint names,
+through start_route_metrics/finish_route_metrics.
+"""
+import os
+import threading
+import time
+from flask import Response, g, request
+
+try:
+    from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge,
+                                   Histogram, generate_latest, multiprocess)
+except ImportError:  # prometheus_client is optional, without it /metrics is not registered
+    Counter = None
+
+from helper.cache_helper import listing_cache, profile_cache
+from helper.db_helper import pool_stats
+from helper.image_gc import gc_stats
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+# Pool, cache and GC gauges are copied from their counters at most this often per process
+GAUGE_REFRESH_SECONDS = 1.0
+NO_BLUEPRINT = 'app'
+NOT_FOUND = 'not_found'
+
+_metrics = {}
+_children = {}
+_children_lock = threading.Lock()
+_gauges_refreshed = [0.0]
+
+
+def _define_metrics():
+    labels = ('blueprint', 'endpoint')
+    _metrics.update({
+        "requests": Counter('http_requests_total', "Requests handled",
+                            labels + ('method', 'status')),
+        "latency": Histogram('http_request_duration_seconds', "Time spent handling a request",
+                             labels, buckets=LATENCY_BUCKETS),
+        "size": Histogram('http_response_size_bytes', "Size of the buffered response bodies",
+                          labels, buckets=SIZE_BUCKETS),
+        "in_flight": Gauge('http_requests_in_progress', "Requests being handled",
+                           labels, multiprocess_mode='livesum'),
+        "pool": Gauge('db_pool_connections', "DB pool connections by state",
+                      ('state',), multiprocess_mode='livesum'),
+        "pool_events": Gauge('db_pool_events', "DB pool checkouts and exhaustions since start",
+                             ('event',), multiprocess_mode='livesum'),
+        "pool_wait": Gauge('db_pool_wait_seconds_max', "Longest wait for a pool connection",
+                           multiprocess_mode='max'),
+        "cache": Gauge('cache_entries', "Entries held by the in-process caches",
+                       ('cache',), multiprocess_mode='livesum'),
+        "cache_events": Gauge('cache_events', "Hits, misses, evictions and invalidations since start",
+                              ('cache', 'event'), multiprocess_mode='livesum'),
+        "gc": Gauge('image_gc_events', "Images queued, scanned and removed and bytes reclaimed since start",
+                    ('event',), multiprocess_mode='livesum'),
+    })
+
+
+def _route_children(blueprint, endpoint):
+    """Metric children of a route, created on its first request"""
+    key = (blueprint, endpoint)
+    children = _children.get(key)
+    if children is None:
+        with _children_lock:
+            children = _children.get(key)
+            if children is None:
+                children = (_metrics["latency"].labels(blueprint, endpoint),
+                            _metrics["size"].labels(blueprint, endpoint),
+                            _metrics["in_flight"].labels(blueprint, endpoint))
+                _children[key] = children
+    return children
+
+
+def _request_counter(blueprint, endpoint, method, status):
+    key = (blueprint, endpoint, method, status)
+    counter = _children.get(key)
+    if counter is None:
+        with _children_lock:
+            counter = _children.setdefault(key, _metrics["requests"].labels(*key))
+    return counter
+
+
+def _route_labels():
+    endpoint = request.endpoint or NOT_FOUND
+    return request.blueprint or NO_BLUEPRINT, endpoint
+
+
+def refresh_gauges():
+    """Copy the pool, cache and image GC counters of this process into the gauges"""
+    stats = pool_stats()
+    pool_size = stats.get("pool_size", 0)
+    _metrics["pool"].labels('in_use').set(stats["in_use"])
+    _metrics["pool"].labels('idle').set(max(pool_size - stats["in_use"], 0))
+    for event in ("checkouts", "exhausted"):
+        _metrics["pool_events"].labels(event).set(stats[event])
+    _metrics["pool_wait"].set(stats["wait_time_max"])
+
+    for name, cache in (("listing", listing_cache), ("profile", profile_cache)):
+        cache_stats = cache.stats()
+        _metrics["cache"].labels(name).set(cache_stats["size"])
+        for event in ("hits", "misses", "evictions", "invalidations"):
+            _metrics["cache_events"].labels(name, event).set(cache_stats[event])
+
+    for event, value in gc_stats().items():
+        _metrics["gc"].labels(event).set(value)
+
+
+def _refresh_gauges_every_second():
+    now = time.monotonic()
+    if now - _gauges_refreshed[0] >= GAUGE_REFRESH_SECONDS:
+        _gauges_refreshed[0] = now
+        refresh_gauges()
+
+
+def start_route_metrics(blueprint, endpoint):
+    """
+    Count a request handled outside Flask in flight, e.g. the async read routes of asgi.py.
+
+    Returns:
+        float: Start time for finish_route_metrics, None when the metrics are not enabled.
+    """
+    if not _metrics:
+        return None
+    _route_children(blueprint, endpoint)[2].inc()
+    return time.perf_counter()
+
+
+def finish_route_metrics(started, blueprint, endpoint, method, status, size=None):
+    """Record a request started with start_route_metrics, size None for a streamed body"""
+    if started is None:
+        return
+    latency, size_histogram, in_flight = _route_children(blueprint, endpoint)
+    if size is not None:
+        size_histogram.observe(size)
+    latency.observe(time.perf_counter() - started)
+    in_flight.dec()
+    _request_counter(blueprint, endpoint, method, status).inc()
+    _refresh_gauges_every_second()
+
+
+def _metrics_view():
+    """Prometheus text exposition, summed over the workers in multiprocess mode"""
+    refresh_gauges()
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
+
+
+def init_metrics(app):
+    """
+    Register the request hooks and the GET /metrics route.
+
+    Returns:
+        bool: False when prometheus_client is not installed and nothing was registered.
+    """
+    if Counter is None:
+        return False
+    if not _metrics:
+        _define_metrics()
+
+    @app.before_request
+    def start_request_metrics():
+        g.metrics_started = time.perf_counter()
+        g.metrics_status = 500
+        _route_children(*_route_labels())[2].inc()
+
+    @app.after_request
+    def record_response_metrics(response):
+        g.metrics_status = response.status_code
+        if not response.is_streamed:
+            _route_children(*_route_labels())[1].observe(response.calculate_content_length() or 0)
+        return response
+
+    @app.teardown_request
+    def finish_request_metrics(_error):
+        started = g.pop('metrics_started', None)
+        if started is None:  # before_request did not run
+            return
+        blueprint, endpoint = _route_labels()
+        latency, _, in_flight = _route_children(blueprint, endpoint)
+        latency.observe(time.perf_counter() - started)
+        in_flight.dec()
+        _request_counter(blueprint, endpoint, request.method, g.metrics_status).inc()
+        _refresh_gauges_every_second()
+
+    app.add_url_rule('/metrics', 'metrics', _metrics_view, methods=['GET'])
+    return True
@@ -0,0 +1,161 @@
+"""Versioned schema migrations: numbered up/down SQL scripts in migrations/ and the versions applied
+
+A migration is a pair of files `<version>_<name>.up.sql` / `<version>_<name>.down.sql`. Applied
+versions are recorded in `schema_migrations`. MySQL commits DDL implicitly, so every migration is
+recorded right after its own statements ran and a failure leaves the earlier ones applied.
+"""
+import os
+import re
+
+MIGRATIONS_FOLDER = os.path.join(os.path.dirname(__file__), '..', 'migrations')
+
+_FILE_NAME = re.compile(r'^(\d+)_(\w+)\.(up|down)\.sql$')
+
+
+class MigrationError(Exception):
+    """Raised when the migration files or the recorded versions are inconsistent"""
+
+
+def discover(folder=MIGRATIONS_FOLDER):
+    """
+    Migration files of the folder.
+
+    Returns:
+        list: (version, name, up path, down path) tuples ordered by version.
+
+    Raises:
+        MigrationError: If a version has no up script or two names.
+    """
+    found = {}
+    for file_name in sorted(os.listdir(folder)):
+        match = _FILE_NAME.match(file_name)
+        if not match:
+            continue
+        version, name, direction = match.groups()
+        migration = found.setdefault(version, {"name": name})
+        if migration["name"] != name:
+            raise MigrationError(f"Migration {version} has two names: {migration['name']} and {name}")
+        migration[direction] = os.path.join(folder, file_name)
+
+    migrations = []
+    for version, migration in sorted(found.items()):
+        if "up" not in migration:
+            raise MigrationError(f"Migration {version}_{migration['name']} has no up script")
+        migrations.append((version, migration["name"], migration["up"], migration.get("down")))
+    return migrations
+
+
+def split_statements(script):
+    """Statements of a SQL script: `--` comment lines dropped, a statement ends with `;` at the end of a line"""
+    statements, current = [], []
+    for line in script.splitlines():
+        if line.strip().startswith('--') or not line.strip():
+            continue
+        current.append(line)
+        if line.rstrip().endswith(';'):
+            statements.append('\n'.join(current).rstrip().rstrip(';'))
+            current = []
+    if current:
+        statements.append('\n'.join(current))
+    return statements
+
+
+def _run_script(cursor, path):
+    with open(path, encoding='utf-8') as script_file:
+        for statement in split_statements(script_file.read()):
+            cursor.execute(statement)
+
+
+def _ensure_table(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+          version varchar(16) NOT NULL,
+          name varchar(255) NOT NULL,
+          applied_at timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP,
+          PRIMARY KEY (version)
+        )
+    """)
+
+
+def applied_versions(cursor):
+    """Versions recorded in schema_migrations, oldest first"""
+    _ensure_table(cursor)
+    cursor.execute("SELECT version FROM schema_migrations ORDER BY version")
+    return [row[0] for row in cursor.fetchall()]
+
+
+def _find_target(migrations, target):
+    if target is None:
+        return None
+    try:
+        target_number = int(target)
+    except ValueError:
+        raise MigrationError(f"Migration version must be a number, got {target!r}")
+    versions = [version for version, _, _, _ in migrations]
+    matches = [version for version in versions if int(version) == target_number]
+    if not matches:
+        raise MigrationError(f"Unknown migration version {target}")
+    return matches[0]
+
+
+def upgrade(cursor, target=None, baseline=False, folder=MIGRATIONS_FOLDER):
+    """
+    Apply the pending migrations up to and including target (all of them by default).
+
+    Args:
+        cursor: Cursor on an autocommit connection, e.g. from db_cursor.
+        baseline: Record the migrations as applied without running them, for a database
+            whose schema was created by hand before the migrations existed.
+
+    Returns:
+        list: (version, name) of the migrations applied.
+    """
+    migrations = discover(folder)
+    target = _find_target(migrations, target)
+    done = set(applied_versions(cursor))
+    applied = []
+    for version, name, up_path, _ in migrations:
+        if target is not None and version > target:
+            break
+        if version in done:
+            continue
+        if not baseline:
+            _run_script(cursor, up_path)
+        cursor.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+        applied.append((version, name))
+    return applied
+
+
+def downgrade(cursor, steps=1, folder=MIGRATIONS_FOLDER):
+    """
+    Revert the last steps applied migrations, newest first.
+
+    Returns:
+        list: (version, name) of the migrations reverted.
+
+    Raises:
+        MigrationError: If an applied version has no down script or no files at all.
+    """
+    migrations = {version: (name, down_path) for version, name, _, down_path in discover(folder)}
+    reverted = []
+    for version in reversed(applied_versions(cursor)[-steps:] if steps > 0 else []):
+        if version not in migrations:
+            raise MigrationError(f"Migration {version} is applied but its files are missing")
+        name, down_path = migrations[version]
+        if down_path is None:
+            raise MigrationError(f"Migration {version}_{name} has no down script")
+        _run_script(cursor, down_path)
+        cursor.execute("DELETE FROM schema_migrations WHERE version = %s", (version,))
+        reverted.append((version, name))
+    return reverted
+
+
+def status(cursor, folder=MIGRATIONS_FOLDER):
+    """
+    State of every migration.
+
+    Returns:
+        list: (version, name, applied) tuples ordered by version.
+    """
+    done = set(applied_versions(cursor))
+    return [(version, name, version in done) for version, name, _, _ in discover(folder)]
@@ -0,0 +1,98 @@
+"""Helper for keyset (cursor) pagination"""
+import base64
+import json
+from flask import request, jsonify
+from werkzeug.exceptions import BadRequest
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+
+
+def encode_cursor(position):
+    """
+    Encode a keyset position into an opaque cursor token.
+
+    Args:
+        position (dict): Values of the sort key of the last row served.
+
+    Returns:
+        str: URL safe token to hand back to the client as next_cursor.
+    """
+    raw = json.dumps(position, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def parse_cursor(token):
+    """
+    Framework independent part of decode_cursor, also used by the async read endpoints.
+
+    Raises:
+        ValueError: If the token is malformed.
+    """
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        position = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, TypeError) as exc:
+        raise ValueError("Invalid cursor") from exc
+    if not isinstance(position, dict):
+        raise ValueError("Invalid cursor")
+    return position
+
+
+def parse_limit(value, default_limit=DEFAULT_LIMIT, max_limit=MAX_LIMIT):
+    """
+    Limit from a raw query parameter, default_limit when it is missing.
+
+    Raises:
+        ValueError: If it is not a positive integer.
+    """
+    if value is None:
+        return default_limit
+    limit = int(value)
+    if limit < 1:
+        raise ValueError("limit must be a positive integer")
+    return min(limit, max_limit)
+
+
+def _bad_request(err_message):
+    """BadRequest carrying a 400 JSON body, jsonify alone would answer 200"""
+    response = jsonify({"err_message": err_message})
+    response.status_code = 400
+    return BadRequest(response=response)
+
+
+def decode_cursor(token):
+    """
+    Decode a cursor token produced by encode_cursor.
+
+    Raises:
+        BadRequest: If the token is malformed.
+    """
+    try:
+        return parse_cursor(token)
+    except ValueError as exc:
+        raise _bad_request("Invalid cursor") from exc
+
+
+def get_page_args(default_limit=DEFAULT_LIMIT, max_limit=MAX_LIMIT):
+    """
+    Read the limit and cursor query parameters of the current request.
+
+    Args:
+        default_limit (int): Limit used when the client does not send one, None for no limit.
+        max_limit (int): Upper bound applied to the client supplied limit.
+
+    Returns:
+        tuple: (limit, position) where position is None for the first page.
+
+    Raises:
+        BadRequest: If limit is not a positive integer or the cursor is malformed.
+    """
+    try:
+        limit = parse_limit(request.args.get('limit'), default_limit, max_limit)
+    except ValueError as exc:
+        raise _bad_request("limit must be a positive integer") from exc
+
+    token = request.args.get('cursor')
+    position = decode_cursor(token) if token else None
+    return limit, position
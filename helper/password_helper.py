@@ -0,0 +1,87 @@
+"""Password hashing on a bounded process pool, so bcrypt never runs on a request thread"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import bcrypt
+
+
+class PasswordHashBusy(Exception):
+    """Raised when every hashing slot stays taken for longer than PASSWORD_HASH_TIMEOUT"""
+
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+_settings = {}
+_slots = None
+
+
+def _load_settings():
+    """Read the settings when the pool is first used, after the app loaded its .env"""
+    workers = int(os.environ.get('PASSWORD_HASH_WORKERS', min(os.cpu_count() or 1, 4)))
+    _settings.update({
+        "log_rounds": int(os.environ.get('BCRYPT_LOG_ROUNDS', 12)),
+        "workers": workers,
+        # Hashes queued or running at once, beyond that a request waits up to `timeout` seconds
+        "concurrency": int(os.environ.get('PASSWORD_HASH_CONCURRENCY', workers * 2)),
+        "timeout": float(os.environ.get('PASSWORD_HASH_TIMEOUT', 5)),
+    })
+
+
+def _get_executor():
+    """Process pool of the current process, created on first use so forked workers get their own"""
+    global _executor, _executor_pid, _slots  # pylint: disable=global-statement
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _load_settings()
+            # spawn: the children must not inherit the locks and sockets of a threaded server
+            _executor = ProcessPoolExecutor(max_workers=_settings["workers"],
+                                            mp_context=multiprocessing.get_context('spawn'))
+            _executor_pid = os.getpid()
+            _slots = threading.BoundedSemaphore(_settings["concurrency"])
+    return _executor
+
+
+def _hash_in_worker(password, log_rounds):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(log_rounds)).decode('utf-8')
+
+
+def _check_in_worker(hashed, password):
+    try:
+        return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+    except ValueError:  # not a bcrypt hash
+        return False
+
+
+def _run(function, *args):
+    """Run function on the pool, waiting for a free slot at most PASSWORD_HASH_TIMEOUT seconds"""
+    executor = _get_executor()
+    if not _slots.acquire(timeout=_settings["timeout"]):
+        raise PasswordHashBusy("Too many password hashes in progress")
+    try:
+        return executor.submit(function, *args).result()
+    finally:
+        _slots.release()
+
+
+def hash_password(password):
+    """Hash a password with the configured BCRYPT_LOG_ROUNDS"""
+    _get_executor()
+    return _run(_hash_in_worker, password, _settings["log_rounds"])
+
+
+def check_password(hashed, password):
+    """Check a password against a stored bcrypt hash"""
+    if not hashed:
+        return False
+    return _run(_check_in_worker, hashed, password)
+
+
+def needs_rehash(hashed):
+    """True when a stored hash was made with another work factor than BCRYPT_LOG_ROUNDS"""
+    _get_executor()
+    try:
+        return int(hashed.split('$')[2]) != _settings["log_rounds"]
+    except (IndexError, ValueError):
+        return True
@@ -0,0 +1,43 @@
+"""Helper to maintain the denormalized rating aggregates on instruments"""
+
+# Average rating read straight from the aggregates, same shape as COALESCE(AVG(r.rating), 0)
+AVERAGE_RATING_SQL = "COALESCE(i.rating_sum / NULLIF(i.rating_count, 0), 0)"
+
+
+def apply_rating(cursor, instrument_id, rating, count):
+    """
+    Add a rating delta to the running aggregates of an instrument.
+
+    Args:
+        cursor: Cursor running inside the same transaction as the review change.
+        instrument_id (int): Instrument the review belongs to.
+        rating (int): Rating to add (negative when a review is removed).
+        count (int): Number of reviews to add (1 on insert, -1 on delete).
+    """
+    update_query = """
+        UPDATE instruments
+        SET rating_sum = rating_sum + %s, rating_count = rating_count + %s
+        WHERE instrument_id = %s
+    """
+    cursor.execute(update_query, (rating, count, instrument_id))
+
+
+def rebuild_rating_aggregates(cursor):
+    """
+    Recompute rating_sum and rating_count of every instrument from the reviews table.
+
+    Returns:
+        int: Number of instrument rows touched by the rebuild.
+    """
+    rebuild_query = """
+        UPDATE instruments i
+        LEFT JOIN (
+            SELECT instrument_id, SUM(rating) AS rating_sum, COUNT(*) AS rating_count
+            FROM reviews
+            GROUP BY instrument_id
+        ) r ON r.instrument_id = i.instrument_id
+        SET i.rating_sum = COALESCE(r.rating_sum, 0),
+            i.rating_count = COALESCE(r.rating_count, 0)
+    """
+    cursor.execute(rebuild_query)
+    return cursor.rowcount
@@ -0,0 +1,167 @@
+"""Batch recommendations: user x instrument type affinities scored against the available instruments
+
+Run `flask --app app build-recommendations` periodically (e.g. from cron). Each user's top-K list is
+stored in the `recommendations` table at positions 1..K, so serving it is a primary key range read.
+"""
+import os
+import time
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional, only the batch job needs it
+    np = None
+
+RECOMMENDATION_TOP_K = int(os.environ.get('RECOMMENDATION_TOP_K', 100))
+USER_CHUNK_SIZE = 256
+# Scratch memory of one chunk of users, the chunk shrinks below USER_CHUNK_SIZE as instruments grow
+RECOMMENDATION_MEMORY_MB = int(os.environ.get('RECOMMENDATION_MEMORY_MB', 64))
+# per user and candidate: a float32 score and the int64 index argpartition returns
+BYTES_PER_SCORE = 4 + 8
+# position of the instruments without a recommendation when the feed is sorted by position
+UNRANKED = 2147483647
+# How much each interaction says about a user's interest in an instrument type
+LOAN_REQUEST_WEIGHT = 1.0
+LOAN_WEIGHT = 2.0
+REVIEW_WEIGHT = 0.5  # per star above (or below) the middle of the 0-5 scale
+# Bayesian prior of the rating score: PRIOR_COUNT virtual reviews of PRIOR_RATING stars
+PRIOR_RATING = 3.0
+PRIOR_COUNT = 5
+
+
+def _interactions(cursor):
+    """(user_id, instrument_type_id, weight) rows of every signal"""
+    cursor.execute(f"""
+        SELECT lr.requester_id, i.instrument_type_id, COUNT(*) * {LOAN_REQUEST_WEIGHT}
+        FROM loanrequests lr JOIN instruments i ON i.instrument_id = lr.instrument_id
+        GROUP BY lr.requester_id, i.instrument_type_id
+        UNION ALL
+        SELECT l.borrower_id, i.instrument_type_id, COUNT(*) * {LOAN_WEIGHT}
+        FROM loans l JOIN instruments i ON i.instrument_id = l.instrument_id
+        GROUP BY l.borrower_id, i.instrument_type_id
+        UNION ALL
+        SELECT r.user_id, i.instrument_type_id, SUM(r.rating - 2.5) * {REVIEW_WEIGHT}
+        FROM reviews r JOIN instruments i ON i.instrument_id = r.instrument_id
+        GROUP BY r.user_id, i.instrument_type_id
+    """)
+    return cursor.fetchall()
+
+
+def _affinities(user_ids, type_ids, interactions):
+    """
+    L2 normalized user x type affinity matrix.
+
+    Users without any signal get the mean affinity of everybody, i.e. plain popularity.
+    """
+    user_index = {user_id: n for n, user_id in enumerate(user_ids)}
+    type_index = {type_id: n for n, type_id in enumerate(type_ids)}
+    affinity = np.zeros((len(user_ids), len(type_ids)), dtype=np.float32)
+    rows = [(user_index[u], type_index[t], float(w)) for u, t, w in interactions
+            if u in user_index and t in type_index]
+    if rows:
+        users, types, weights = (np.array(column) for column in zip(*rows))
+        np.add.at(affinity, (users.astype(int), types.astype(int)), weights)
+    np.clip(affinity, 0, None, out=affinity)
+    norms = np.linalg.norm(affinity, axis=1, keepdims=True)
+    has_signal = norms[:, 0] > 0
+    affinity[has_signal] /= norms[has_signal]
+    popularity = affinity[has_signal].mean(axis=0) if has_signal.any() else np.ones(len(type_ids), dtype=np.float32)
+    affinity[~has_signal] = popularity / (np.linalg.norm(popularity) or 1)
+    return affinity
+
+
+def build_recommendations(cursor_factory, top_k=RECOMMENDATION_TOP_K):
+    """
+    Rebuild the top-K recommendations of every user.
+
+    Score of an instrument for a user: affinity of the user for its type times its Bayesian
+    average rating, own instruments and instruments the user already asked for excluded.
+
+    Args:
+        cursor_factory: Context manager yielding a cursor in a transaction, e.g. db_transaction.
+            Each chunk of users is written in its own transaction so readers never wait long.
+
+    Returns:
+        dict: users, candidates and rows written, and the duration in seconds.
+    """
+    if np is None:
+        raise RuntimeError("NumPy is required to build recommendations, pip install numpy")
+    started = time.monotonic()
+
+    with cursor_factory() as cursor:
+        cursor.execute("SELECT user_id FROM users")
+        user_ids = [row[0] for row in cursor.fetchall()]
+        cursor.execute("SELECT id FROM instrument_type")
+        type_ids = [row[0] for row in cursor.fetchall()]
+        cursor.execute("""
+            SELECT instrument_id, owner_id, instrument_type_id, rating_sum, rating_count
+            FROM instruments WHERE availability_status IN (1, 2)
+        """)
+        candidates = cursor.fetchall()
+        interactions = _interactions(cursor)
+        cursor.execute("""
+            SELECT requester_id, instrument_id FROM loanrequests
+            UNION SELECT borrower_id, instrument_id FROM loans
+        """)
+        seen = cursor.fetchall()
+
+    report = {"users": len(user_ids), "candidates": len(candidates), "rows": 0}
+    if not user_ids or not candidates or not type_ids:
+        report["seconds"] = round(time.monotonic() - started, 3)
+        return report
+
+    affinity = _affinities(user_ids, type_ids, interactions)
+    type_index = {type_id: n for n, type_id in enumerate(type_ids)}
+    instrument_ids = np.array([row[0] for row in candidates])
+    types = np.array([type_index.get(row[2], 0) for row in candidates])
+    rating_sum = np.array([float(row[3] or 0) for row in candidates])
+    rating_count = np.array([float(row[4] or 0) for row in candidates])
+    quality = ((rating_sum + PRIOR_RATING * PRIOR_COUNT) / (rating_count + PRIOR_COUNT) / 5.0).astype(np.float32)
+
+    # Candidate columns each user must not get: own instruments and the ones already asked for or borrowed
+    candidate_index = {instrument_id: n for n, instrument_id in enumerate(instrument_ids.tolist())}
+    excluded_by_user = {}
+    for n, candidate in enumerate(candidates):
+        excluded_by_user.setdefault(candidate[1], []).append(n)
+    for user_id, instrument_id in seen:
+        if instrument_id in candidate_index:
+            excluded_by_user.setdefault(user_id, []).append(candidate_index[instrument_id])
+
+    k = min(top_k, len(candidates))
+    chunk_size = max(1, min(USER_CHUNK_SIZE,
+                             RECOMMENDATION_MEMORY_MB * 2 ** 20 // (BYTES_PER_SCORE * len(candidates))))
+    buffer = np.empty((min(chunk_size, len(user_ids)), len(candidates)), dtype=np.float32)
+    for start in range(0, len(user_ids), chunk_size):
+        chunk = user_ids[start:start + chunk_size]
+        # Negated scores, built in place so the smallest values are the best candidates
+        scores = buffer[:len(chunk)]
+        np.take(affinity[start:start + len(chunk)], types, axis=1, out=scores, mode='clip')
+        scores *= -quality
+        for row, user_id in enumerate(chunk):
+            scores[row, excluded_by_user.get(user_id, [])] = np.inf
+
+        top = np.argpartition(scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(top_scores, axis=1, kind='stable')
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = -np.take_along_axis(top_scores, order, axis=1)
+
+        rows = []
+        for row, user_id in enumerate(chunk):
+            position = 0
+            for column, score in zip(top[row].tolist(), top_scores[row].tolist()):
+                if score == -np.inf:
+                    break
+                position += 1
+                rows.append((user_id, position, int(instrument_ids[column]), round(score, 6)))
+
+        with cursor_factory() as cursor:
+            placeholders = ', '.join(['%s'] * len(chunk))
+            cursor.execute(f"DELETE FROM recommendations WHERE user_id IN ({placeholders})", chunk)
+            if rows:
+                cursor.executemany("""
+                    INSERT INTO recommendations (user_id, position, instrument_id, score) VALUES (%s, %s, %s, %s)
+                """, rows)
+        report["rows"] += len(rows)
+
+    report["seconds"] = round(time.monotonic() - started, 3)
+    return report
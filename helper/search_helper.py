@@ -0,0 +1,26 @@
+"""Helper for the FULLTEXT instrument search"""
+import re
+
+# Must list exactly the columns of the ft_instruments_search index (migrations/0005_instrument_search.up.sql)
+SEARCH_COLUMNS = "i.instrument_name, i.description, i.location, i.type_name"
+MATCH_SQL = f"MATCH({SEARCH_COLUMNS}) AGAINST(%s IN BOOLEAN MODE)"
+# instruments.type_name copies instrument_type.name so one index covers the type too
+TYPE_NAME_SQL = "(SELECT name FROM instrument_type WHERE id = %s)"
+
+MIN_TERM_LENGTH = 3  # innodb_ft_min_token_size, shorter words are not indexed
+MAX_TERMS = 8
+
+_TERM = re.compile(r'\w+')
+
+
+def boolean_query(text):
+    """
+    Turn free text into a BOOLEAN MODE query: every word is required and matches as a prefix.
+
+    Only word characters are kept, so user input cannot inject boolean operators.
+
+    Returns:
+        str: e.g. '+gita* +bandung*', empty when no word is long enough to be indexed.
+    """
+    terms = [term for term in _TERM.findall(text.lower()) if len(term) >= MIN_TERM_LENGTH]
+    return ' '.join(f'+{term}*' for term in terms[:MAX_TERMS])
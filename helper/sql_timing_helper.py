@@ -0,0 +1,229 @@
+"""Per-request SQL instrumentation: Server-Timing header and slow-query log"""
+import json
+import logging
+import os
+import re
+import time
+from contextvars import ContextVar
+from flask import g, has_request_context, request
+
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 100))
+SERVER_TIMING_MAX_STATEMENTS = 10  # keep the header small on chatty handlers
+
+slow_query_logger = logging.getLogger('slow_query')
+
+# (endpoint, SQL timings list) of the async request being handled, see start_async_sql_timing
+_async_request = ContextVar('async_sql_timing', default=None)
+
+_WHITESPACE = re.compile(r'\s+')
+_LITERALS = re.compile(r"'(?:[^'\\]|\\.)*'|\b\d+(?:\.\d+)?\b|%s")
+
+
+def normalize_sql(statement):
+    """Collapse whitespace and replace literals and placeholders with ?"""
+    if isinstance(statement, (bytes, bytearray)):
+        statement = statement.decode('utf-8', 'replace')
+    return _LITERALS.sub('?', _WHITESPACE.sub(' ', statement).strip())
+
+
+def _request_timings():
+    """SQL timings list of the current request, None outside a timed request"""
+    if has_request_context():
+        return g.get('sql_timings')
+    async_request = _async_request.get()
+    return async_request[1] if async_request else None
+
+
+def _request_endpoint():
+    if has_request_context():
+        return request.endpoint
+    async_request = _async_request.get()
+    return async_request[0] if async_request else None
+
+
+def _log_if_slow(statement, duration):
+    if duration * 1000 >= SLOW_QUERY_MS:
+        slow_query_logger.warning(json.dumps({
+            "event": "slow_query",
+            "duration_ms": round(duration * 1000, 3),
+            "statement": normalize_sql(statement),
+            "endpoint": _request_endpoint(),
+        }))
+
+
+class TimedCursor:
+    """
+    Cursor wrapper timing each statement, everything else is delegated to the wrapped cursor.
+
+    A statement's time runs from execute/executemany through the fetches of its rows, so the
+    server time of unbuffered cursors, spent while the rows are read, is counted too. The slow
+    query log sees the total once the next statement starts or the cursor is closed.
+    """
+
+    __slots__ = ('_cursor', '_statement', '_elapsed', '_timings', '_slot')
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self._statement = None
+        self._elapsed = 0.0
+        self._timings = None
+        self._slot = None
+
+    def _begin(self, operation, duration):
+        self._finish()
+        self._statement = operation
+        self._elapsed = duration
+        self._timings = _request_timings()
+        if self._timings is not None:
+            self._slot = len(self._timings)
+            self._timings.append(duration)
+
+    def _add(self, duration):
+        self._elapsed += duration
+        if self._timings is not None:
+            self._timings[self._slot] += duration
+
+    def _finish(self):
+        if self._statement is not None:
+            _log_if_slow(self._statement, self._elapsed)
+            self._statement = None
+
+    def execute(self, operation, params=None, *args, **kwargs):
+        """Execute and record the time spent on the round trip"""
+        started = time.perf_counter()
+        try:
+            return self._cursor.execute(operation, params, *args, **kwargs)
+        finally:
+            self._begin(operation, time.perf_counter() - started)
+
+    def executemany(self, operation, seq_params, *args, **kwargs):
+        """Execute for every set of parameters, timed as one statement"""
+        started = time.perf_counter()
+        try:
+            return self._cursor.executemany(operation, seq_params, *args, **kwargs)
+        finally:
+            self._begin(operation, time.perf_counter() - started)
+
+    def fetchone(self):
+        started = time.perf_counter()
+        try:
+            return self._cursor.fetchone()
+        finally:
+            self._add(time.perf_counter() - started)
+
+    def fetchmany(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return self._cursor.fetchmany(*args, **kwargs)
+        finally:
+            self._add(time.perf_counter() - started)
+
+    def fetchall(self):
+        started = time.perf_counter()
+        try:
+            return self._cursor.fetchall()
+        finally:
+            self._add(time.perf_counter() - started)
+
+    def close(self):
+        self._finish()
+        return self._cursor.close()
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class TimedAsyncCursor(TimedCursor):
+    """TimedCursor of an aiomysql cursor, the round trips are awaited"""
+
+    __slots__ = ()
+
+    async def execute(self, operation, params=None, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await self._cursor.execute(operation, params, *args, **kwargs)
+        finally:
+            self._begin(operation, time.perf_counter() - started)
+
+    async def executemany(self, operation, seq_params, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await self._cursor.executemany(operation, seq_params, *args, **kwargs)
+        finally:
+            self._begin(operation, time.perf_counter() - started)
+
+    async def fetchone(self):
+        started = time.perf_counter()
+        try:
+            return await self._cursor.fetchone()
+        finally:
+            self._add(time.perf_counter() - started)
+
+    async def fetchmany(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await self._cursor.fetchmany(*args, **kwargs)
+        finally:
+            self._add(time.perf_counter() - started)
+
+    async def fetchall(self):
+        started = time.perf_counter()
+        try:
+            return await self._cursor.fetchall()
+        finally:
+            self._add(time.perf_counter() - started)
+
+    async def close(self):
+        self._finish()
+        return await self._cursor.close()
+
+    def __iter__(self):
+        raise TypeError("TimedAsyncCursor is not iterable, await fetchone/fetchmany/fetchall")
+
+
+def start_async_sql_timing(endpoint):
+    """
+    Collect the SQL timings of the async request handled in the current context, the ASGI
+    counterpart of the before_request hook of init_sql_timing.
+
+    Returns:
+        tuple: (timings list filled by TimedAsyncCursor, token for finish_async_sql_timing)
+    """
+    timings = []
+    return timings, _async_request.set((endpoint, timings))
+
+
+def finish_async_sql_timing(token):
+    """Stop collecting, token from start_async_sql_timing"""
+    _async_request.reset(token)
+
+
+def server_timing(total, timings):
+    """Server-Timing header value of a request that took total seconds and ran these statements"""
+    entries = [
+        f'app;dur={total * 1000:.2f}',
+        f'db;dur={sum(timings) * 1000:.2f};desc="{len(timings)} queries"',
+    ]
+    entries.extend(f'sql-{index};dur={duration * 1000:.2f}'
+                   for index, duration in enumerate(timings[:SERVER_TIMING_MAX_STATEMENTS], start=1))
+    return ', '.join(entries)
+
+
+def init_sql_timing(app):
+    """Register the request hooks that collect the SQL timings and emit the Server-Timing header"""
+
+    @app.before_request
+    def start_sql_timing():
+        g.sql_timings = []
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def add_server_timing(response):
+        timings = g.get('sql_timings')
+        if timings is None:
+            return response
+        response.headers.add('Server-Timing', server_timing(time.perf_counter() - g.request_started, timings))
+        return response
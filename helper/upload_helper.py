@@ -0,0 +1,141 @@
+"""Streaming image uploads: per-route size limits and magic-byte sniffing while the body is parsed"""
+import hashlib
+import os
+import uuid
+from functools import wraps
+from flask import Request, current_app, jsonify, make_response, request
+from werkzeug.exceptions import RequestEntityTooLarge, UnsupportedMediaType
+from helper.image_storage import STORAGE_ROOT, TMP_FOLDER, commit_file
+
+# Magic bytes of the accepted image types and the extension they are stored with
+IMAGE_SIGNATURES = [
+    (b'\xff\xd8\xff', '.jpg'),
+    (b'\x89PNG\r\n\x1a\n', '.png'),
+    (b'GIF87a', '.gif'),
+    (b'GIF89a', '.gif'),
+]
+SNIFF_BYTES = 16
+
+
+def sniff_image_type(header):
+    """
+    Detect the image type from the first bytes of a file.
+
+    Returns:
+        str: Extension including the dot, or None when the bytes are not an accepted image.
+    """
+    for signature, extension in IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return extension
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return '.webp'
+    return None
+
+
+def _error(status, exception_class, message):
+    """HTTP exception carrying the repo's JSON error body"""
+    return exception_class(response=make_response(jsonify({"message": message}), status))
+
+
+class SniffedUpload:
+    """
+    Writable spool for one uploaded file, created by the form parser.
+
+    It writes straight into the storage temp folder while hashing, and rejects the upload as soon
+    as the first bytes are not an accepted image, before the rest of the body is read.
+    """
+
+    def __init__(self):
+        tmp_dir = os.path.join(STORAGE_ROOT, TMP_FOLDER)
+        os.makedirs(tmp_dir, exist_ok=True)
+        self.path = os.path.join(tmp_dir, uuid.uuid4().hex)
+        self.extension = None
+        self._file = open(self.path, 'w+b')  # pylint: disable=consider-using-with
+        self._digest = hashlib.sha256()
+        self._header = b''
+
+    def write(self, data):
+        """Called by the multipart parser for every chunk of the file"""
+        if self.extension is None:
+            self._header += data[:SNIFF_BYTES]
+            if len(self._header) >= SNIFF_BYTES:
+                self._check_type()
+        self._digest.update(data)
+        return self._file.write(data)
+
+    def _check_type(self):
+        """Reject the upload unless its first bytes are an accepted image signature"""
+        self.extension = sniff_image_type(self._header)
+        if self.extension is None:
+            self.close()
+            raise _error(415, UnsupportedMediaType, "Only JPEG, PNG, GIF and WebP images are accepted.")
+
+    def seek(self, offset, whence=0):
+        """The parser seeks back to 0 once the file is complete, short files are checked then"""
+        if self.extension is None and self._header:
+            self._check_type()
+        return self._file.seek(offset, whence)
+
+    def hexdigest(self):
+        """SHA-256 of the content written so far"""
+        return self._digest.hexdigest()
+
+    def read(self, *args):
+        """Read back the spooled content"""
+        return self._file.read(*args)
+
+    def readline(self, *args):
+        """Read back one line of the spooled content"""
+        return self._file.readline(*args)
+
+    def tell(self):
+        """Current position in the spool"""
+        return self._file.tell()
+
+    def commit(self):
+        """
+        Move the spooled file to its content address.
+
+        Returns:
+            str: Storage key, see helper.image_storage.store_stream.
+        """
+        if self.extension is None:
+            # Empty file part
+            self.close()
+            raise _error(415, UnsupportedMediaType, "Only JPEG, PNG, GIF and WebP images are accepted.")
+        self._file.close()
+        return commit_file(self.path, self.hexdigest(), self.extension)
+
+    def close(self):
+        """Close the spool and drop its temp file unless it was moved into storage"""
+        if not self._file.closed:
+            self._file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class UploadRequest(Request):
+    """Request class whose file uploads are sniffed and spooled into image storage while parsed"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return SniffedUpload()
+
+
+def upload_limit(config_key):
+    """
+    Limit the request body size of an upload route to the number of bytes in app.config[config_key].
+
+    The Content-Length is checked before anything is read, bodies without one are cut off by
+    the form parser as soon as they pass the limit. Either way the handler never runs, so no
+    DB connection is taken for a rejected upload.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            max_bytes = current_app.config[config_key]
+            if request.content_length is not None and request.content_length > max_bytes:
+                raise _error(413, RequestEntityTooLarge, f"Upload exceeds {max_bytes} bytes.")
+            request.max_content_length = max_bytes
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,6 @@
+DROP TABLE IF EXISTS `reviews`;
+DROP TABLE IF EXISTS `loans`;
+DROP TABLE IF EXISTS `loanrequests`;
+DROP TABLE IF EXISTS `instruments`;
+DROP TABLE IF EXISTS `instrument_type`;
+DROP TABLE IF EXISTS `users`;
@@ -0,0 +1,81 @@
+-- Schema of the app before the migrations existed: the tables and columns the original endpoints query.
+-- Existing databases that already have these tables: `flask --app app db-migrate --baseline --to 1`,
+-- then `flask --app app db-migrate` applies the later migrations.
+
+CREATE TABLE `users` (
+  `user_id` int NOT NULL AUTO_INCREMENT,
+  `username` varchar(255) NOT NULL,
+  `password` varchar(255) NOT NULL,
+  `email` varchar(255) DEFAULT NULL,
+  `full_name` varchar(255) DEFAULT NULL,
+  `phone` varchar(32) DEFAULT NULL,
+  `profile_picture` varchar(255) DEFAULT NULL,
+  `roles` varchar(255) DEFAULT NULL,
+  `created_at` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`user_id`),
+  UNIQUE KEY `uq_users_username` (`username`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+
+CREATE TABLE `instrument_type` (
+  `id` int NOT NULL AUTO_INCREMENT,
+  `name` varchar(255) NOT NULL,
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `uq_instrument_type_name` (`name`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+
+-- The single column keys are the ones the foreign keys need, later migrations replace some of them
+-- with the composite keys of the hot queries.
+CREATE TABLE `instruments` (
+  `instrument_id` int NOT NULL AUTO_INCREMENT,
+  `owner_id` int NOT NULL,
+  `instrument_name` varchar(255) NOT NULL,
+  `description` text,
+  `location` varchar(255) DEFAULT NULL,
+  `instrument_type_id` int NOT NULL,
+  `availability_status` tinyint NOT NULL DEFAULT 1,
+  `image` varchar(255) DEFAULT NULL,
+  PRIMARY KEY (`instrument_id`),
+  KEY `idx_instruments_owner` (`owner_id`),
+  KEY `idx_instruments_type` (`instrument_type_id`),
+  CONSTRAINT `fk_instruments_owner` FOREIGN KEY (`owner_id`) REFERENCES `users` (`user_id`) ON DELETE CASCADE,
+  CONSTRAINT `fk_instruments_type` FOREIGN KEY (`instrument_type_id`) REFERENCES `instrument_type` (`id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+
+CREATE TABLE `loanrequests` (
+  `request_id` int NOT NULL AUTO_INCREMENT,
+  `instrument_id` int NOT NULL,
+  `requester_id` int NOT NULL,
+  `request_date` datetime NOT NULL,
+  `message` text,
+  PRIMARY KEY (`request_id`),
+  KEY `idx_loanrequests_instrument` (`instrument_id`),
+  KEY `idx_loanrequests_requester` (`requester_id`),
+  CONSTRAINT `fk_loanrequests_instrument` FOREIGN KEY (`instrument_id`) REFERENCES `instruments` (`instrument_id`) ON DELETE CASCADE,
+  CONSTRAINT `fk_loanrequests_requester` FOREIGN KEY (`requester_id`) REFERENCES `users` (`user_id`) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+
+CREATE TABLE `loans` (
+  `loan_id` int NOT NULL AUTO_INCREMENT,
+  `instrument_id` int NOT NULL,
+  `borrower_id` int NOT NULL,
+  `loan_date` datetime NOT NULL,
+  PRIMARY KEY (`loan_id`),
+  KEY `idx_loans_instrument` (`instrument_id`),
+  KEY `idx_loans_borrower` (`borrower_id`),
+  CONSTRAINT `fk_loans_instrument` FOREIGN KEY (`instrument_id`) REFERENCES `instruments` (`instrument_id`) ON DELETE CASCADE,
+  CONSTRAINT `fk_loans_borrower` FOREIGN KEY (`borrower_id`) REFERENCES `users` (`user_id`) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+
+CREATE TABLE `reviews` (
+  `review_id` int NOT NULL AUTO_INCREMENT,
+  `instrument_id` int NOT NULL,
+  `user_id` int NOT NULL,
+  `rating` tinyint NOT NULL,
+  `comment` text,
+  `review_date` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`review_id`),
+  KEY `idx_reviews_instrument` (`instrument_id`),
+  KEY `idx_reviews_user` (`user_id`),
+  CONSTRAINT `fk_reviews_instrument` FOREIGN KEY (`instrument_id`) REFERENCES `instruments` (`instrument_id`) ON DELETE CASCADE,
+  CONSTRAINT `fk_reviews_user` FOREIGN KEY (`user_id`) REFERENCES `users` (`user_id`) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
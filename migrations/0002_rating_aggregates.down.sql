@@ -0,0 +1,3 @@
+ALTER TABLE `instruments`
+  DROP COLUMN `rating_sum`,
+  DROP COLUMN `rating_count`;
@@ -0,0 +1,15 @@
+-- Denormalized rating aggregates read by the instrument listings, kept by add_review/delete_review
+-- (helper/rating_helper.py). `flask --app app rebuild-ratings` recomputes them.
+
+ALTER TABLE `instruments`
+  ADD COLUMN `rating_sum` int NOT NULL DEFAULT 0,
+  ADD COLUMN `rating_count` int NOT NULL DEFAULT 0;
+
+UPDATE `instruments` i
+LEFT JOIN (
+  SELECT instrument_id, SUM(rating) AS rating_sum, COUNT(*) AS rating_count
+  FROM `reviews`
+  GROUP BY instrument_id
+) r ON r.instrument_id = i.instrument_id
+SET i.rating_sum = COALESCE(r.rating_sum, 0),
+    i.rating_count = COALESCE(r.rating_count, 0);
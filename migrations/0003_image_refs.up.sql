@@ -0,0 +1,9 @@
+-- Reference counts of the content-addressed images (instruments.image, users.profile_picture), see
+-- helper/image_storage.py. Then `flask --app app migrate-images` moves the flat img/ files into the
+-- sharded layout and counts their references.
+
+CREATE TABLE `image_refs` (
+  `image_key` varchar(255) NOT NULL,
+  `ref_count` int NOT NULL DEFAULT 0,
+  PRIMARY KEY (`image_key`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
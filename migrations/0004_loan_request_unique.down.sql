@@ -0,0 +1,3 @@
+ALTER TABLE `loanrequests`
+  ADD KEY `idx_loanrequests_instrument` (`instrument_id`),
+  DROP KEY `uq_loanrequests_instrument_requester`;
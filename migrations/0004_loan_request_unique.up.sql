@@ -0,0 +1,14 @@
+-- One loan request per (instrument, requester), enforced by the database.
+-- create_loan_request relies on this key to reject double taps atomically.
+
+-- Keep the oldest of the duplicate requests made before the key existed
+DELETE lr FROM `loanrequests` lr
+JOIN `loanrequests` keep
+  ON keep.instrument_id = lr.instrument_id
+ AND keep.requester_id = lr.requester_id
+ AND keep.request_id < lr.request_id;
+
+-- The unique key also serves the lookups by instrument_id and the browse feed's anti-join
+ALTER TABLE `loanrequests`
+  ADD UNIQUE KEY `uq_loanrequests_instrument_requester` (`instrument_id`, `requester_id`),
+  DROP KEY `idx_loanrequests_instrument`;
@@ -0,0 +1,3 @@
+ALTER TABLE `instruments`
+  DROP KEY `ft_instruments_search`,
+  DROP COLUMN `type_name`;
@@ -0,0 +1,12 @@
+-- FULLTEXT search over instruments (GET /api/v1/instruments/search), see helper/search_helper.py.
+-- type_name copies instrument_type.name so a single index covers the type; add/update_instrument keep it in sync.
+
+ALTER TABLE `instruments`
+  ADD COLUMN `type_name` varchar(255) DEFAULT NULL;
+
+UPDATE `instruments` i
+JOIN `instrument_type` it ON it.id = i.instrument_type_id
+SET i.type_name = it.name;
+
+ALTER TABLE `instruments`
+  ADD FULLTEXT KEY `ft_instruments_search` (`instrument_name`, `description`, `location`, `type_name`);
@@ -0,0 +1,5 @@
+ALTER TABLE `instruments`
+  DROP KEY `idx_instruments_geohash`,
+  DROP COLUMN `latitude`,
+  DROP COLUMN `longitude`,
+  DROP COLUMN `geohash`;
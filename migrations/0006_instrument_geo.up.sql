@@ -0,0 +1,8 @@
+-- Coordinates of the instruments for the proximity search (GET /api/v1/instruments/nearby/<user_id>),
+-- see helper/geo_helper.py. Then `flask --app app geocode-instruments` places the existing rows.
+
+ALTER TABLE `instruments`
+  ADD COLUMN `latitude` decimal(9,6) DEFAULT NULL,
+  ADD COLUMN `longitude` decimal(9,6) DEFAULT NULL,
+  ADD COLUMN `geohash` varchar(12) DEFAULT NULL,
+  ADD KEY `idx_instruments_geohash` (`geohash`);
@@ -0,0 +1,12 @@
+-- Top-K recommendations per user, rebuilt by `flask --app app build-recommendations`
+-- (helper/recommendation_helper.py). The primary key serves a user's list and the ranked half of
+-- the feed's sort=recommended in position order, the second key the anti-join of its unranked half.
+
+CREATE TABLE `recommendations` (
+  `user_id` int NOT NULL,
+  `position` int NOT NULL,
+  `instrument_id` int NOT NULL,
+  `score` double NOT NULL,
+  PRIMARY KEY (`user_id`, `position`),
+  UNIQUE KEY `uq_recommendations_user_instrument` (`user_id`, `instrument_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
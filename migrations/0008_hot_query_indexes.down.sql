@@ -0,0 +1,15 @@
+ALTER TABLE `reviews`
+  ADD KEY `idx_reviews_instrument` (`instrument_id`),
+  DROP KEY `uq_reviews_instrument_user`;
+
+ALTER TABLE `loans`
+  ADD KEY `idx_loans_borrower` (`borrower_id`),
+  DROP KEY `idx_loans_borrower_instrument`;
+
+ALTER TABLE `loanrequests`
+  ADD KEY `idx_loanrequests_requester` (`requester_id`),
+  DROP KEY `idx_loanrequests_requester_instrument`;
+
+ALTER TABLE `instruments`
+  ADD KEY `idx_instruments_owner` (`owner_id`),
+  DROP KEY `idx_instruments_owner_availability`;
@@ -0,0 +1,38 @@
+-- Composite keys of the hot listings and anti-joins, and one review per user and instrument.
+-- Each replaces the single column key of 0001 it starts with, the foreign keys keep an index.
+
+-- read_instruments_by_user, the dashboard and the owner/availability filters of the feeds
+ALTER TABLE `instruments`
+  ADD KEY `idx_instruments_owner_availability` (`owner_id`, `availability_status`),
+  DROP KEY `idx_instruments_owner`;
+
+-- loan_requests/<user_id>, my_loans and the cache audience
+ALTER TABLE `loanrequests`
+  ADD KEY `idx_loanrequests_requester_instrument` (`requester_id`, `instrument_id`),
+  DROP KEY `idx_loanrequests_requester`;
+
+ALTER TABLE `loans`
+  ADD KEY `idx_loans_borrower_instrument` (`borrower_id`, `instrument_id`),
+  DROP KEY `idx_loans_borrower`;
+
+-- Keep the oldest of the duplicate reviews made before the key existed
+DELETE r FROM `reviews` r
+JOIN `reviews` keep
+  ON keep.instrument_id = r.instrument_id
+ AND keep.user_id = r.user_id
+ AND keep.review_id < r.review_id;
+
+-- add_review relies on this key to reject a second review, it also serves lookups by instrument_id
+ALTER TABLE `reviews`
+  ADD UNIQUE KEY `uq_reviews_instrument_user` (`instrument_id`, `user_id`),
+  DROP KEY `idx_reviews_instrument`;
+
+-- The rating aggregates of 0002 still count the removed duplicates
+UPDATE `instruments` i
+LEFT JOIN (
+  SELECT instrument_id, SUM(rating) AS rating_sum, COUNT(*) AS rating_count
+  FROM `reviews`
+  GROUP BY instrument_id
+) r ON r.instrument_id = i.instrument_id
+SET i.rating_sum = COALESCE(r.rating_sum, 0),
+    i.rating_count = COALESCE(r.rating_count, 0);
@@ -1,11 +1,70 @@
 """Static endpoint to show image"""
-from flask import Blueprint, send_from_directory
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+from flask import Blueprint, abort, current_app, request, send_from_directory
+from werkzeug.security import safe_join
+from helper.image_helper import find_variant
+from helper.image_storage import STORAGE_ROOT
 
 static_file_server = Blueprint('static_file_server', __name__)
-UPLOAD_FOLDER = 'img'
+UPLOAD_FOLDER = STORAGE_ROOT
 
+# Uploads are named after their content hash (legacy ones after a fresh UUID) and never rewritten,
+# so they can be cached forever
+IMMUTABLE_NAME = re.compile(r'^(?:[0-9a-f]{64}|[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})')
+IMMUTABLE_MAX_AGE = int(os.environ.get('IMAGE_MAX_AGE', 31536000))
+# '' serves the bytes from Python, 'x-accel-redirect' hands them to nginx, 'x-sendfile' to Apache/lighttpd
+SENDFILE_MODE = os.environ.get('STATIC_SENDFILE', '').lower()
+ACCEL_REDIRECT_PREFIX = os.environ.get('STATIC_ACCEL_PREFIX', '/protected-img/')
 
-@static_file_server.route("/img/<image_name>", methods=["GET"])
+
+def _send_image(name, cacheable=True):
+    """
+    Send a file of UPLOAD_FOLDER with validators and caching headers.
+
+    Strong ETag, Last-Modified, 304 and Range handling come from send_from_directory, or from
+    the front server when the bytes are offloaded with X-Accel-Redirect / X-Sendfile.
+    """
+    immutable = cacheable and IMMUTABLE_NAME.match(os.path.basename(name)) is not None
+    max_age = IMMUTABLE_MAX_AGE if immutable else None
+
+    if SENDFILE_MODE == 'x-accel-redirect':
+        path = safe_join(UPLOAD_FOLDER, name)
+        if path is None or not os.path.isfile(path):
+            abort(404)
+        response = current_app.response_class(
+            mimetype=mimetypes.guess_type(name)[0] or 'application/octet-stream')
+        response.headers['X-Accel-Redirect'] = ACCEL_REDIRECT_PREFIX + quote(name)
+        if max_age is not None:
+            response.cache_control.max_age = max_age
+    else:
+        # X-Sendfile is switched on through Config.USE_X_SENDFILE
+        response = send_from_directory(UPLOAD_FOLDER, name, conditional=True, etag=True, max_age=max_age)
+
+    if immutable:
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+    return response
+
+
+@static_file_server.route("/img/<path:image_name>", methods=["GET"])
 def show_image(image_name):
-    """Show file"""
-    return send_from_directory(UPLOAD_FOLDER, image_name)
+    """
+    Show file.
+
+    `size` (thumb, medium or full) serves a resized variant, WebP when the client accepts it.
+    The original is served until the variant has been generated.
+    """
+    size = request.args.get('size')
+    if size:
+        extension = 'webp' if request.accept_mimetypes['image/webp'] else 'jpg'
+        variant = find_variant(image_name, size, extension)
+        if variant:
+            response = _send_image(variant)
+            response.vary.add('Accept')
+            return response
+        # Stand-in for a variant that is still being built, must not be cached as final
+        return _send_image(image_name, cacheable=False)
+    return _send_image(image_name)